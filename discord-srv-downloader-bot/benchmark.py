@@ -0,0 +1,597 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark stahovací pipeline bota – bez Discordu a bez sítě.
+
+Lokální HTTP server servíruje syntetická média a náhradu Spotify Web API.
+Úlohy běží skutečnou frontou, yt-dlp, převodem zvuku i úložištěm obsahu,
+Discord nahrazují falešné Interaction/Message. Každá zátěž běží v samostatném
+procesu s vlastní dočasnou datovou složkou, výsledek se zapisuje jako JSON.
+
+Použití:
+    python3 benchmark.py --workloads single,playlist,spotify --items 20 --size-mb 8 --output vysledky.json
+    python3 benchmark.py --baseline vysledky.json   # porovnání s předchozím během
+"""
+import os
+import sys
+import time
+import json
+import types
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.server
+import urllib.parse
+
+try:
+    import resource
+except ImportError:  # Windows – špičková paměť se nezměří
+    resource = None
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKLOADS = ("single", "playlist", "spotify", "mixed")
+SPOTIFY_PLAYLIST_ID = "benchmark"
+SPOTIFY_ARTIST = "Benchmark"
+
+# Metriky pro porovnání s předchozím během: (cesta, vyšší je lepší)
+COMPARED_METRICS = [
+    (("jobs_per_s",), True),
+    (("bytes_per_s",), True),
+    (("ttfb_s", "p50"), False),
+    (("completion_s", "interactive", "p90"), False),
+    (("peak_rss_kib",), False),
+]
+COMPARED_STAGE_PERCENTILES = ("p50", "p90")
+# Kratší časy se neporovnávají – jde o šum měření
+MIN_COMPARED_SECONDS = 0.005
+
+# Plugin yt-dlp, který vyhledávání "ytsearch" odbaví z lokálního serveru (skladba "spotify-00001
+# Benchmark" → /media/spotify-00001.m4a). Vyhledávání tak jde stejnou cestou jako v provozu,
+# jen bez sítě; plugin se načte i v podřízených procesech režimu "process" (přes PYTHONPATH).
+SEARCH_PLUGIN = """
+import os
+from yt_dlp.extractor.common import SearchInfoExtractor
+
+class BenchmarkSearchIE(SearchInfoExtractor):
+    IE_NAME = "benchmark:search"
+    _SEARCH_KEY = "ytsearch"
+
+    def _search_results(self, query):
+        name = query.split()[0]
+        yield self.url_result(f"{os.environ['BENCHMARK_MEDIA_BASE']}/media/{name}.m4a", "Generic", name, name)
+"""
+
+# -------------------------------------------
+# Lokální server médií a Spotify API
+# -------------------------------------------
+class QuietHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # yt-dlp zavírá spojení po extrakci i mezi požadavky – to není chyba
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+class MediaServer:
+    """
+    Servíruje `/media/<název>.<přípona>` (stejná syntetická data pro každý název)
+    a náhradu Spotify Web API pod `/spotify/`. Zaznamenává odeslané bajty a čas
+    prvního bajtu každého požadavku.
+    """
+
+    CONTENT_TYPES = {"mp4": "video/mp4", "m4a": "audio/mp4", "webm": "video/webm"}
+
+    def __init__(self, payloads: dict, rate: float = 0, spotify_tracks: int = 0, page_size: int = 50):
+        self.payloads = payloads
+        self.rate = rate
+        self.spotify_tracks = spotify_tracks
+        self.page_size = page_size
+        self.bytes_served = 0
+        self.first_bytes = {}
+        self._lock = threading.Lock()
+        self._httpd = QuietHTTPServer(("127.0.0.1", 0), self._handler())
+        self.base_url = f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name="benchmark-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def media_url(self, name: str, ext: str) -> str:
+        return f"{self.base_url}/media/{name}.{ext}"
+
+    def playlist_url(self, prefix: str, items: int) -> str:
+        """RSS kanál s `items` médii – generický extraktor yt-dlp z něj udělá playlist."""
+        return f"{self.base_url}/playlist.rss?prefix={prefix}&items={items}"
+
+    def spotify_track(self, index: int) -> dict:
+        return {
+            "id": f"bench{index:05d}",
+            "name": f"spotify-{index:05d}",
+            "type": "track",
+            "artists": [{"name": SPOTIFY_ARTIST}],
+            "album": {"name": SPOTIFY_ARTIST, "images": []},
+        }
+
+    def download_first_byte(self, path: str):
+        """Čas prvního bajtu posledního požadavku na `path` (první požadavek je extrakce yt-dlp, poslední stahování)."""
+        with self._lock:
+            times = self.first_bytes.get(path)
+            return times[-1] if times else None
+
+    def _record(self, path: str, sent: int, first: bool):
+        with self._lock:
+            self.bytes_served += sent
+            if first:
+                self.first_bytes.setdefault(path, []).append(time.perf_counter())
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload: dict, status: int = 200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path.startswith("/spotify/token"):
+                    self._send_json({"access_token": "benchmark", "token_type": "Bearer", "expires_in": 3600})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                if url.path.startswith("/media/"):
+                    self._send_media(url.path)
+                elif url.path == "/playlist.rss":
+                    self._send_feed(url)
+                elif url.path.startswith("/spotify/v1/playlists/"):
+                    self._send_playlist(url)
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def _send_feed(self, url):
+                query = urllib.parse.parse_qs(url.query)
+                prefix, items = query["prefix"][0], int(query["items"][0])
+                entries = []
+                for i in range(items):
+                    media = server.media_url(f"{prefix}-{i:05d}", "mp4")
+                    entries.append(
+                        f"<item><title>{prefix}-{i:05d}</title><guid>{prefix}-{i:05d}</guid><link>{media}</link>"
+                        f'<enclosure url="{media}" type="video/mp4" length="{len(server.payloads["mp4"])}"/></item>'
+                    )
+                body = (
+                    '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+                    f"<title>Benchmark Playlist</title><link>{server.base_url}/</link>{''.join(entries)}</channel></rss>"
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/rss+xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_playlist(self, url):
+                parts = url.path.split("/")
+                if len(parts) == 5:
+                    self._send_json({"name": "Benchmark Playlist", "snapshot_id": "benchmark", "tracks": {"total": server.spotify_tracks}})
+                    return
+                query = urllib.parse.parse_qs(url.query)
+                offset = int(query.get("offset", ["0"])[0])
+                limit = min(int(query.get("limit", ["100"])[0]), server.page_size)
+                end = min(offset + limit, server.spotify_tracks)
+                next_url = None
+                if end < server.spotify_tracks:
+                    next_url = f"{server.base_url}{url.path}?offset={end}&limit={limit}"
+                self._send_json({"items": [{"track": server.spotify_track(i)} for i in range(offset, end)], "next": next_url})
+
+            def _send_media(self, path: str):
+                ext = path.rsplit(".", 1)[-1]
+                payload = server.payloads.get(ext)
+                if payload is None:
+                    self._send_json({"error": "not found"}, 404)
+                    return
+                start = 0
+                match = self.headers.get("Range", "")
+                if match.startswith("bytes=") and match[6:].split("-")[0].isdigit():
+                    start = min(int(match[6:].split("-")[0]), len(payload))
+                self.send_response(206 if start else 200)
+                self.send_header("Content-Type", server.CONTENT_TYPES.get(ext, "application/octet-stream"))
+                self.send_header("Content-Length", str(len(payload) - start))
+                self.send_header("Accept-Ranges", "bytes")
+                if start:
+                    self.send_header("Content-Range", f"bytes {start}-{len(payload) - 1}/{len(payload)}")
+                self.end_headers()
+
+                started = time.perf_counter()
+                sent = 0
+                view = memoryview(payload)[start:]
+                try:
+                    while sent < len(view):
+                        chunk = view[sent:sent + 65536]
+                        self.wfile.write(chunk)
+                        server._record(path, len(chunk), first=sent == 0)
+                        sent += len(chunk)
+                        if server.rate:
+                            # Omezení rychlosti na jedno spojení
+                            delay = sent / server.rate - (time.perf_counter() - started)
+                            if delay > 0:
+                                time.sleep(delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    # yt-dlp při extrakci čte jen hlavičky a spojení zavře
+                    self.close_connection = True
+
+        return Handler
+
+def synthetic_payloads(size: int, audio: bool) -> dict:
+    """Syntetická média. Se zvukem zkusí přes ffmpeg vyrobit skutečné AAC, aby převod měl co dělat."""
+    payloads = {"mp4": os.urandom(size)}
+    if audio:
+        payloads["m4a"] = payloads["mp4"]
+        if shutil.which("ffmpeg"):
+            with tempfile.TemporaryDirectory() as tmp:
+                target = os.path.join(tmp, "sine.m4a")
+                duration = max(1, size * 8 // 192000)
+                command = ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+                           "-c:a", "aac", "-b:a", "192k", target]
+                if subprocess.run(command, capture_output=True).returncode == 0 and os.path.exists(target):
+                    with open(target, "rb") as f:
+                        payloads["m4a"] = f.read()
+    return payloads
+
+# -------------------------------------------
+# Náhrada Discordu
+# -------------------------------------------
+class FakeMessage:
+    """Náhrada discord.Message: úpravy jen počítá, volitelně se simulovanou latencí API."""
+
+    def __init__(self, content: str, latency: float = 0):
+        self.content = content
+        self.latency = latency
+        self.edits = 0
+
+    async def edit(self, content: str = None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.content = content
+        self.edits += 1
+
+class FakeFollowup:
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.messages = []
+
+    async def send(self, content: str, ephemeral: bool = False, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        message = FakeMessage(content, self.latency)
+        self.messages.append(message)
+        return message
+
+class FakeInteraction:
+    """Náhrada discord.Interaction pro DownloadJob.from_interaction."""
+
+    def __init__(self, latency: float = 0):
+        self.user = types.SimpleNamespace(id=0, name="benchmark")
+        self.channel_id = 0
+        self.followup = FakeFollowup(latency)
+
+# -------------------------------------------
+# Běh jedné zátěže (v podřízeném procesu)
+# -------------------------------------------
+def percentiles(values: list) -> dict:
+    """p50/p90/p99 (nearest-rank), maximum a součet."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+    return {
+        "count": len(ordered),
+        "p50": round(rank(50), 4),
+        "p90": round(rank(90), 4),
+        "p99": round(rank(99), 4),
+        "max": round(ordered[-1], 4),
+        "total": round(sum(ordered), 4),
+    }
+
+def prepare_environment(workdir: str, server: MediaServer):
+    """Nasměruje bota do dočasné složky a na lokální server (před importem bot.py)."""
+    downloads = os.path.join(workdir, "downloads")
+    os.environ.update({
+        "BOT_DATA_DIR": os.path.join(workdir, "data"),
+        "BOT_LOGS_DIR": os.path.join(workdir, "logs"),
+        "OMV_BASE_DOWNLOAD_DIR": downloads,
+        "CONTENT_STORE_DIR": os.path.join(downloads, ".store"),
+        "SPOTIFY_CLIENT_ID": "benchmark",
+        "SPOTIFY_CLIENT_SECRET": "benchmark",
+        "SPOTIFY_API_BASE": f"{server.base_url}/spotify/v1",
+        "SPOTIFY_TOKEN_URL": f"{server.base_url}/spotify/token",
+    })
+    for folder in ("data", "logs", "downloads"):
+        os.makedirs(os.path.join(workdir, folder), exist_ok=True)
+
+    # Náhrada vyhledávání na YouTube (viz SEARCH_PLUGIN)
+    plugins = os.path.join(workdir, "plugins")
+    os.makedirs(os.path.join(plugins, "yt_dlp_plugins", "extractor"), exist_ok=True)
+    with open(os.path.join(plugins, "yt_dlp_plugins", "extractor", "benchmark_search.py"), "w", encoding="utf-8") as f:
+        f.write(SEARCH_PLUGIN)
+    sys.path.insert(0, plugins)
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [plugins, os.environ.get("PYTHONPATH")]))
+    os.environ["BENCHMARK_MEDIA_BASE"] = server.base_url
+
+def output_files(bot) -> tuple:
+    """Počet a velikost hotových souborů ve složkách uživatelů (bez úložiště a .part)."""
+    count, size = 0, 0
+    store = os.path.abspath(bot.CONTENT_STORE_DIR)
+    for root, dirs, files in os.walk(bot.BASE_DOWNLOAD_DIR):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != store]
+        for name in files:
+            if name.endswith((".part", ".ytdl", ".jpg", ".webp", ".png")):
+                continue
+            count += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return count, size
+
+async def run_jobs(bot, server: MediaServer, specs: list, args) -> dict:
+    """Zařadí úlohy do vlastní fronty bota a počká na jejich dokončení."""
+    stages = {}
+    def observer(stage, seconds):
+        stages.setdefault(stage, []).append(seconds)
+    bot.STAGE_OBSERVERS.append(observer)
+
+    queue = bot.DownloadQueue(args.workers, len(specs), args.workers, len(specs))
+    queue.start()
+    interaction = FakeInteraction(args.discord_latency_ms / 1000)
+    started = time.perf_counter()
+    jobs = []
+    for kind, url, paths, as_audio in specs:
+        job = bot.DownloadJob.from_interaction(kind, url, interaction, as_audio=as_audio)
+        await queue.submit(job)
+        jobs.append((job, paths, time.perf_counter()))
+    finished = {}
+    while queue.pending or queue.running:
+        await asyncio.sleep(0.02)
+        for job, _, _ in jobs:
+            if job.job_id not in finished and job.state not in ("queued", "running"):
+                finished[job.job_id] = time.perf_counter()
+    for job, _, _ in jobs:
+        finished.setdefault(job.job_id, time.perf_counter())
+    wall = time.perf_counter() - started
+    queue._dispatcher.cancel()
+    bot.STAGE_OBSERVERS.remove(observer)
+
+    ttfb = []
+    for job, paths, submitted in jobs:
+        first = [t for t in (server.download_first_byte(path) for path in paths) if t is not None]
+        if first:
+            ttfb.append(min(first) - submitted)
+    files, size = output_files(bot)
+    return {
+        "jobs": len(jobs),
+        "failed_jobs": sum(1 for job, _, _ in jobs if job.state != "done"),
+        "files": files,
+        "bytes": size,
+        "bytes_served": server.bytes_served,
+        "wall_s": round(wall, 4),
+        "jobs_per_s": round(len(jobs) / wall, 4) if wall else None,
+        "bytes_per_s": round(size / wall, 1) if wall else None,
+        "ttfb_s": percentiles(ttfb),
+        # Doba od zařazení do dokončení podle prioritního pruhu úlohy
+        "completion_s": {
+            lane: percentiles([finished[job.job_id] - submitted for job, _, submitted in jobs if job.lane == lane])
+            for lane in sorted({job.lane for job, _, _ in jobs})
+        },
+        "stages": {stage: percentiles(values) for stage, values in sorted(stages.items())},
+        "discord_edits": sum(message.edits for message in interaction.followup.messages),
+    }
+
+def workload_specs(bot, workload: str, server: MediaServer, items: int) -> tuple:
+    """Úlohy zátěže: [(druh, url, cesty médií, audio)] a počet očekávaných souborů."""
+    if workload == "single":
+        specs = []
+        for i in range(items):
+            url = server.media_url(f"single-{i:05d}", "mp4")
+            specs.append(("generic", url, [urllib.parse.urlsplit(url).path], False))
+        return specs
+
+    if workload == "mixed":
+        # Velký playlist a za ním samostatné úlohy – interaktivní úlohy nemají čekat na celý playlist
+        singles = workload_specs(bot, "single", server, max(1, items // 4))
+        return workload_specs(bot, "playlist", server, items) + singles
+
+    if workload == "playlist":
+        # Playlist projde stejnou cestou jako YouTube playlist: extrakce (generický extraktor
+        # čte RSS kanál lokálního serveru) a souběžné stažení položek
+        paths = [urllib.parse.urlsplit(server.media_url(f"playlist-{i:05d}", "mp4")).path for i in range(items)]
+        return [("youtube_playlist_video", server.playlist_url("playlist", items), paths, False)]
+
+    # Spotify: stránky přes náhradu Web API, skladby se vyhledají přes "ytsearch1:" (SEARCH_PLUGIN)
+    paths = [urllib.parse.urlsplit(server.media_url(server.spotify_track(i)["name"], "m4a")).path for i in range(items)]
+    return [("spotify_playlist", f"https://open.spotify.com/playlist/{SPOTIFY_PLAYLIST_ID}", paths, True)]
+
+def run_workload(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bot-benchmark-")
+    size = int(args.size_mb * 1024 * 1024)
+    payloads = synthetic_payloads(size, audio=args.run == "spotify")
+    server = MediaServer(payloads, rate=args.rate_mbps * 1024 * 1024 / 8, spotify_tracks=args.items, page_size=args.page_size).start()
+    try:
+        prepare_environment(workdir, server)
+        sys.path.insert(0, BOT_DIR)
+        import bot
+
+        specs = workload_specs(bot, args.run, server, args.items)
+        result = asyncio.run(run_jobs(bot, server, specs, args))
+        result["expected_files"] = sum(len(paths) for _, _, paths, _ in specs)
+        if result["failed_jobs"] or result["files"] < result["expected_files"]:
+            # Např. extrakce playlistu nevrátila žádné položky – rychlost bez souborů nic neznamená
+            result["error"] = f"staženo {result['files']}/{result['expected_files']} souborů, neúspěšných úloh {result['failed_jobs']}"
+        result["ffmpeg"] = shutil.which("ffmpeg") is not None
+        result["ytdlp_mode"] = bot.YTDLP_EXECUTOR.mode
+        if bot.YTDLP_EXECUTOR._pool is not None:
+            bot.YTDLP_EXECUTOR._pool.shutdown(wait=True)
+        if resource:
+            # ru_maxrss je v KiB (Linux); u potomků jde o největší z nich (ffmpeg, procesy yt-dlp)
+            result["peak_rss_kib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result["peak_rss_children_kib"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return result
+    finally:
+        server.stop()
+        if args.keep:
+            print(f"Data zátěže {args.run} ponechána v {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+# -------------------------------------------
+# Řízení běhu a porovnání
+# -------------------------------------------
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment_info() -> dict:
+    info = {"git": git_revision(), "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+    try:
+        import yt_dlp
+        info["yt_dlp"] = yt_dlp.version.__version__
+    except ImportError:
+        info["yt_dlp"] = None
+    return info
+
+def lookup(data: dict, path: tuple):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Vrátí zhoršení oproti `baseline` větší než `tolerance` (podíl)."""
+    regressions = []
+    for workload, result in current["workloads"].items():
+        previous = baseline.get("workloads", {}).get(workload)
+        if not previous:
+            continue
+        checks = list(COMPARED_METRICS)
+        for stage in result.get("stages", {}):
+            checks += [(("stages", stage, p), False) for p in COMPARED_STAGE_PERCENTILES]
+        for path, higher_is_better in checks:
+            new, old = lookup(result, path), lookup(previous, path)
+            if not new or not old:
+                continue
+            if path[0] in ("stages", "ttfb_s", "completion_s") and max(new, old) < MIN_COMPARED_SECONDS:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{workload}.{'.'.join(path)}: {old} → {new} ({change:+.0%})")
+    return regressions
+
+def print_summary(report: dict):
+    for workload, result in report["workloads"].items():
+        if "error" in result:
+            print(f"❌ {workload}: {result['error']}", file=sys.stderr)
+            continue
+        print(
+            f"📊 {workload}: {result['files']}/{result['expected_files']} souborů za {result['wall_s']:.2f} s | "
+            f"{result['jobs_per_s']} úloh/s | {result['bytes_per_s'] / 1024 / 1024:.1f} MiB/s | "
+            f"TTFB p50 {result['ttfb_s'].get('p50')} s | RSS {result.get('peak_rss_kib')} KiB",
+            file=sys.stderr,
+        )
+        for lane, stats in result.get("completion_s", {}).items():
+            print(f"    hotovo {lane:<12} n={stats['count']:<5} p50={stats.get('p50')}  p90={stats.get('p90')}  p99={stats.get('p99')}", file=sys.stderr)
+        for stage, stats in result["stages"].items():
+            print(f"    {stage:<12} n={stats['count']:<5} p50={stats['p50']:<8} p90={stats['p90']:<8} p99={stats['p99']}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark stahovací pipeline bota.")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="Zátěže oddělené čárkou: single, playlist, spotify, mixed")
+    parser.add_argument("--items", type=int, default=20, help="Počet úloh (single) nebo položek playlistu")
+    parser.add_argument("--size-mb", type=float, default=4, help="Velikost jednoho syntetického média v MiB")
+    parser.add_argument("--rate-mbps", type=float, default=0, help="Omezení rychlosti jednoho spojení v Mbit/s (0 = bez omezení)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("DOWNLOAD_WORKERS", "2")), help="Počet souběžných úloh fronty")
+    parser.add_argument("--discord-latency-ms", type=float, default=0, help="Simulovaná latence Discord API")
+    parser.add_argument("--page-size", type=int, default=50, help="Velikost stránky náhradního Spotify API")
+    parser.add_argument("--output", help="Soubor pro JSON výsledek (jinak stdout)")
+    parser.add_argument("--baseline", help="Předchozí JSON výsledek pro porovnání")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Povolené zhoršení oproti baseline (podíl)")
+    parser.add_argument("--keep", action="store_true", help="Ponechat dočasná data zátěží")
+    parser.add_argument("--run", choices=WORKLOADS, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(run_workload(args), f)
+        return 0
+
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"Neznámá zátěž: {', '.join(sorted(unknown))}")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment_info(),
+        "config": {key: getattr(args, key) for key in ("items", "size_mb", "rate_mbps", "workers", "discord_latency_ms", "page_size")},
+        "workloads": {},
+    }
+    passthrough = [
+        "--items", str(args.items), "--size-mb", str(args.size_mb), "--rate-mbps", str(args.rate_mbps),
+        "--workers", str(args.workers), "--discord-latency-ms", str(args.discord_latency_ms), "--page-size", str(args.page_size),
+    ] + (["--keep"] if args.keep else [])
+    for workload in workloads:
+        # Každá zátěž v novém procesu: čistý stav modulu bota a vlastní špičková paměť
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_path = f.name
+        try:
+            # Průběh yt-dlp na stdout by jen zdržoval a míchal se s JSON výstupem
+            process = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run", workload, "--result", result_path] + passthrough,
+                stdout=subprocess.DEVNULL,
+            )
+            if process.returncode != 0:
+                report["workloads"][workload] = {"error": f"proces skončil s kódem {process.returncode}"}
+                continue
+            with open(result_path, encoding="utf-8") as f:
+                report["workloads"][workload] = json.load(f)
+        finally:
+            os.remove(result_path)
+
+    print_summary(report)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"⚠️ Zhoršení: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    if any("error" in result for result in report["workloads"].values()):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,18 +7,32 @@ import sys
 import re
 import time
 import base64
-import requests
 import subprocess
 from pathlib import Path
 import logging
+import logging.handlers
 from datetime import datetime
 import asyncio
+import io
 import json
-import yt_dlp
-import discord
-from discord.ext import commands
-from discord import app_commands
-from dotenv import load_dotenv
+import queue
+import shutil
+import contextlib
+import hashlib
+import sqlite3
+import collections
+import threading
+import traceback
+import uuid
+import math
+import atexit
+import contextvars
+import random
+import multiprocessing
+import concurrent.futures
+
+# Začátek procesu pro měření doby startu (time-to-ready)
+PROCESS_STARTED = time.perf_counter()
 
 # --- Pomocná funkce pro zajištění složky ---
 def ensure_folder(folder: str):
@@ -31,24 +45,7 @@ PACKAGES_DIR = os.path.join(os.path.dirname(__file__), "Packages")
 if PACKAGES_DIR not in sys.path:
     sys.path.insert(0, PACKAGES_DIR)
 
-# --- Nastavení logování ---
-LOGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Logs")
-ensure_folder(LOGS_DIR)
-
-# Archivace předchozího logu
-LATEST_LOG_PATH = os.path.join(LOGS_DIR, "latest.log")
-if os.path.exists(LATEST_LOG_PATH):
-    timestamp = datetime.fromtimestamp(os.path.getmtime(LATEST_LOG_PATH)).strftime('%H-%M-%S-%d-%m-%Y')
-    archived_log_path = os.path.join(LOGS_DIR, f"{timestamp}.log")
-    os.rename(LATEST_LOG_PATH, archived_log_path)
-
-logging.basicConfig(
-    filename=LATEST_LOG_PATH,
-    level=logging.INFO,
-    format='%(asctime)s:%(levelname)s:%(message)s'
-)
-
-# --- Instalace závislostí ---
+# --- Instalace závislostí (jen explicitně: python3 bot.py --setup) ---
 REQUIRED_PACKAGES = ["yt-dlp", "requests", "python-dotenv", "discord.py"]
 
 def install_dependencies():
@@ -73,13 +70,166 @@ def install_dependencies():
                 logging.critical(f"❌ Kritická chyba při instalaci balíčku '{package}': {e}")
                 sys.exit(1)
 
-install_dependencies()
+if __name__ == "__main__" and "--setup" in sys.argv:
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(message)s')
+    install_dependencies()
+    sys.exit(0)
+
+# yt_dlp se nenačítá zde – jeho registr extraktorů zdržuje start, načte se až při prvním použití
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    import discord
+    from aiohttp import web
+    from discord.ext import commands
+    from discord import app_commands
+    from dotenv import load_dotenv
+except ImportError as e:
+    sys.exit(f"❌ Chybí balíček '{e.name}'. Nainstalujte závislosti příkazem 'python3 bot.py --setup'.")
 
-# načtení .env
+# načtení .env (ještě před logováním, aby platilo i nastavení logů)
 env_path = Path(__file__).parent / ".env"
 if env_path.exists():
     load_dotenv(dotenv_path=env_path)
 
+# --- Nastavení logování ---
+LOGS_DIR = os.environ.get("BOT_LOGS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Logs"))
+ensure_folder(LOGS_DIR)
+
+# Podřízené procesy yt-dlp (YTDLP_EXECUTION_MODE=process) tento modul znovu importují,
+# v nich se nesmí archivovat log ani instalovat balíčky.
+IS_MAIN_PROCESS = multiprocessing.current_process().name == "MainProcess"
+
+LATEST_LOG_PATH = os.path.join(LOGS_DIR, "latest.log")
+# latest.log se archivuje po překročení velikosti nebo stáří, archivy starší než retence se mažou
+LOG_MAX_BYTES = int(float(os.environ.get("LOG_MAX_MB", "10")) * 1024 * 1024)
+LOG_ROTATE_INTERVAL = int(float(os.environ.get("LOG_ROTATE_HOURS", "24")) * 3600)
+LOG_RETENTION_DAYS = int(os.environ.get("LOG_RETENTION_DAYS", "14"))
+# Formát záznamů: "text" (výchozí) nebo "json" (jeden JSON objekt na řádek)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+LOG_ARCHIVE_TIME_FORMAT = '%H-%M-%S-%d-%m-%Y'
+
+# Právě zpracovávaná úloha – nastavuje ji DownloadQueue._run, dědí ji i vnořené tasky
+# a vlákna z asyncio.to_thread; logování z ní doplňuje číslo úlohy
+CURRENT_JOB = contextvars.ContextVar("current_job", default=None)
+
+class JobContextFilter(logging.Filter):
+    """Doplní do záznamu číslo právě zpracovávané úlohy (běží ve vlákně volajícího)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "job_id"):
+            job = CURRENT_JOB.get()
+            record.job_id = job.job_id if job else None
+        record.job_tag = f"[#{record.job_id}] " if record.job_id else ""
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    """Jeden záznam = jeden řádek JSON (čas, úroveň, zpráva, úloha, vlákno). Výpis výjimky je součástí zprávy."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "job_id": getattr(record, "job_id", None),
+            "thread": record.threadName,
+            "process": record.processName,
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+class ArchivingLogHandler(logging.handlers.RotatingFileHandler):
+    """
+    Zapisuje do latest.log a po překročení `max_bytes` nebo `max_age` sekund ho
+    archivuje přejmenováním na čas archivace (stejně jako dřív při startu bota).
+    Archivy starší než `retention_days` maže. Zapisuje jen vlákno QueueListeneru.
+    """
+
+    def __init__(self, path: str, max_bytes: int, max_age: int, retention_days: int):
+        super().__init__(path, maxBytes=max_bytes, encoding="utf-8", delay=True)
+        self.max_age = max_age
+        self.retention_days = retention_days
+        self.opened_at = time.time()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.max_age and time.time() - self.opened_at >= self.max_age:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def archive(self):
+        """Přejmenuje latest.log na čas archivace a smaže archivy po retenci."""
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            folder = os.path.dirname(self.baseFilename)
+            timestamp = datetime.now().strftime(LOG_ARCHIVE_TIME_FORMAT)
+            target = os.path.join(folder, f"{timestamp}.log")
+            suffix = 1
+            while os.path.exists(target):
+                target = os.path.join(folder, f"{timestamp}-{suffix}.log")
+                suffix += 1
+            os.rename(self.baseFilename, target)
+        self.prune()
+
+    def prune(self):
+        if self.retention_days <= 0:
+            return
+        folder = os.path.dirname(self.baseFilename)
+        cutoff = time.time() - self.retention_days * 86400
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if name.endswith(".log") and path != self.baseFilename and os.path.getmtime(path) < cutoff:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self.archive()
+        self.stream = self._open()
+        self.opened_at = time.time()
+
+class WorkerLogHandler(logging.handlers.QueueHandler):
+    """V podřízeném procesu yt-dlp posílá záznamy frontou událostí do bota, zapisuje je jeho listener."""
+
+    def enqueue(self, record: logging.LogRecord):
+        self.queue.put((None, "log", record))
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """
+    Log se zapisuje jediným vláknem: volání logging.* jen vloží záznam do fronty,
+    takže event loop ani vlákna stahování nikdy nečekají na disk (NAS).
+    """
+    file_handler = ArchivingLogHandler(LATEST_LOG_PATH, LOG_MAX_BYTES, LOG_ROTATE_INTERVAL, LOG_RETENTION_DAYS)
+    # Předchozí latest.log se archivuje při každém startu
+    file_handler.archive()
+    if LOG_FORMAT == "json":
+        file_handler.setFormatter(JsonLogFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(job_tag)s%(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(JobContextFilter())
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+def stop_logging():
+    """Zapíše zbývající záznamy z fronty (před os.execv nebo ukončením procesu)."""
+    global LOG_LISTENER
+    if LOG_LISTENER is not None:
+        LOG_LISTENER.stop()
+        LOG_LISTENER = None
+
+LOG_LISTENER = setup_logging() if IS_MAIN_PROCESS else None
+atexit.register(stop_logging)
+
 # -------------------------------------------
 # Konfigurace bota a stahování
 # -------------------------------------------
@@ -96,258 +246,2998 @@ BASE_DOWNLOAD_DIR = os.environ.get("OMV_BASE_DOWNLOAD_DIR", OMV_DEFAULT_DIR)
 AUDIO_DIR_NAME = os.environ.get("AUDIO_SUB_DIR_NAME", "Zvuk")
 VIDEO_DIR_NAME = os.environ.get("VIDEO_SUB_DIR_NAME", "Video")
 
-# Fiktivní URL pro testování, Spotify token se získává z API
-SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
-SPOTIFY_API_BASE = "https://api.spotify.com/v1"
+# Spotify Web API (adresy lze přesměrovat např. na lokální testovací server)
+SPOTIFY_TOKEN_URL = os.environ.get("SPOTIFY_TOKEN_URL", "https://accounts.spotify.com/api/token")
+SPOTIFY_API_BASE = os.environ.get("SPOTIFY_API_BASE", "https://api.spotify.com/v1").rstrip("/")
 
 # Globální proměnná pro stav "silent" módu
 SILENT_MODE = False
 
-# Globální proměnná pro sledování stahování yt-dlp
-ACTIVE_DOWNLOAD_TASKS = {}
+# Fronta stahování: počet souběžných stahování (slotů), kapacita fronty a limity na uživatele
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "2"))
+DOWNLOAD_QUEUE_LIMIT = int(os.environ.get("DOWNLOAD_QUEUE_LIMIT", "50"))
+MAX_ACTIVE_JOBS_PER_USER = int(os.environ.get("MAX_ACTIVE_JOBS_PER_USER", "1"))
+MAX_QUEUED_JOBS_PER_USER = int(os.environ.get("MAX_QUEUED_JOBS_PER_USER", "5"))
+
+# Režim spouštění yt-dlp: "thread" (vlákno v procesu bota) nebo "process" (samostatné
+# procesy, extrakce a postprocessing pak neblokují GIL event loopu bota)
+YTDLP_EXECUTION_MODE = os.environ.get("YTDLP_EXECUTION_MODE", "thread").lower()
+YTDLP_PROCESS_WORKERS = int(os.environ.get("YTDLP_PROCESS_WORKERS", str(os.cpu_count() or 2)))
+
+# Počet souběžných převodů zvuku (ffmpeg). Převod běží odděleně od stahování,
+# takže síť i CPU zůstávají vytížené současně.
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", str(os.cpu_count() or 2)))
+
+# Výstup zvuku: "transcode" (vždy převod na MP3), "native" (ponechá stažený soubor i kontejner),
+# "remux" (přebalí stream bez převodu do zvukového kontejneru, např. .opus/.m4a),
+# "auto" (přebalí, je-li kodek v AUDIO_ALLOWED_CODECS, jinak převede na MP3)
+AUDIO_OUTPUT_POLICY = os.environ.get("AUDIO_OUTPUT_POLICY", "transcode").lower()
+AUDIO_ALLOWED_CODECS = {codec.strip().lower() for codec in os.environ.get("AUDIO_ALLOWED_CODECS", "opus,aac,mp3").split(",") if codec.strip()}
+
+# Cache metadat (info dict) z yt-dlp: počet položek a platnost v sekundách.
+# Odkazy na formáty (hlavně YouTube) po několika hodinách expirují, proto krátké TTL.
+INFO_CACHE_SIZE = int(os.environ.get("INFO_CACHE_SIZE", "256"))
+INFO_CACHE_TTL = int(os.environ.get("INFO_CACHE_TTL", "1800"))
+
+# Počet položek jednoho playlistu stahovaných současně (limit na jednu úlohu)
+PLAYLIST_ITEM_PARALLELISM = int(os.environ.get("PLAYLIST_ITEM_PARALLELISM", "3"))
+
+# Průběžné zprávy o stahování: výchozí interval úprav zprávy a strop při zpomalení Discordu
+PROGRESS_UPDATE_INTERVAL = float(os.environ.get("PROGRESS_UPDATE_INTERVAL", "2"))
+PROGRESS_MAX_INTERVAL = 30.0
+
+# Token interakce (followup zprávy) platí 15 minut, necháváme si rezervu
+INTERACTION_FOLLOWUP_TTL = 14 * 60
 
-# Cesta k souboru pro sledování playlistů a archiv stahování
+# Žurnál úloh: kolikrát se nedokončená úloha po restartu obnoví, a jak dlouho (ve dnech)
+# se uchovávají záznamy dokončených úloh
+JOB_MAX_RESTARTS = int(os.environ.get("JOB_MAX_RESTARTS", "3"))
+JOB_JOURNAL_RETENTION_DAYS = 30
+# Hromadné stahování (/hromadne): nejvíce URL v jedné úloze a největší přiložený .txt soubor
+BATCH_MAX_URLS = int(os.environ.get("BATCH_MAX_URLS", "500"))
+BATCH_MAX_ATTACHMENT_BYTES = 1024 * 1024
+# Kolik položek hromadné práce (playlisty, kontrola sledovaných playlistů) smí běžet, zatímco běží interaktivní úloha
+BULK_ITEMS_WHILE_INTERACTIVE = int(os.environ.get("BULK_ITEMS_WHILE_INTERACTIVE", "1"))
+
+# Úložiště obsahu: každé médium (ve dané variantě formátu) je uloženo jednou, složky
+# uživatelů obsahují hardlinky. Musí být na stejném svazku jako BASE_DOWNLOAD_DIR.
+CONTENT_STORE_DIR = os.environ.get("CONTENT_STORE_DIR", os.path.join(BASE_DOWNLOAD_DIR, ".store"))
+
+# Lokální pracovní složka (tmpfs/SSD) pro .part soubory, spojování a převod; na úložiště
+# se přesune až hotový soubor. Prázdné = stahuje se přímo do BASE_DOWNLOAD_DIR.
+STAGING_DIR = os.environ.get("STAGING_DIR", "")
+# Pracovní složky přerušených stahování se po tolika hodinách při startu smažou
+STAGING_RETENTION = 24 * 3600
+# Kolik místa musí na úložišti zůstat volného po stažení (GiB)
+MIN_FREE_SPACE = int(float(os.environ.get("MIN_FREE_SPACE_GB", "2")) * 1024**3)
+
+# Knihovna stažených souborů: jak často (hodiny) se porovná s obsahem složek (0 = jen při startu)
+LIBRARY_SCAN_INTERVAL = float(os.environ.get("LIBRARY_SCAN_HOURS", "6")) * 3600
+# Nejvíce výsledků vyhledávání /hledej
+LIBRARY_SEARCH_LIMIT = 15
+
+# Datová složka bota (stav, archiv). Absolutní cesta, nezávisí na pracovním adresáři.
+DATA_DIR = os.environ.get("BOT_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+STATE_DB_FILE = os.path.join(DATA_DIR, "bot_state.db")
+
+# Původní soubory (sledované playlisty, archiv stahování, cache vyhledávání) – jen pro jednorázovou migraci
 PLAYLIST_DATA_FILE = "downloaded_playlists.json"
 DOWNLOAD_ARCHIVE_FILE = "downloaded_songs_archive.txt"
+RESOLUTION_CACHE_FILE = "spotify_resolution_cache.json"
+
+# Počet souběžných vyhledávání Spotify skladeb na YouTube
+SPOTIFY_SEARCH_CONCURRENCY = int(os.environ.get("SPOTIFY_SEARCH_CONCURRENCY", "4"))
+
+# Plánovač kontroly sledovaných playlistů: výchozí interval, náhodný rozptyl (podíl intervalu)
+# a prodleva před dalším pokusem po chybě
+PLAYLIST_CHECK_INTERVAL = int(float(os.environ.get("PLAYLIST_CHECK_INTERVAL_HOURS", "6")) * 3600)
+PLAYLIST_CHECK_JITTER = float(os.environ.get("PLAYLIST_CHECK_JITTER", "0.1"))
+PLAYLIST_RETRY_DELAY = 3600
+# Počet sledovaných playlistů kontrolovaných současně
+PLAYLIST_SWEEP_CONCURRENCY = int(os.environ.get("PLAYLIST_SWEEP_CONCURRENCY", "3"))
+
+# Spotify Web API: timeout požadavku a počet pokusů
+SPOTIFY_HTTP_TIMEOUT = 15
+SPOTIFY_MAX_RETRIES = 5
+# Delší Retry-After než tento limit (v sekundách) se nečeká a požadavek selže
+SPOTIFY_MAX_RETRY_AFTER = 120
+
+# Společný limit šířky pásma pro všechna stahování v Mbit/s (0 = bez omezení)
+BANDWIDTH_LIMIT_MBPS = float(os.environ.get("BANDWIDTH_LIMIT_MBPS", "0"))
+# Časové profily limitu, např. "07:00-23:00=20,23:00-07:00=0" (mimo okna platí BANDWIDTH_LIMIT_MBPS)
+BANDWIDTH_SCHEDULE = os.environ.get("BANDWIDTH_SCHEDULE", "")
+# Jak často (s) se přepočítává rozdělení pásma a jakou dávku (s) smí stahování najednou vyčerpat
+BANDWIDTH_REALLOCATE_INTERVAL = 0.5
+BANDWIDTH_BURST_SECONDS = 0.5
+# Velikost čteného bloku při omezení – yt-dlp jinak blok zvětšuje až na 4 MiB a omezení by bylo trhané
+BANDWIDTH_BLOCK_SIZE = 128 * 1024
+
+# Metriky ve formátu Prometheus na http://METRICS_HOST:METRICS_PORT/metrics (0 = vypnuto)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+# Interval měření zpoždění event loopu (s)
+LOOP_LAG_INTERVAL = 0.5
+# Zablokování event loopu delší než tento práh (s) se zaloguje i se zásobníkem (0 = vypnuto)
+LOOP_BLOCK_THRESHOLD = float(os.environ.get("LOOP_BLOCK_THRESHOLD", "1.0"))
+# Profiler (/profile): interval vzorkování a nejdelší povolená doba běhu (s)
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 120
 
 # -------------------------------------------
-# Správa dat
+# Měření fází zpracování
 # -------------------------------------------
-def load_playlist_data():
-    if os.path.exists(PLAYLIST_DATA_FILE):
+# Pozorovatelé délky fází (benchmark.py, metriky): funkce (fáze, sekundy).
+# Volají se i z vláken executoru, nesmí tedy blokovat.
+STAGE_OBSERVERS = []
+
+def observe_stage(stage: str, seconds: float):
+    """Předá délku fáze (extract, download, transcode, ...) všem pozorovatelům."""
+    for observer in STAGE_OBSERVERS:
         try:
-            with open(PLAYLIST_DATA_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            logging.error("❌ Chyba při čtení souboru downloaded_playlists.json. Soubor je poškozen.")
-            return {}
-    return {}
-
-def save_playlist_data(data):
-    with open(PLAYLIST_DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
-        
-# -------------------------------------------
-# Pomocné a asynchronní funkce
-# -------------------------------------------
+            observer(stage, seconds)
+        except Exception as e:
+            logging.warning(f"Chyba pozorovatele fáze '{stage}': {e}")
+
+@contextlib.contextmanager
+def stage_timer(stage: str):
+    """Změří blok kódu jako fázi `stage` (i když skončí výjimkou)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
 
-async def check_for_new_songs_async(manual_run: bool = False):
+class Metrics:
     """
-    Pravidelně kontroluje sledované playlisty a stahuje nové skladby.
-    Spoléhá na DOWNLOAD_ARCHIVE_FILE pro přeskočení již stažených položek.
+    Počítadla a histogramy v textovém formátu Prometheus (bez externí knihovny).
+    Zapisovat lze z libovolného vlákna; stav fronty se čte až při dotazu na /metrics.
+    V režimu YTDLP_EXECUTION_MODE=process se počítá jen to, co běží v procesu bota.
     """
-    if not manual_run:
-        await bot.wait_until_ready()
-    
-    logging.info("⏳ Zahajuji kontrolu nových skladeb v sledovaných playlistech.")
-    
-    total_songs_checked = 0
 
-    try:
-        playlists_to_check = load_playlist_data()
-        if not playlists_to_check:
-            logging.info("✅ Nejsou žádné playlisty ke kontrole.")
-            if not manual_run:
-                await asyncio.sleep(3600 * 6)
+    STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+    LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+    DEFINITIONS = {
+        "bot_jobs_total": ("counter", "Dokončené úlohy podle druhu a výsledného stavu."),
+        "bot_download_bytes_total": ("counter", "Stažené bajty podle progress hooků yt-dlp."),
+        "bot_stage_duration_seconds": ("histogram", "Délka fází zpracování (extract, search, download, transcode, ...)."),
+        "bot_archive_lookups_total": ("counter", "Dotazy do download archivu podle výsledku."),
+        "bot_content_store_lookups_total": ("counter", "Dotazy do úložiště obsahu podle výsledku."),
+        "bot_event_loop_lag_seconds": ("histogram", "Zpoždění event loopu oproti plánovanému probuzení."),
+        "bot_event_loop_blocks_total": ("counter", "Zablokování event loopu delší než LOOP_BLOCK_THRESHOLD."),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)
+        self._histograms = {}
+        self.loop_lag = 0.0
+        self._runner = None
+        self._lag_task = None
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name: str, value: float, buckets: tuple = STAGE_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def observe_stage(self, stage: str, seconds: float):
+        self.observe("bot_stage_duration_seconds", seconds, stage=stage)
+
+    @staticmethod
+    def _labels(labels, extra: dict = None) -> str:
+        items = list(labels) + list((extra or {}).items())
+        if not items:
+            return ""
+        def escape(value) -> str:
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in items) + "}"
+
+    def render(self) -> str:
+        """Všechny metriky v textovém formátu Prometheus 0.0.4."""
+        lines = []
+        gauges = {
+            "bot_jobs_active": ("Právě běžící úlohy.", len(JOB_QUEUE.running)),
+            "bot_jobs_queued": ("Úlohy čekající ve frontě.", len(JOB_QUEUE.pending)),
+            "bot_transcodes_active": ("Právě běžící převody zvuku.", TRANSCODE_POOL.active),
+            "bot_event_loop_lag_last_seconds": ("Poslední naměřené zpoždění event loopu.", self.loop_lag),
+            "bot_bandwidth_limit_bytes": ("Aktuální společný limit stahování v B/s (0 = bez omezení).", BANDWIDTH.limit() or 0),
+        }
+        for name, (help_text, value) in gauges.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {**value, "counts": list(value["counts"])} for key, value in self._histograms.items()}
+        for name, (kind, help_text) in self.DEFINITIONS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{self._labels(labels)} {int(value) if value.is_integer() else value}")
+                continue
+            for (metric, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                    lines.append(f"{name}_bucket{self._labels(labels, {'le': f'{bound:g}'})} {count}")
+                lines.append(f"{name}_bucket{self._labels(labels, {'le': '+Inf'})} {histogram['count']}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{name}_count{self._labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    async def _measure_loop_lag(self):
+        """Měří, o kolik se probuzení z `asyncio.sleep` opozdí – blokující kód v event loopu."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.loop_lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+            self.observe("bot_event_loop_lag_seconds", self.loop_lag, buckets=self.LAG_BUCKETS)
+
+    async def _handle(self, request):
+        return web.Response(text=self.render(), content_type="text/plain; version=0.0.4", charset="utf-8", headers={"Cache-Control": "no-store"})
+
+    async def start(self, host: str, port: int):
+        """Spustí měření zpoždění loopu a HTTP endpoint /metrics (jen jednou, chyba bota nezastaví)."""
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.create_task(self._measure_loop_lag())
+        if not port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError as e:
+            await runner.cleanup()
+            logging.error(f"❌ Endpoint metrik na {host}:{port} se nepodařilo spustit: {e}")
             return
+        self._runner = runner
+        logging.info(f"📈 Metriky jsou dostupné na http://{host}:{port}/metrics")
 
-        for playlist_id, data in playlists_to_check.items():
-            playlist_url = data.get("url")
-            playlist_folder_rel = data.get("folder") 
-            
-            if not playlist_url or not playlist_folder_rel:
+METRICS = Metrics()
+STAGE_OBSERVERS.append(METRICS.observe_stage)
+
+class LoopWatchdog:
+    """
+    Hlídá, zda event loop neblokuje synchronní kód (NAS, subprocess, zápis logu).
+    Loop pravidelně zapisuje "tep"; vlákno watchdogu při jeho vynechání delším než
+    `threshold` zaloguje zásobník vlákna loopu – jednou za každé zablokování.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._beat = time.monotonic()
+        self._loop = None
+        self._loop_thread_id = None
+        self._thread = None
+
+    def start(self):
+        """Spustí hlídání aktuálního event loopu (jen jednou)."""
+        if self.threshold <= 0 or self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logging.info(f"🐕 Watchdog event loopu hlídá zablokování delší než {self.threshold:g} s.")
+
+    def _heartbeat(self):
+        self._beat = time.monotonic()
+        self._loop.call_later(self.threshold / 4, self._heartbeat)
+
+    def _watch(self):
+        blocked_since = None
+        while True:
+            time.sleep(self.threshold / 4)
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold:
+                if blocked_since is not None:
+                    logging.warning(f"🐢 Event loop se uvolnil po {beat - blocked_since:.2f} s blokování.")
+                    blocked_since = None
                 continue
+            if blocked_since is not None:
+                continue
+            blocked_since = beat
+            METRICS.inc("bot_event_loop_blocks_total")
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(zásobník není dostupný)\n"
+            logging.warning(f"🐢 Event loop je zablokován už {stalled:.2f} s, zásobník vlákna loopu:\n{stack.rstrip()}")
 
-            logging.info(f"🔍 Kontroluji playlist: {playlist_url}")
-            
-            # Tato funkce je pouze pro Spotify, takže cílová složka je pevně daná
-            out_dir = os.path.join(BASE_DOWNLOAD_DIR, AUDIO_DIR_NAME, playlist_folder_rel)
-            ensure_folder(out_dir)
-            
-            opts = {
-                "format": "bestaudio",
-                "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
-                "download_archive": DOWNLOAD_ARCHIVE_FILE, 
-                "ignoreerrors": True, # PŘIDÁNO: Ignoruje chyby v playlistu
-                "postprocessors": [{
-                    "key": "FFmpegExtractAudio",
-                    "preferredcodec": "mp3",
-                    "preferredquality": "192",
-                }]
-            }
-            
-            try:
-                # Blokující volání v executoru
-                token = await asyncio.to_thread(get_spotify_token, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET)
-                tracks = await asyncio.to_thread(get_spotify_playlist_tracks, playlist_url, token)
-                
-                download_urls = []
-                for track in tracks:
-                    query = f"ytsearch1:{track['title']} {track['artist']}".strip()
-                    download_urls.append(query)
-                        
-                if download_urls:
-                    await asyncio.to_thread(yt_dlp.YoutubeDL(opts).download, download_urls)
-                    
-                    logging.info(f"✅ Úspěšně zkontrolováno {len(download_urls)} skladeb z playlistu: {playlist_url}")
-                    total_songs_checked += len(download_urls) 
+LOOP_WATCHDOG = LoopWatchdog(LOOP_BLOCK_THRESHOLD)
+
+class SamplingProfiler:
+    """
+    Vzorkovací profiler všech vláken procesu (event loop, stahování, executory).
+    Výsledek je ve formátu collapsed stacks ("vlákno;funkce;...;funkce počet"),
+    který přímo načte flamegraph.pl nebo speedscope.app.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.running = False
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def run(self, seconds: float) -> tuple:
+        """Vzorkuje `seconds` sekund (blokuje, volá se z vlákna). Vrací (Counter zásobníků, počet vzorků)."""
+        self.running = True
+        own = threading.get_ident()
+        stacks = collections.Counter()
+        samples = 0
+        names = {}
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                if samples % 200 == 0:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(self._frame_name(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, f"thread-{ident}"))
+                    stacks[";".join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(self.interval)
+        finally:
+            self.running = False
+        return stacks, samples
+
+    @staticmethod
+    def top_functions(stacks: collections.Counter, limit: int = 10) -> list:
+        """Nejčastější funkce na vrcholu zásobníku (vlastní čas) jako [(vlákno, funkce, vzorky)]."""
+        leaves = collections.Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            leaves[(frames[0], frames[-1])] += count
+        return [(thread, function, count) for (thread, function), count in leaves.most_common(limit)]
+
+PROFILER = SamplingProfiler()
+
+# -------------------------------------------
+# Správa dat
+# -------------------------------------------
+class StateStore:
+    """
+    Stav bota v SQLite (WAL): archiv stažených položek, sledované playlisty a cache
+    vyhledávání. Každé vlákno i proces má vlastní připojení, zápisy jsou transakční
+    a dotaz na archiv je indexovaný (bez načítání celého souboru do paměti).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS archive (
+            media_key TEXT PRIMARY KEY,
+            added_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS playlists (
+            playlist_id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            snapshot_id TEXT,
+            check_interval INTEGER,
+            next_run REAL
+        );
+        CREATE TABLE IF NOT EXISTS playlist_tracks (
+            playlist_id TEXT NOT NULL,
+            track_key TEXT NOT NULL,
+            PRIMARY KEY (playlist_id, track_key)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS spotify_resolution (
+            track_key TEXT PRIMARY KEY,
+            entry TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            url TEXT NOT NULL,
+            as_audio INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            user_name TEXT NOT NULL,
+            channel_id INTEGER,
+            created_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS job_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL,
+            item_key TEXT,
+            state TEXT NOT NULL,
+            payload TEXT,
+            at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, seq);
+        CREATE TABLE IF NOT EXISTS content (
+            media_key TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            path TEXT NOT NULL,
+            name TEXT NOT NULL,
+            size INTEGER,
+            added_at REAL NOT NULL,
+            PRIMARY KEY (media_key, variant)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS library (
+            path TEXT PRIMARY KEY,
+            dir TEXT NOT NULL,
+            media_key TEXT,
+            variant TEXT,
+            url TEXT,
+            title TEXT,
+            size INTEGER,
+            duration REAL,
+            codec TEXT,
+            inode INTEGER,
+            user_id INTEGER,
+            user_name TEXT,
+            mtime REAL,
+            added_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS library_dir ON library (dir);
+        CREATE INDEX IF NOT EXISTS library_media ON library (media_key, variant);
+        CREATE TABLE IF NOT EXISTS library_dirs (
+            path TEXT PRIMARY KEY,
+            parent TEXT,
+            mtime_ns INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS library_dirs_parent ON library_dirs (parent);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    # Objekt se předává i do procesů yt-dlp (jako download_archive) – přenáší se jen cesta
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            ensure_folder(os.path.dirname(self.path))
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._upgrade_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _upgrade_schema(conn: sqlite3.Connection):
+        """Doplní sloupce přidané v novějších verzích do již existující databáze."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(playlists)")}
+        for name, definition in (("check_interval", "INTEGER"), ("next_run", "REAL")):
+            if name not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE playlists ADD COLUMN {name} {definition}")
+                except sqlite3.OperationalError:
+                    # Sloupec mezitím přidalo jiné připojení
+                    pass
+
+    def _write(self, statements):
+        """Provede zápisy v jedné transakci (BEGIN IMMEDIATE – souběžní zapisovatelé čekají)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in statements:
+                if isinstance(params, list):
+                    conn.executemany(sql, params)
                 else:
-                    logging.info(f"✅ Žádné skladby k nalezení v playlistu: {playlist_url}")
+                    conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
 
-            except Exception as e:
-                logging.error(f"❌ Chyba při automatické kontrole playlistu '{playlist_url}': {e}")
-                
-        if total_songs_checked > 0:
-            await send_dm_to_owner(f"✅ Automatická kontrola dokončena. Zkontrolováno {total_songs_checked} skladeb v playlistech (již stažené byly přeskočeny).")
-        else:
-            logging.info("✅ Kontrola dokončena. Nebyly nalezeny žádné skladby ke kontrole.")
+    # --- Drobná metadata (otisky, cache kontrol při startu) ---
+    def meta_get(self, key: str):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
 
-    except Exception as e:
-        logging.error(f"❌ Kritická chyba při automatické kontrole playlistů: {e}")
-        await send_dm_to_owner(f"❌ Kritická chyba při automatické kontrole playlistů.", str(e))
-    
-    if not manual_run:
-        await asyncio.sleep(3600 * 6)
+    def meta_set(self, key: str, value: str):
+        self._write([("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))])
 
-def is_owner_or_designated_channel(interaction: discord.Interaction):
-    """Kontroluje, zda příkaz přichází od vlastníka nebo z povoleného kanálu."""
-    if DISCORD_OWNER_ID and interaction.user.id == int(DISCORD_OWNER_ID):
-        return True
-    
-    if DISCORD_CHANNEL_ID and str(interaction.channel_id) == DISCORD_CHANNEL_ID:
+    # --- Archiv stažených položek ---
+    def archive_contains(self, media_key: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM archive WHERE media_key = ?", (media_key,)).fetchone() is not None
+
+    def archive_add(self, media_key: str):
+        self._write([("INSERT OR IGNORE INTO archive (media_key, added_at) VALUES (?, ?)", (media_key, time.time()))])
+
+    def archive_remove(self, media_keys: list):
+        """Odebere položky z archivu, aby je další stahování nepřeskočilo."""
+        self._write([("DELETE FROM archive WHERE media_key = ?", (key,)) for key in media_keys])
+
+    def archive_missing(self, media_keys: list) -> set:
+        """Vrátí ty klíče, které v archivu nejsou."""
+        return {key for key in media_keys if not self.archive_contains(key)}
+
+    # --- Sledované playlisty ---
+    def list_playlists(self) -> dict:
+        rows = self._conn().execute("SELECT playlist_id, url, folder, snapshot_id, check_interval, next_run FROM playlists").fetchall()
+        return {
+            row[0]: {"url": row[1], "folder": row[2], "snapshot_id": row[3], "check_interval": row[4], "next_run": row[5]}
+            for row in rows
+        }
+
+    def playlist_tracks(self, playlist_id: str) -> set:
+        rows = self._conn().execute("SELECT track_key FROM playlist_tracks WHERE playlist_id = ?", (playlist_id,)).fetchall()
+        return {row[0] for row in rows}
+
+    def save_playlist(self, playlist_id: str, url: str, folder: str, next_run: float = None):
+        self._write([(
+            "INSERT INTO playlists (playlist_id, url, folder, next_run) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(playlist_id) DO UPDATE SET url = excluded.url, folder = excluded.folder, "
+            "next_run = COALESCE(excluded.next_run, playlists.next_run)",
+            (playlist_id, url, folder, next_run),
+        )])
+
+    def set_playlist_next_run(self, playlist_id: str, next_run: float):
+        self._write([("UPDATE playlists SET next_run = ? WHERE playlist_id = ?", (next_run, playlist_id))])
+
+    def set_playlist_interval(self, playlist_id: str, check_interval: int) -> bool:
+        if not self._conn().execute("SELECT 1 FROM playlists WHERE playlist_id = ?", (playlist_id,)).fetchone():
+            return False
+        self._write([("UPDATE playlists SET check_interval = ? WHERE playlist_id = ?", (check_interval, playlist_id))])
         return True
-    
-    # Příkazy pro správu (sync, stop, shutdown, silent) mohou používat jen vlastníci
-    if interaction.command.name in ['sync', 'stop', 'shutdown', 'silent']:
-        return DISCORD_OWNER_ID and interaction.user.id == int(DISCORD_OWNER_ID)
 
-    return False
+    def save_playlist_snapshot(self, playlist_id: str, snapshot_id: str, added: set, removed: set):
+        """Uloží verzi snapshotu a změny v množině zpracovaných skladeb (jen rozdíl, ne celý seznam)."""
+        self._write([
+            ("UPDATE playlists SET snapshot_id = ? WHERE playlist_id = ?", (snapshot_id, playlist_id)),
+            ("INSERT OR IGNORE INTO playlist_tracks (playlist_id, track_key) VALUES (?, ?)", [(playlist_id, key) for key in added]),
+            ("DELETE FROM playlist_tracks WHERE playlist_id = ? AND track_key = ?", [(playlist_id, key) for key in removed]),
+        ])
 
-async def send_dm_to_owner(message: str, error_details: str = None, log_file: str = None):
-    """Odešle soukromou zprávu vlastníkovi bota."""
-    if not DISCORD_OWNER_ID:
-        logging.warning("Nelze odeslat soukromou zprávu, DISCORD_OWNER_ID není nastaven.")
-        return
+    # --- Cache vyhledávání Spotify skladeb ---
+    def get_resolution(self, track_key: str):
+        row = self._conn().execute("SELECT entry FROM spotify_resolution WHERE track_key = ?", (track_key,)).fetchone()
+        return json.loads(row[0]) if row else None
 
-    try:
-        user = await bot.fetch_user(int(DISCORD_OWNER_ID))
-        if user:
-            dm_message = f"**Upozornění bota:** {message}"
-            if error_details:
-                dm_message += f"\n\n**Chyba:**\n```\n{error_details}\n```"
-            if log_file:
-                dm_message += f"\nPodrobnosti najdete v logu: `{log_file}`"
-            await user.send(dm_message)
-    except discord.Forbidden:
-        logging.error("Nemám oprávnění posílat soukromé zprávy uživateli s tímto ID.")
-    except discord.HTTPException as e:
-        logging.error(f"Chyba při odesílání soukromé zprávy: {e}")
-    except ValueError:
-        logging.error("DISCORD_OWNER_ID není platné číslo.")
+    def put_resolution(self, track_key: str, entry: dict):
+        self._write([("INSERT OR REPLACE INTO spotify_resolution (track_key, entry) VALUES (?, ?)", (track_key, json.dumps(entry, ensure_ascii=False)))])
 
-def sanitize_filename(filename: str):
-    """Odstraní nepovolené znaky z názvu složky."""
-    return re.sub(r'[\\/*?:"<>|]', "", filename)
+    # --- Úložiště obsahu ---
+    def content_get(self, media_key: str, variant: str):
+        row = self._conn().execute(
+            "SELECT path, name, size FROM content WHERE media_key = ? AND variant = ?", (media_key, variant)
+        ).fetchone()
+        return {"path": row[0], "name": row[1], "size": row[2], "media_key": media_key, "variant": variant} if row else None
 
-def detect_platform(url: str):
-    if re.search(r"tiktok\.com", url, re.I):
-        return "tiktok"
-    if re.search(r"instagram\.com", url, re.I):
-        return "instagram"
-    if re.search(r"open\.spotify\.com/playlist|spotify:playlist|spotify\.com/playlist", url, re.I):
-        return "spotify_playlist"
-    if re.search(r"youtube\.com/playlist\?list=|youtube\.com/watch\?v=.+&list=", url, re.I):
-        return "youtube_playlist"
-    if re.search(r"youtube\.com|youtu\.be", url, re.I):
-        return "youtube"
-    if re.search(r"open\.spotify\.com/track|spotify:track|spotify\.com/track", url, re.I):
-        return "spotify_track"
-    if re.search(r"googleusercontent\.com/spotify\.com/\d+", url, re.I):
-        return "spotify_test_url"
-    return None
+    def content_put(self, media_key: str, variant: str, path: str, name: str, size: int):
+        self._write([(
+            "INSERT OR REPLACE INTO content (media_key, variant, path, name, size, added_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (media_key, variant, path, name, size, time.time()),
+        )])
 
-def format_speed(speed_bytes):
-    """Formátuje rychlost v bajtech do čitelného formátu (KiB/s, MiB/s)."""
-    if speed_bytes is None:
-        return "N/A"
-    if speed_bytes < 1024:
-        return f"{speed_bytes} B/s"
-    elif speed_bytes < 1024**2:
-        return f"{speed_bytes/1024:.2f} KiB/s"
-    elif speed_bytes < 1024**3:
-        return f"{speed_bytes/1024**2:.2f} MiB/s"
-    else:
-        return f"{speed_bytes/1024**3:.2f} GiB/s"
+    def content_delete(self, media_key: str, variant: str):
+        self._write([("DELETE FROM content WHERE media_key = ? AND variant = ?", (media_key, variant))])
+
+    # --- Knihovna stažených souborů ---
+    LIBRARY_COLUMNS = ("path", "dir", "media_key", "variant", "url", "title", "size", "duration", "codec", "inode", "user_id", "user_name", "mtime", "added_at")
+
+    def library_put(self, records: list, replace: bool = True):
+        """Zapíše záznamy souborů; s `replace=False` se už známé cesty nepřepisují (sken složek)."""
+        if not records:
+            return
+        columns = ", ".join(self.LIBRARY_COLUMNS)
+        placeholders = ", ".join("?" * len(self.LIBRARY_COLUMNS))
+        self._write([(
+            f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO library ({columns}) VALUES ({placeholders})",
+            [tuple(record.get(column) for column in self.LIBRARY_COLUMNS) for record in records],
+        )])
+
+    def library_find(self, media_key: str, variant: str) -> list:
+        rows = self._conn().execute(
+            f"SELECT {', '.join(self.LIBRARY_COLUMNS)} FROM library WHERE media_key = ? AND variant = ? ORDER BY added_at",
+            (media_key, variant),
+        ).fetchall()
+        return [dict(zip(self.LIBRARY_COLUMNS, row)) for row in rows]
+
+    def library_search(self, terms: list, limit: int) -> list:
+        """Soubory, jejichž název nebo cesta obsahuje všechna slova z `terms` (bez ohledu na velikost písmen)."""
+        conditions, params = [], []
+        for term in terms:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            conditions.append("(title LIKE ? ESCAPE '\\' OR path LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern]
+        rows = self._conn().execute(
+            f"SELECT path, title, user_name, size, duration, added_at FROM library "
+            f"WHERE {' AND '.join(conditions) or '1'} ORDER BY added_at DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        return [dict(zip(("path", "title", "user_name", "size", "duration", "added_at"), row)) for row in rows]
+
+    def library_usage(self) -> dict:
+        """Souhrn obsazeného místa: celkem, bez započtení hardlinků a podle uživatelů."""
+        conn = self._conn()
+        files, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM library").fetchone()
+        unique = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM library GROUP BY COALESCE(inode, path))"
+        ).fetchone()[0]
+        users = conn.execute(
+            "SELECT user_name, COUNT(*), COALESCE(SUM(size), 0) FROM library GROUP BY user_name ORDER BY 3 DESC"
+        ).fetchall()
+        return {"files": files, "size": size, "unique": unique, "users": users}
+
+    def library_in_dir(self, directory: str) -> set:
+        return {row[0] for row in self._conn().execute("SELECT path FROM library WHERE dir = ?", (directory,))}
+
+    def library_dir_mtime(self, path: str):
+        row = self._conn().execute("SELECT mtime_ns FROM library_dirs WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def library_dir_children(self, path: str) -> list:
+        return [row[0] for row in self._conn().execute("SELECT path FROM library_dirs WHERE parent = ?", (path,))]
+
+    def library_sync_dir(self, path: str, parent: str, mtime_ns: int, added: list, removed: set, removed_dirs: set):
+        """Uloží výsledek skenu jedné složky v jedné transakci (nové a zmizelé soubory i podsložky)."""
+        statements = []
+        if added:
+            columns = ", ".join(self.LIBRARY_COLUMNS)
+            placeholders = ", ".join("?" * len(self.LIBRARY_COLUMNS))
+            statements.append((
+                f"INSERT OR IGNORE INTO library ({columns}) VALUES ({placeholders})",
+                [tuple(record.get(column) for column in self.LIBRARY_COLUMNS) for record in added],
+            ))
+        if removed:
+            statements.append(("DELETE FROM library WHERE path = ?", [(item,) for item in removed]))
+        for directory in removed_dirs:
+            statements += self._library_forget_statements(directory)
+        statements.append(("INSERT OR REPLACE INTO library_dirs (path, parent, mtime_ns) VALUES (?, ?, ?)", (path, parent, mtime_ns)))
+        self._write(statements)
+
+    @staticmethod
+    def _library_forget_statements(directory: str) -> list:
+        """Smazání celého podstromu složky (soubory i záznamy podsložek)."""
+        prefix = directory.rstrip(os.sep) + os.sep
+        return [
+            ("DELETE FROM library WHERE dir = ? OR substr(dir, 1, ?) = ?", (directory, len(prefix), prefix)),
+            ("DELETE FROM library_dirs WHERE path = ? OR substr(path, 1, ?) = ?", (directory, len(prefix), prefix)),
+        ]
+
+    def library_forget_dir(self, path: str):
+        self._write(self._library_forget_statements(path))
+
+    # --- Žurnál úloh (pouze přidávání záznamů) ---
+    JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+
+    def journal_job(self, job) -> int:
+        """Zapíše zadání nové úlohy a její stav "queued". Vrací trvalé ID úlohy."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, url, as_audio, user_id, user_name, channel_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job.kind, job.url, int(job.as_audio), job.user_id, job.user_name, job.channel_id, job.created_at),
+            )
+            conn.execute("INSERT INTO job_events (job_id, state, at) VALUES (?, 'queued', ?)", (cursor.lastrowid, time.time()))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.lastrowid
+
+    def journal_event(self, job_id: int, state: str, item_key: str = None, payload: dict = None):
+        """Přidá záznam o stavu úlohy (nebo její položky, je-li zadán `item_key`)."""
+        self._write([(
+            "INSERT INTO job_events (job_id, item_key, state, payload, at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, item_key, state, json.dumps(payload, ensure_ascii=False) if payload is not None else None, time.time()),
+        )])
+
+    def _job_state_sql(self) -> str:
+        states = ", ".join(f"'{state}'" for state in self.JOB_STATES)
+        return (f"(SELECT state FROM job_events e WHERE e.job_id = jobs.job_id AND e.item_key IS NULL "
+                f"AND e.state IN ({states}) ORDER BY e.seq DESC LIMIT 1)")
+
+    def unfinished_jobs(self) -> list:
+        """Úlohy, jejichž poslední stav je "queued" nebo "running", i s počtem dosavadních spuštění."""
+        rows = self._conn().execute(
+            "SELECT job_id, kind, url, as_audio, user_id, user_name, channel_id, created_at, "
+            "(SELECT COUNT(*) FROM job_events e WHERE e.job_id = jobs.job_id AND e.item_key IS NULL AND e.state = 'running') "
+            f"FROM jobs WHERE {self._job_state_sql()} IN ('queued', 'running') ORDER BY job_id"
+        ).fetchall()
+        keys = ("job_id", "kind", "url", "as_audio", "user_id", "user_name", "channel_id", "created_at", "runs")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def journal_done_items(self, job_id: int) -> set:
+        """Položky úlohy, jejichž poslední záznam je "done"."""
+        rows = self._conn().execute(
+            "SELECT item_key, state FROM job_events WHERE job_id = ? AND item_key IS NOT NULL ORDER BY seq", (job_id,)
+        ).fetchall()
+        latest = {}
+        for item_key, state in rows:
+            latest[item_key] = state
+        return {item_key for item_key, state in latest.items() if state == "done"}
+
+    def journal_plan(self, job_id: int):
+        """Naposledy uložený plán úlohy (např. seznam položek playlistu), nebo None."""
+        row = self._conn().execute(
+            "SELECT payload FROM job_events WHERE job_id = ? AND item_key IS NULL AND state = 'planned' ORDER BY seq DESC LIMIT 1",
+            (job_id,),
+        ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def prune_journal(self, older_than: float):
+        """Smaže záznamy dokončených úloh starších než `older_than` (timestamp)."""
+        finished = f"{self._job_state_sql()} IN ('done', 'failed', 'cancelled')"
+        self._write([
+            (f"DELETE FROM job_events WHERE job_id IN (SELECT job_id FROM jobs WHERE created_at < ? AND {finished})", (older_than,)),
+            ("DELETE FROM jobs WHERE created_at < ? AND NOT EXISTS (SELECT 1 FROM job_events e WHERE e.job_id = jobs.job_id)", (older_than,)),
+        ])
+
+    # --- Jednorázová migrace z původních souborů ---
+    @staticmethod
+    def _legacy_path(name: str):
+        # Původní soubory ležely v pracovním adresáři, zkusíme ho i složku bota
+        for candidate in (os.path.abspath(name), os.path.join(DATA_DIR, name)):
+            if os.path.exists(candidate):
+                return candidate
+        return None
+
+    def migrate_legacy_files(self):
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_migrated'").fetchone():
+            return
+
+        statements = []
+        archive_path = self._legacy_path(DOWNLOAD_ARCHIVE_FILE)
+        if archive_path:
+            with open(archive_path, "r", encoding="utf-8") as f:
+                keys = {line.strip() for line in f if line.strip()}
+            statements.append(("INSERT OR IGNORE INTO archive (media_key, added_at) VALUES (?, ?)", [(key, time.time()) for key in keys]))
+            logging.info(f"📦 Migruji {len(keys)} záznamů archivu z {archive_path}.")
+
+        playlists_path = self._legacy_path(PLAYLIST_DATA_FILE)
+        if playlists_path:
+            try:
+                with open(playlists_path, "r", encoding="utf-8") as f:
+                    playlists = json.load(f)
+            except json.JSONDecodeError:
+                logging.error(f"❌ Soubor {playlists_path} je poškozen, sledované playlisty nebudou převedeny.")
+                playlists = {}
+            for playlist_id, data in playlists.items():
+                if not data.get("url") or not data.get("folder"):
+                    continue
+                statements.append(("INSERT OR REPLACE INTO playlists (playlist_id, url, folder, snapshot_id) VALUES (?, ?, ?, ?)",
+                                   (playlist_id, data["url"], data["folder"], data.get("snapshot_id"))))
+                statements.append(("INSERT OR IGNORE INTO playlist_tracks (playlist_id, track_key) VALUES (?, ?)",
+                                   [(playlist_id, key) for key in data.get("tracks") or []]))
+            logging.info(f"📦 Migruji {len(playlists)} sledovaných playlistů z {playlists_path}.")
+
+        resolution_path = self._legacy_path(RESOLUTION_CACHE_FILE)
+        if resolution_path:
+            try:
+                with open(resolution_path, "r", encoding="utf-8") as f:
+                    resolutions = json.load(f)
+            except json.JSONDecodeError:
+                resolutions = {}
+            statements.append(("INSERT OR REPLACE INTO spotify_resolution (track_key, entry) VALUES (?, ?)",
+                               [(key, json.dumps(entry, ensure_ascii=False)) for key, entry in resolutions.items()]))
+
+        statements.append(("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_migrated', ?)", (str(time.time()),)))
+        self._write(statements)
+
+        # Původní soubory ponecháme jako zálohu, ale už se nepoužívají
+        for path in (archive_path, playlists_path, resolution_path):
+            if path:
+                os.replace(path, f"{path}.migrated")
+        logging.info("✅ Migrace stavu do SQLite dokončena.")
+
+class SqliteDownloadArchive:
+    """
+    Download archiv pro yt-dlp nad tabulkou `archive`. yt-dlp přijímá místo cesty
+    k souboru libovolný objekt s `in` a `add`, takže archiv se nenačítá celý.
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+
+    def __contains__(self, media_key: str) -> bool:
+        found = self.store.archive_contains(media_key)
+        METRICS.inc("bot_archive_lookups_total", check="ytdlp", result="hit" if found else "miss")
+        return found
+
+    def add(self, media_key: str):
+        self.store.archive_add(media_key)
+
+STATE_STORE = StateStore(STATE_DB_FILE)
+DOWNLOAD_ARCHIVE = SqliteDownloadArchive(STATE_STORE)
+
+class ResolutionCache:
+    """
+    Trvalá cache výsledků hledání `ytsearch1:` pro Spotify skladby. Klíčem je
+    normalizovaný (název, interpret), hodnotou nalezené YouTube video, takže
+    stejnou skladbu už podruhé (ani pro jiného uživatele) nevyhledáváme.
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+
+    @staticmethod
+    def key(title: str, artist: str) -> str:
+        return f"{(title or '').strip().lower()}\t{(artist or '').strip().lower()}"
+
+    def get(self, title: str, artist: str):
+        return self.store.get_resolution(self.key(title, artist))
+
+    def put(self, title: str, artist: str, entry: dict):
+        self.store.put_resolution(self.key(title, artist), entry)
+
+RESOLUTION_CACHE = ResolutionCache(STATE_STORE)
+
+# ioctl FICLONE (Linux) – reflink na Btrfs/XFS, kopie sdílí bloky s originálem
+FICLONE = 0x40049409
+
+class ContentStore:
+    """
+    Úložiště obsahu adresované klíčem média a variantou formátu. Každé video se
+    stáhne a uloží jen jednou (CONTENT_STORE_DIR/<varianta>/<klíč>.<přípona>),
+    do složek uživatelů se vkládá hardlink, případně reflink nebo kopie.
+    Další uživatel tak soubor dostane okamžitě a bez nového stahování.
+    """
+
+    def __init__(self, store: StateStore, root: str):
+        self.store = store
+        self.root = root
+
+    @staticmethod
+    def variant(ytdlp_opts: dict, transcode: dict = None) -> str:
+        """Varianta = otisk všeho, co ovlivňuje výsledný soubor (formát, spojení, převod zvuku)."""
+        recipe = {
+            "format": ytdlp_opts.get("format"),
+            "merge_output_format": ytdlp_opts.get("merge_output_format"),
+            "transcode": transcode,
+        }
+        digest = hashlib.sha1(json.dumps(recipe, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:12]
+        return f"{'audio' if transcode else 'video'}-{digest}"
+
+    @staticmethod
+    def link(source: str, target: str) -> str:
+        """Vytvoří `target` jako hardlink na `source`, jinak reflink, jinak kopii. Vrací použitou metodu."""
+        if os.path.exists(target):
+            return "existuje"
+        ensure_folder(os.path.dirname(target))
+        try:
+            os.link(source, target)
+            return "hardlink"
+        except OSError:
+            pass
+        try:
+            import fcntl
+            with open(source, "rb") as src, open(target, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except (ImportError, OSError):
+            if os.path.exists(target):
+                os.remove(target)
+        shutil.copy2(source, target)
+        return "kopie"
+
+    def _stored(self, media_key: str, variant: str):
+        record = self.store.content_get(media_key, variant)
+        if record and not os.path.exists(record["path"]):
+            self.store.content_delete(media_key, variant)
+            return None
+        return record
+
+    def lookup(self, media_key: str, variant: str):
+        """
+        Záznam uloženého souboru, nebo None (záznam bez souboru se smaže).
+        Chybí-li soubor v úložišti, ale knihovna zná jeho kopii ve složce
+        některého uživatele, kopie se do úložiště znovu zařadí.
+        """
+        record = self._stored(media_key, variant)
+        if record is None:
+            for entry in self.store.library_find(media_key, variant):
+                if os.path.exists(entry["path"]):
+                    self.publish(media_key, variant, entry["path"])
+                    record = self._stored(media_key, variant)
+                    break
+        return record
+
+    def materialize(self, record: dict, out_dir: str) -> str:
+        """Vloží uložený soubor do složky uživatele a vrátí jeho cestu."""
+        target = os.path.join(out_dir, record["name"])
+        with stage_timer("link"):
+            method = self.link(record["path"], target)
+        logging.info(f"🔗 `{record['name']}` vložen z úložiště do {out_dir} ({method}).")
+        LIBRARY.add_copy(target, record)
+        return target
+
+    def publish(self, media_key: str, variant: str, filepath: str):
+        """Uloží dokončený soubor do úložiště (hardlinkem, data se nekopírují)."""
+        if not filepath or not os.path.exists(filepath) or self._stored(media_key, variant):
+            return
+        ext = os.path.splitext(filepath)[1]
+        path = os.path.join(self.root, variant, sanitize_filename(media_key.replace(" ", "_")) + ext)
+        with stage_timer("publish"):
+            self.link(filepath, path)
+        self.store.content_put(media_key, variant, path, os.path.basename(filepath), os.path.getsize(path))
+
+CONTENT_STORE = ContentStore(STATE_STORE, CONTENT_STORE_DIR)
+
+# -------------------------------------------
+# Místo na disku a pracovní složka
+# -------------------------------------------
+
+def estimate_size(info: dict) -> int:
+    """Odhad velikosti stahování v bajtech z metadat yt-dlp (0 = neznámá)."""
+    if not info:
+        return 0
+    if info.get("entries"):
+        return sum(estimate_size(entry) for entry in info["entries"] if entry)
+    # Spojované video+zvuk má velikost v jednotlivých formátech; bez velikosti (HLS/DASH)
+    # odhadneme z datového toku (tbr v kbit/s) a délky
+    duration = info.get("duration") or 0
+    formats = info.get("requested_formats") or [info]
+    return int(sum(fmt.get("filesize") or fmt.get("filesize_approx") or (fmt.get("tbr") or 0) * 125 * duration for fmt in formats))
+
+def free_space(path: str) -> int:
+    """Volné místo svazku, na kterém leží `path` (nebo jeho nejbližší existující rodič)."""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+def ensure_free_space(path: str, needed: int = 0):
+    """Vyhodí ValueError, pokud by po stažení `needed` bajtů kleslo volné místo pod MIN_FREE_SPACE."""
+    free = free_space(path)
+    if free - needed < MIN_FREE_SPACE:
+        raise ValueError(
+            f"Na úložišti dochází místo: volných {free / 1024**3:.1f} GiB, potřeba {needed / 1024**3:.1f} GiB "
+            f"a rezerva {MIN_FREE_SPACE / 1024**3:.1f} GiB."
+        )
+
+class StagingArea:
+    """
+    Lokální pracovní složka pro stahování. yt-dlp do ní zapisuje .part soubory,
+    stopy ke spojení i náhledy a převod zvuku běží tamtéž; na úložiště (OMV) se
+    přesune jen hotový soubor jedním sekvenčním zápisem. Každé stahování má
+    vlastní podsložku odvozenou z cílové šablony a URL, takže přerušené
+    stahování po restartu naváže na svůj .part soubor.
+    """
+
+    # Spojení videa se zvukem nebo převod potřebuje na chvíli místo pro obě kopie
+    SPACE_FACTOR = 2
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def prepare(self, opts: dict, key: str, needed: int = 0) -> tuple:
+        """Vrátí (možnosti yt-dlp, pracovní složka); bez pracovní složky (None) se stahuje přímo do cíle."""
+        if not self.root or not isinstance(opts.get("outtmpl"), str):
+            return opts, None
+        if needed and free_space(self.root) < needed * self.SPACE_FACTOR:
+            logging.warning(f"⚠️ V pracovní složce {self.root} není místo pro {needed / 1024**2:.0f} MiB, stahuji přímo na úložiště.")
+            return opts, None
+        workdir = os.path.join(self.root, hashlib.sha1(f"{opts['outtmpl']}|{key}".encode("utf-8")).hexdigest()[:16])
+        ensure_folder(workdir)
+        return {**opts, "outtmpl": os.path.join(workdir, os.path.basename(opts["outtmpl"]))}, workdir
+
+    @staticmethod
+    def finalize(filepath: str, final_dir: str) -> str:
+        """Přesune hotový soubor z pracovní složky do cílové složky a vrátí novou cestu."""
+        target = os.path.join(final_dir, os.path.basename(filepath))
+        ensure_folder(final_dir)
+        with stage_timer("move"):
+            # Mezi svazky shutil.move kopíruje celý soubor najednou a originál smaže
+            shutil.move(filepath, target)
+        return target
+
+    @staticmethod
+    def discard(workdir: str):
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def prune(self, max_age: float) -> int:
+        """Smaže pracovní složky přerušených stahování starší než `max_age` sekund."""
+        if not self.root or not os.path.isdir(self.root):
+            return 0
+        removed = 0
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.root):
+            if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        return removed
+
+STAGING = StagingArea(STAGING_DIR)
+
+# -------------------------------------------
+# Knihovna stažených souborů
+# -------------------------------------------
+class LibraryIndex:
+    """
+    Trvalý index všech souborů ve složkách uživatelů (tabulka `library`).
+    Dokončená stahování se zapisují hned (i s URL, délkou a kodekem), ruční
+    změny na úložišti dohání sken, který znovu prochází jen složky se změněným
+    mtime – u ostatních se použijí podsložky známé z minulého skenu.
+    """
+
+    # Nedokončené a pomocné soubory yt-dlp se neindexují
+    SKIP_SUFFIXES = (".part", ".ytdl", ".temp", ".tmp")
+    # Složka změněná těsně před skenem může dostat další soubor se stejným (hrubým) mtime;
+    # uloží se jako neověřená a příští sken ji přečte znovu
+    RACY_SECONDS = 2
+
+    def __init__(self, store: StateStore, roots: list):
+        self.store = store
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.last_scan = None
+        self._lock = threading.Lock()
+        self._task = None
+
+    def owner(self, path: str):
+        """Složka uživatele (první úroveň pod Zvuk/Video), do které soubor patří."""
+        for root in self.roots:
+            relative = os.path.relpath(path, root)
+            if not relative.startswith(os.pardir) and os.sep in relative:
+                return relative.split(os.sep, 1)[0]
+        return None
+
+    def _record(self, path: str, stat: os.stat_result, **fields) -> dict:
+        return {
+            "path": path,
+            "dir": os.path.dirname(path),
+            "title": os.path.splitext(os.path.basename(path))[0],
+            "size": stat.st_size,
+            "inode": stat.st_ino,
+            "user_name": self.owner(path),
+            "mtime": stat.st_mtime,
+            "added_at": time.time(),
+            **{key: value for key, value in fields.items() if value is not None},
+        }
+
+    def add(self, item: dict, variant: str = None, transcode: dict = None):
+        """Zapíše dokončený soubor (položka z _downloaded_file po převodu a přesunu)."""
+        path = item.get("filepath")
+        if not path or not os.path.exists(path):
+            return
+        path = os.path.abspath(path)
+        if transcode and path.endswith("." + transcode["codec"]):
+            codec = transcode["codec"]
+        else:
+            codec = "/".join(c for c in (item.get("vcodec"), item.get("acodec")) if c and c != "none") or None
+        job = CURRENT_JOB.get()
+        self.store.library_put([self._record(
+            path, os.stat(path),
+            media_key=item.get("media_key"), variant=variant, url=item.get("url"),
+            title=item.get("title"), duration=item.get("duration"), codec=codec,
+            user_id=job.user_id if job else None,
+        )])
+
+    def add_copy(self, path: str, record: dict):
+        """Zapíše soubor vložený z úložiště obsahu; metadata převezme z dřívějšího záznamu stejného média."""
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            return
+        known = next(iter(self.store.library_find(record["media_key"], record["variant"])), {})
+        job = CURRENT_JOB.get()
+        self.store.library_put([self._record(
+            path, os.stat(path),
+            media_key=record["media_key"], variant=record["variant"], url=known.get("url"),
+            title=known.get("title"), duration=known.get("duration"), codec=known.get("codec"),
+            user_id=job.user_id if job else None,
+        )])
+
+    def search(self, query: str, limit: int = LIBRARY_SEARCH_LIMIT) -> list:
+        return self.store.library_search(query.split(), limit)
+
+    def reconcile(self) -> dict:
+        """Porovná index se složkami (blokuje, volá se z vlákna). Vrací počty prošlých a změněných položek."""
+        stats = {"dirs": 0, "scanned": 0, "added": 0, "removed": 0}
+        with self._lock:
+            started = time.perf_counter()
+            racy_after = int((time.time() - self.RACY_SECONDS) * 1e9)
+            stack = [(root, None) for root in self.roots]
+            while stack:
+                path, parent = stack.pop()
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    self.store.library_forget_dir(path)
+                    continue
+                stats["dirs"] += 1
+                if self.store.library_dir_mtime(path) == mtime_ns:
+                    # Obsah složky se nezměnil, stačí projít známé podsložky
+                    stack.extend((child, path) for child in self.store.library_dir_children(path))
+                    continue
+
+                stats["scanned"] += 1
+                files, subdirs = {}, []
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(self.SKIP_SUFFIXES):
+                            files[entry.path] = entry
+                known = self.store.library_in_dir(path)
+                added = [self._record(file_path, entry.stat()) for file_path, entry in files.items() if file_path not in known]
+                removed = known - files.keys()
+                removed_dirs = set(self.store.library_dir_children(path)) - set(subdirs)
+                # Uloží se mtime zjištěný před výpisem – změna během skenu se projeví příště
+                self.store.library_sync_dir(path, parent, mtime_ns if mtime_ns < racy_after else 0, added, removed, removed_dirs)
+                stats["added"] += len(added)
+                stats["removed"] += len(removed)
+                stack.extend((child, path) for child in subdirs)
+            self.last_scan = time.time()
+        logging.info(
+            f"📚 Sken knihovny: {stats['dirs']} složek, přečteno {stats['scanned']}, "
+            f"+{stats['added']} / -{stats['removed']} souborů za {time.perf_counter() - started:.2f} s."
+        )
+        return stats
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.reconcile)
+            except Exception as e:
+                logging.error(f"❌ Sken knihovny selhal: {e}")
+            if LIBRARY_SCAN_INTERVAL <= 0:
+                return
+            await asyncio.sleep(LIBRARY_SCAN_INTERVAL)
+
+LIBRARY = LibraryIndex(STATE_STORE, [os.path.join(BASE_DOWNLOAD_DIR, AUDIO_DIR_NAME), os.path.join(BASE_DOWNLOAD_DIR, VIDEO_DIR_NAME)])
+
+# -------------------------------------------
+# Prioritní pruhy
+# -------------------------------------------
+# Interaktivní úlohy (jedno video, jedna skladba) mají přednost před hromadnou
+# prací (playlisty, kontrola sledovaných playlistů). Hromadná práce neustupuje
+# uprostřed stahování, ale na hranicích položek.
+
+LANES = ("interactive", "bulk")
+BULK_JOB_KINDS = {"spotify_playlist", "youtube_playlist_video", "youtube_playlist_audio", "batch"}
+
+def current_lane() -> str:
+    """Pruh právě běžící práce; kód mimo úlohu (plánovač playlistů) je hromadný."""
+    job = CURRENT_JOB.get()
+    return job.lane if job else "bulk"
+
+class PrioritySlots:
+    """
+    Omezený počet slotů (jako asyncio.Semaphore), uvolněný slot ale dostane
+    nejdřív čekající z interaktivního pruhu a teprve potom hromadná práce.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = max(1, slots)
+        self.active = 0
+        self._waiters = {lane: collections.deque() for lane in LANES}
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, lane: str = None):
+        lane = lane or current_lane()
+        if self.active < self.slots and not any(self._waiters.values()):
+            self.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[lane].append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Slot nám už byl předán – vrátíme ho dalšímu
+                    self._release()
+                else:
+                    with contextlib.suppress(ValueError):
+                        self._waiters[lane].remove(future)
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        # Slot se předává přímo dalšímu čekajícímu, počet obsazených se nemění
+        for lane in LANES:
+            waiters = self._waiters[lane]
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self.active -= 1
+
+class LaneGate:
+    """
+    Hranice položek hromadné práce. Dokud běží interaktivní úloha, smí hromadná
+    práce mít rozběhnutých nejvýše `bulk_while_interactive` položek; další
+    položky počkají, až interaktivní úlohy doběhnou.
+    """
+
+    def __init__(self, bulk_while_interactive: int):
+        self.bulk_while_interactive = max(0, bulk_while_interactive)
+        self.interactive = 0
+        self.bulk_items = 0
+        self._changed = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    @contextlib.asynccontextmanager
+    async def job(self, lane: str):
+        """Označí běh úlohy; interaktivní úloha přiměje hromadnou práci ustoupit."""
+        if lane != "interactive":
+            yield
+            return
+        self.interactive += 1
+        try:
+            yield
+        finally:
+            self.interactive -= 1
+            async with self._condition():
+                self._condition().notify_all()
+
+    @contextlib.asynccontextmanager
+    async def item(self):
+        """Jedna položka hromadné práce (v interaktivní úloze se neomezuje)."""
+        if current_lane() == "interactive":
+            yield
+            return
+        async with self._condition():
+            await self._condition().wait_for(lambda: self.interactive == 0 or self.bulk_items < self.bulk_while_interactive)
+            self.bulk_items += 1
+        try:
+            yield
+        finally:
+            self.bulk_items -= 1
+            async with self._condition():
+                self._condition().notify_all()
+
+LANE_GATE = LaneGate(BULK_ITEMS_WHILE_INTERACTIVE)
+
+# -------------------------------------------
+# Fronta stahování
+# -------------------------------------------
+
+class DownloadJob:
+    """Jedna úloha stahování ve frontě (jedna URL od jednoho uživatele)."""
+
+    def __init__(self, kind: str, url: str, user_id: int, user_name: str, channel_id: int,
+                 interaction: discord.Interaction = None, as_audio: bool = False):
+        self.job_id = None
+        self.kind = kind
+        self.url = url
+        self.as_audio = as_audio
+        self.user_id = user_id
+        self.user_name = user_name
+        self.channel_id = channel_id
+        self.interaction = interaction
+        self.title = url
+        self.state = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.task = None
+        # Obnovená úloha ze žurnálu: již dokončené položky a uložený plán
+        self.restored = False
+        self.done_items = set()
+        self.plan = None
+
+    @classmethod
+    def from_journal(cls, record: dict):
+        """Znovu sestaví nedokončenou úlohu ze žurnálu (bez interakce, zprávy jdou do kanálu)."""
+        job = cls(record["kind"], record["url"], record["user_id"], record["user_name"], record["channel_id"],
+                  as_audio=bool(record["as_audio"]))
+        job.job_id = record["job_id"]
+        job.created_at = record["created_at"]
+        job.restored = True
+        job.done_items = STATE_STORE.journal_done_items(job.job_id)
+        job.plan = STATE_STORE.journal_plan(job.job_id)
+        return job
+
+    def journal(self, state: str, item_key: str = None, payload: dict = None):
+        """Zapíše stav úlohy (nebo položky) do žurnálu; chyba zápisu úlohu nezastaví."""
+        try:
+            STATE_STORE.journal_event(self.job_id, state, item_key, payload)
+        except sqlite3.Error as e:
+            logging.warning(f"Zápis do žurnálu úlohy #{self.job_id} selhal: {e}")
+
+    @classmethod
+    def from_interaction(cls, kind: str, url: str, interaction: discord.Interaction, as_audio: bool = False):
+        return cls(kind, url, interaction.user.id, interaction.user.name, interaction.channel_id,
+                   interaction=interaction, as_audio=as_audio)
+
+    async def send(self, content: str, ephemeral: bool = False):
+        """
+        Odešle zprávu k úloze. Dokud je token interakce platný, použije followup,
+        jinak (úloha čekala ve frontě příliš dlouho) pošle zprávu přímo do kanálu.
+        """
+        if self.interaction and time.time() - self.created_at < INTERACTION_FOLLOWUP_TTL:
+            return await self.interaction.followup.send(content, ephemeral=ephemeral)
+        if ephemeral:
+            # Ephemeral zprávu bez platné interakce poslat nelze
+            return None
+        channel = bot.get_channel(self.channel_id) or await bot.fetch_channel(self.channel_id)
+        return await channel.send(content)
+
+    @property
+    def lane(self) -> str:
+        return "bulk" if self.kind in BULK_JOB_KINDS else "interactive"
+
+    def describe(self) -> str:
+        return f"`#{self.job_id}` {self.title} ({self.user_name})"
+
+class DownloadQueue:
+    """
+    Omezená fronta úloh. Nejvýše `workers` úloh běží současně, každý uživatel
+    může mít nejvýše `per_user_active` běžících a `per_user_queued` čekajících úloh.
+    Interaktivní úlohy se spouští před hromadnými a hromadné smí obsadit nejvýše
+    `workers - 1` slotů, takže pro interaktivní úlohu zůstává volný slot (s jediným
+    workerem počká na dokončení běžící úlohy). Běžící hromadná práce navíc během
+    interaktivní úlohy omezí rozběhnuté položky (LANE_GATE).
+    """
+
+    def __init__(self, workers: int, limit: int, per_user_active: int, per_user_queued: int):
+        self.workers = max(1, workers)
+        self.limit = limit
+        self.per_user_active = max(1, per_user_active)
+        self.per_user_queued = per_user_queued
+        self.pending = collections.deque()
+        self.running = {}
+        # Úlohy, které právě dostávají ID v žurnálu – už se počítají do limitů
+        self._admitting = []
+        self._wakeup = None
+        self._dispatcher = None
+        self._restored = False
+
+    def start(self):
+        """Spustí dispečera fronty (volání je idempotentní, např. při opětovném on_ready)."""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._wakeup.set()
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    def _count_for_user(self, jobs, user_id: int) -> int:
+        return sum(1 for job in jobs if job.user_id == user_id)
+
+    async def submit(self, job: DownloadJob) -> int:
+        """Zařadí úlohu do fronty a vrátí její pozici. Při překročení limitů vyhodí ValueError."""
+        waiting = list(self.pending) + self._admitting
+        if len(waiting) >= self.limit:
+            raise ValueError("Fronta stahování je plná, zkus to prosím později.")
+        if self._count_for_user(waiting, job.user_id) >= self.per_user_queued:
+            raise ValueError(f"Máš ve frontě už {self.per_user_queued} čekajících úloh.")
+
+        # Trvalé ID ze žurnálu – úloha přežije /stop, restart i pád bota
+        self._admitting.append(job)
+        try:
+            job.job_id = await asyncio.to_thread(STATE_STORE.journal_job, job)
+        finally:
+            self._admitting.remove(job)
+        self.pending.append(job)
+        logging.info(f"📥 Úloha #{job.job_id} ({job.kind}, {job.lane}) zařazena do fronty: {job.url}")
+        if self._wakeup:
+            self._wakeup.set()
+        return self.ordered_pending().index(job) + 1
+
+    def ordered_pending(self) -> list:
+        """Čekající úlohy v pořadí, v jakém se budou spouštět (interaktivní napřed)."""
+        return [job for lane in LANES for job in self.pending if job.lane == lane]
+
+    async def restore(self) -> list:
+        """
+        Po startu znovu zařadí nedokončené úlohy ze žurnálu (jen jednou, ne při
+        každém opětovném připojení). Úlohy, které už JOB_MAX_RESTARTS× nedoběhly,
+        se označí jako neúspěšné, aby pád neopakovaly donekonečna.
+        """
+        if self._restored:
+            return []
+        self._restored = True
+        restored = await asyncio.to_thread(self._load_journal)
+        for job in restored:
+            self.pending.append(job)
+            logging.info(f"♻️ Obnovuji úlohu #{job.job_id} ({job.kind}) ze žurnálu: {job.url}")
+        if restored and self._wakeup:
+            self._wakeup.set()
+        return restored
+
+    @staticmethod
+    def _load_journal() -> list:
+        """Načte nedokončené úlohy ze žurnálu (běží ve vlákně, mimo event loop)."""
+        STATE_STORE.prune_journal(time.time() - JOB_JOURNAL_RETENTION_DAYS * 86400)
+        jobs = []
+        for record in STATE_STORE.unfinished_jobs():
+            if record["runs"] >= JOB_MAX_RESTARTS:
+                STATE_STORE.journal_event(record["job_id"], "failed")
+                logging.warning(f"⚠️ Úloha #{record['job_id']} nedoběhla ani po {record['runs']} pokusech, vzdávám ji: {record['url']}")
+                continue
+            jobs.append(DownloadJob.from_journal(record))
+        return jobs
+
+    def _next_runnable(self):
+        # Celkem nejvýše `workers` úloh; interaktivní smí na libovolný volný slot,
+        # hromadné jen na `workers - 1` z nich. Limit na uživatele platí v každém pruhu zvlášť.
+        if len(self.running) >= self.workers:
+            return None
+        bulk_slots = max(1, self.workers - 1)
+        for job in self.ordered_pending():
+            same_lane = [running for running in self.running.values() if running.lane == job.lane]
+            if job.lane != "interactive" and len(same_lane) >= bulk_slots:
+                continue
+            if self._count_for_user(same_lane, job.user_id) < self.per_user_active:
+                return job
+        return None
+
+    async def _dispatch_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                job = self._next_runnable()
+                if job is None:
+                    break
+                self.pending.remove(job)
+                job.state = "running"
+                job.started_at = time.time()
+                # U obnovené úlohy by čekání zahrnovalo i dobu, kdy bot neběžel
+                if not job.restored:
+                    observe_stage("queue_wait", job.started_at - job.created_at)
+                self.running[job.job_id] = job
+                job.task = asyncio.create_task(self._run(job))
+
+    async def _run(self, job: DownloadJob):
+        logging.info(f"▶️ Spouštím úlohu #{job.job_id} ({job.kind}): {job.url}")
+        CURRENT_JOB.set(job)
+        try:
+            await asyncio.to_thread(job.journal, "running")
+            async with LANE_GATE.job(job.lane):
+                await JOB_RUNNERS[job.kind](job)
+            if job.state == "running":
+                job.state = "done"
+            await asyncio.to_thread(job.journal, job.state)
+        except asyncio.CancelledError:
+            # Zrušení uživatelem (/dlstop) se zapíše; zrušení při vypínání bota ne – úloha se po startu obnoví
+            if job.state == "cancelled":
+                await asyncio.to_thread(job.journal, "cancelled")
+            job.state = "cancelled"
+        except Exception as e:
+            job.state = "failed"
+            await asyncio.to_thread(job.journal, "failed")
+            logging.error(f"❌ Neošetřená chyba v úloze #{job.job_id}: {e}")
+        finally:
+            self.running.pop(job.job_id, None)
+            observe_stage("job", time.time() - job.started_at)
+            METRICS.inc("bot_jobs_total", kind=job.kind, state=job.state)
+            logging.info(f"⏹️ Úloha #{job.job_id} skončila se stavem '{job.state}' za {time.time() - job.started_at:.1f} s.")
+            self._wakeup.set()
+
+    def get(self, job_id: int):
+        if job_id in self.running:
+            return self.running[job_id]
+        return next((job for job in self.pending if job.job_id == job_id), None)
+
+    def jobs_for_user(self, user_id: int):
+        return [job for job in list(self.running.values()) + list(self.pending) if job.user_id == user_id]
+
+    async def cancel(self, job: DownloadJob) -> bool:
+        """Zruší čekající nebo běžící úlohu."""
+        if job in self.pending:
+            self.pending.remove(job)
+            job.state = "cancelled"
+            await asyncio.to_thread(job.journal, "cancelled")
+            logging.info(f"🛑 Čekající úloha #{job.job_id} byla zrušena.")
+            return True
+        if job.task and not job.task.done():
+            job.state = "cancelled"
+            job.task.cancel()
+            logging.info(f"🛑 Běžící úloha #{job.job_id} byla zrušena.")
+            return True
+        return False
+
+JOB_QUEUE = DownloadQueue(DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_LIMIT, MAX_ACTIVE_JOBS_PER_USER, MAX_QUEUED_JOBS_PER_USER)
+
+# -------------------------------------------
+# Pomocné a asynchronní funkce
+# -------------------------------------------
+
+def spotify_track_key(track: dict) -> str:
+    """ID skladby pro porovnání snapshotů playlistu (Spotify ID, jinak název a interpret)."""
+    return track.get('id') or ResolutionCache.key(track.get('title'), track.get('artist'))
+
+async def sync_tracked_playlist(playlist_id: str, data: dict) -> int:
+    """
+    Porovná aktuální obsah sledovaného playlistu s uloženým snapshotem a vyhledá
+    a stáhne jen nově přidané skladby. Vrací počet nově zpracovaných skladeb.
+    """
+    playlist_url = data.get("url")
+    # Tato funkce je pouze pro Spotify, takže cílová složka je pevně daná
+    out_dir = os.path.join(BASE_DOWNLOAD_DIR, AUDIO_DIR_NAME, data.get("folder"))
+
+    playlist_info = await asyncio.to_thread(get_spotify_playlist_info, playlist_url)
+    snapshot_id = (playlist_info or {}).get("snapshot_id")
+    handled = await asyncio.to_thread(STATE_STORE.playlist_tracks, playlist_id)
+    if snapshot_id and snapshot_id == data.get("snapshot_id") and handled:
+        logging.info(f"✅ Playlist {playlist_url} se od poslední kontroly nezměnil (snapshot {snapshot_id}).")
+        return 0
+
+    opts = {
+        "format": "bestaudio",
+        "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
+        "download_archive": DOWNLOAD_ARCHIVE, 
+        "ignoreerrors": True, # PŘIDÁNO: Ignoruje chyby v playlistu
+        # Převod na MP3 probíhá až po stažení v TRANSCODE_POOL
+    }
+    current = set()
+    added = []
+    resolved = []
+
+    async def new_entries():
+        # Stránky playlistu se vyhledávají a stahují průběžně, jak přicházejí
+        async for page in iter_spotify_playlist_tracks(playlist_url):
+            page_added = [track for track in page if spotify_track_key(track) not in handled]
+            current.update(spotify_track_key(track) for track in page)
+            if not page_added:
+                continue
+            await asyncio.to_thread(ensure_folder, out_dir)
+            entries = await resolve_spotify_tracks(page_added)
+            added.extend(page_added)
+            resolved.extend(entries)
+            yield [entry for entry in entries if entry]
+
+    summary = await download_playlist_items(new_entries(), opts, None, playlist_url, transcode=AUDIO_TRANSCODE)
+    logging.info(f"🔍 Playlist {playlist_url}: {len(current)} skladeb, nových {len(added)}.")
+
+    failed_media = set(summary["failed_keys"])
+    # Nenalezené nebo neúspěšně stažené skladby zkusíme znovu při další kontrole
+    failed_keys = {
+        spotify_track_key(track) for track, entry in zip(added, resolved)
+        if entry is None or media_key(entry) in failed_media
+    }
+
+    # Odebrané skladby ze snapshotu vypadnou, nově zpracované přibudou.
+    # Snapshot posouváme jen při úplném úspěchu, jinak by se chybějící skladby přeskočily.
+    await asyncio.to_thread(
+        STATE_STORE.save_playlist_snapshot, playlist_id,
+        snapshot_id if not failed_keys else data.get("snapshot_id"),
+        current - handled - failed_keys, handled - current,
+    )
+    return len(added) - len(failed_keys)
+
+class PlaylistScheduler:
+    """
+    Plánovač pravidelné kontroly sledovaných playlistů. Spouští se jednou (opětovné
+    on_ready ho nezdvojí), každý playlist má vlastní interval s náhodným rozptylem
+    a čas příští kontroly je uložen v databázi, takže přežije i restart bota.
+    Kontrola jednoho playlistu běží vždy nejvýše jednou – ruční /check se
+    k probíhající kontrole připojí, místo aby spustil další. Playlisty se kontrolují
+    souběžně přes sdílený omezený pool (PLAYLIST_SWEEP_CONCURRENCY).
+    """
+
+    def __init__(self, concurrency: int = PLAYLIST_SWEEP_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self._task = None
+        self._wakeup = None
+        self._pool = None
+        self._inflight = {}
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def _slots(self) -> asyncio.Semaphore:
+        # Sdílený pool pro plánované i ruční kontroly
+        if self._pool is None:
+            self._pool = asyncio.Semaphore(self.concurrency)
+        return self._pool
+
+    def wake(self):
+        """Probudí plánovač, např. po přidání playlistu nebo změně intervalu."""
+        if self._wakeup:
+            self._wakeup.set()
+
+    @staticmethod
+    def next_run_after_check(data: dict, failed: bool = False) -> float:
+        interval = data.get("check_interval") or PLAYLIST_CHECK_INTERVAL
+        if failed:
+            interval = min(interval, PLAYLIST_RETRY_DELAY)
+        jitter = random.uniform(-PLAYLIST_CHECK_JITTER, PLAYLIST_CHECK_JITTER)
+        return time.time() + interval * (1 + jitter)
+
+    async def _run(self):
+        await bot.wait_until_ready()
+        logging.info("⏰ Plánovač kontroly playlistů spuštěn.")
+        while True:
+            self._wakeup.clear()
+            try:
+                playlists = await asyncio.to_thread(STATE_STORE.list_playlists)
+                now = time.time()
+                due = [playlist_id for playlist_id, data in playlists.items() if (data["next_run"] or 0) <= now]
+                if due:
+                    await self.run_sweep(due)
+                    continue
+                next_run = min((data["next_run"] for data in playlists.values()), default=None)
+                timeout = PLAYLIST_CHECK_INTERVAL if next_run is None else max(1.0, next_run - now)
+            except Exception as e:
+                logging.error(f"❌ Chyba v plánovači kontroly playlistů: {e}")
+                timeout = 60
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def check_playlist(self, playlist_id: str, data: dict) -> asyncio.Task:
+        """Spustí kontrolu playlistu, nebo vrátí tu, která už běží (single-flight)."""
+        task = self._inflight.get(playlist_id)
+        if task is None:
+            task = asyncio.create_task(self._check(playlist_id, data))
+            self._inflight[playlist_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(playlist_id, None))
+        else:
+            logging.info(f"🔁 Kontrola playlistu {data.get('url')} už běží, připojuji se k ní.")
+        return task
+
+    async def _check(self, playlist_id: str, data: dict) -> dict:
+        """Zkontroluje jeden playlist a vrátí výsledek s počtem nových skladeb a dobou trvání."""
+        playlist_url = data.get("url")
+        result = {"playlist_id": playlist_id, "url": playlist_url, "new": 0, "elapsed": 0.0, "error": None}
+        async with self._slots():
+            logging.info(f"🔍 Kontroluji playlist: {playlist_url}")
+            started = time.monotonic()
+            try:
+                result["new"] = await sync_tracked_playlist(playlist_id, data)
+            except Exception as e:
+                result["error"] = str(e)
+                logging.error(f"❌ Chyba při automatické kontrole playlistu '{playlist_url}': {e}")
+            finally:
+                result["elapsed"] = time.monotonic() - started
+                await asyncio.to_thread(
+                    STATE_STORE.set_playlist_next_run, playlist_id, self.next_run_after_check(data, result["error"] is not None)
+                )
+        return result
+
+    async def run_sweep(self, playlist_ids: list = None) -> int:
+        """
+        Zkontroluje zadané (nebo všechny) sledované playlisty a vrátí počet nových skladeb.
+        Již běžící kontroly se nespouští znovu, jen se na ně počká.
+        """
+        logging.info("⏳ Zahajuji kontrolu nových skladeb v sledovaných playlistech.")
+        total_new_songs = 0
+        try:
+            playlists = await asyncio.to_thread(STATE_STORE.list_playlists)
+            if playlist_ids is not None:
+                playlists = {playlist_id: playlists[playlist_id] for playlist_id in playlist_ids if playlist_id in playlists}
+            playlists = {playlist_id: data for playlist_id, data in playlists.items() if data.get("url") and data.get("folder")}
+            if not playlists:
+                logging.info("✅ Nejsou žádné playlisty ke kontrole.")
+                return 0
+
+            # Token se získá jednou a klient ho sdílí pro celou kontrolu (blokující volání v executoru)
+            try:
+                await asyncio.to_thread(SPOTIFY.token)
+            except Exception:
+                # Bez tokenu nelze kontrolovat nic – odložíme celou dávku, aby se plánovač nezacyklil
+                for playlist_id, data in playlists.items():
+                    await asyncio.to_thread(STATE_STORE.set_playlist_next_run, playlist_id, self.next_run_after_check(data, True))
+                raise
+            sweep_started = time.monotonic()
+            # shield: zrušení čekajícího (např. /check) nezruší sdílenou kontrolu
+            results = await asyncio.gather(*(
+                asyncio.shield(self.check_playlist(playlist_id, data)) for playlist_id, data in playlists.items()
+            ))
+            sweep_elapsed = time.monotonic() - sweep_started
+            total_new_songs = sum(result["new"] for result in results)
+
+            lines = []
+            for result in sorted(results, key=lambda r: r["elapsed"], reverse=True):
+                status = f"❌ {result['error']}" if result["error"] else f"{result['new']} nových"
+                lines.append(f"{result['url']}: {status} ({result['elapsed']:.1f} s)")
+            summary = "\n".join(lines)
+            logging.info(f"⏱️ Kontrola {len(results)} playlistů trvala {sweep_elapsed:.1f} s:\n{summary}")
+
+            if total_new_songs > 0 or any(result["error"] for result in results):
+                await send_dm_to_owner(
+                    f"✅ Automatická kontrola dokončena za {sweep_elapsed:.1f} s. "
+                    f"Staženo {total_new_songs} nových skladeb ze sledovaných playlistů.\n```\n{summary[:1500]}\n```"
+                )
+            else:
+                logging.info("✅ Kontrola dokončena. V playlistech nebyly nalezeny žádné nové skladby.")
+
+        except Exception as e:
+            logging.error(f"❌ Kritická chyba při automatické kontrole playlistů: {e}")
+            await send_dm_to_owner(f"❌ Kritická chyba při automatické kontrole playlistů.", str(e))
+        return total_new_songs
+
+PLAYLIST_SCHEDULER = PlaylistScheduler()
+
+def is_owner(interaction: discord.Interaction) -> bool:
+    """Kontroluje, zda příkaz přichází od vlastníka bota (bez výjimky pro povolený kanál)."""
+    return bool(DISCORD_OWNER_ID) and interaction.user.id == int(DISCORD_OWNER_ID)
+
+def is_owner_or_designated_channel(interaction: discord.Interaction) -> bool:
+    """Kontroluje, zda příkaz přichází od vlastníka nebo z povoleného kanálu."""
+    if is_owner(interaction):
+        return True
+    
+    if DISCORD_CHANNEL_ID and str(interaction.channel_id) == DISCORD_CHANNEL_ID:
+        return True
+    
+    # Příkazy pro správu (sync, stop, shutdown, silent) mohou používat jen vlastníci
+    if interaction.command.name in ['sync', 'stop', 'shutdown', 'silent']:
+        return is_owner(interaction)
+
+    return False
+
+async def send_dm_to_owner(message: str, error_details: str = None, log_file: str = None):
+    """Odešle soukromou zprávu vlastníkovi bota."""
+    if not DISCORD_OWNER_ID:
+        logging.warning("Nelze odeslat soukromou zprávu, DISCORD_OWNER_ID není nastaven.")
+        return
+
+    try:
+        user = await bot.fetch_user(int(DISCORD_OWNER_ID))
+        if user:
+            dm_message = f"**Upozornění bota:** {message}"
+            if error_details:
+                dm_message += f"\n\n**Chyba:**\n```\n{error_details}\n```"
+            if log_file:
+                dm_message += f"\nPodrobnosti najdete v logu: `{log_file}`"
+            await user.send(dm_message)
+    except discord.Forbidden:
+        logging.error("Nemám oprávnění posílat soukromé zprávy uživateli s tímto ID.")
+    except discord.HTTPException as e:
+        logging.error(f"Chyba při odesílání soukromé zprávy: {e}")
+    except ValueError:
+        logging.error("DISCORD_OWNER_ID není platné číslo.")
+
+def sanitize_filename(filename: str):
+    """Odstraní nepovolené znaky z názvu složky."""
+    return re.sub(r'[\\/*?:"<>|]', "", filename)
+
+def detect_platform(url: str):
+    if re.search(r"tiktok\.com", url, re.I):
+        return "tiktok"
+    if re.search(r"instagram\.com", url, re.I):
+        return "instagram"
+    if re.search(r"open\.spotify\.com/playlist|spotify:playlist|spotify\.com/playlist", url, re.I):
+        return "spotify_playlist"
+    if re.search(r"youtube\.com/playlist\?list=|youtube\.com/watch\?v=.+&list=", url, re.I):
+        return "youtube_playlist"
+    if re.search(r"youtube\.com|youtu\.be", url, re.I):
+        return "youtube"
+    if re.search(r"open\.spotify\.com/track|spotify:track|spotify\.com/track", url, re.I):
+        return "spotify_track"
+    if re.search(r"googleusercontent\.com/spotify\.com/\d+", url, re.I):
+        return "spotify_test_url"
+    return None
+
+# Kanonické ID podle platformy – ve tvaru klíče download archivu (viz media_key)
+CANONICAL_ID_PATTERNS = {
+    "youtube": ("Youtube", r"(?:[?&]v=|youtu\.be/|/shorts/|/live/|/embed/)([\w-]{11})"),
+    "tiktok": ("TikTok", r"/video/(\d+)"),
+    "instagram": ("Instagram", r"/(?:p|reels?|tv)/([\w-]+)"),
+}
+
+def canonical_entry(url: str, platform: str) -> dict:
+    """
+    Položka pro download_playlist_items. Se známým ID ji lze porovnat s archivem
+    a úložištěm obsahu bez volání yt-dlp; jinak se pozná jen podle URL.
+    """
+    ie_key, pattern = CANONICAL_ID_PATTERNS.get(platform, (None, None))
+    match = re.search(pattern, url) if pattern else None
+    if match:
+        return {"id": match.group(1), "ie_key": ie_key, "url": url, "title": url}
+    return {"url": url, "title": url}
+
+def extract_urls(text: str) -> list:
+    """Najde v textu všechny http(s) odkazy (oddělené mezerami, čárkami nebo řádky)."""
+    return [url.rstrip(".,;)>]'\"") for url in re.findall(r"https?://[^\s,<>\"']+", text or "")]
+
+def format_speed(speed_bytes):
+    """Formátuje rychlost v bajtech do čitelného formátu (KiB/s, MiB/s)."""
+    if speed_bytes is None:
+        return "N/A"
+    if speed_bytes < 1024:
+        return f"{speed_bytes} B/s"
+    elif speed_bytes < 1024**2:
+        return f"{speed_bytes/1024:.2f} KiB/s"
+    elif speed_bytes < 1024**3:
+        return f"{speed_bytes/1024**2:.2f} MiB/s"
+    else:
+        return f"{speed_bytes/1024**3:.2f} GiB/s"
+
+# -------------------------------------------
+# Řízení šířky pásma
+# -------------------------------------------
+# `ratelimit` yt-dlp platí jen pro jednu instanci YoutubeDL a počítá průměr od
+# začátku souboru. Místo něj má každé stahování vlastní token bucket, jehož
+# rychlost průběžně přiděluje jeden plánovač: limit se dělí spravedlivě mezi
+# uživatele (max-min) a pásmo, které někdo nevyužije, dostanou ostatní.
+
+def parse_bandwidth_schedule(spec: str) -> list:
+    """Převede "HH:MM-HH:MM=Mbit/s,..." na seznam (začátek, konec, B/s) v minutách od půlnoci."""
+    windows = []
+    for part in filter(None, (chunk.strip() for chunk in spec.split(","))):
+        match = re.fullmatch(r"(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=(\d+(?:\.\d+)?)", part)
+        if not match:
+            raise ValueError(f"Neplatné okno v BANDWIDTH_SCHEDULE: '{part}' (očekáváno HH:MM-HH:MM=Mbit/s).")
+        start_h, start_m, end_h, end_m, mbps = match.groups()
+        start, end = int(start_h) * 60 + int(start_m), int(end_h) * 60 + int(end_m)
+        if start > 24 * 60 or end > 24 * 60:
+            raise ValueError(f"Neplatný čas v BANDWIDTH_SCHEDULE: '{part}'.")
+        windows.append((start, end, float(mbps) * 1_000_000 / 8))
+    return windows
+
+def max_min_share(capacity: float, demands: dict) -> dict:
+    """
+    Max-min spravedlivé rozdělení kapacity (water-filling): kdo chce méně než
+    rovný díl, dostane, co chce, zbytek se dělí mezi ostatní. Zbude-li po
+    uspokojení všech kapacita, rozdělí se rovnoměrně jako rezerva pro růst.
+    """
+    shares = {}
+    remaining = dict(demands)
+    while remaining:
+        fair = capacity / len(remaining)
+        satisfied = {key: demand for key, demand in remaining.items() if demand <= fair}
+        if not satisfied:
+            shares.update({key: fair for key in remaining})
+            return shares
+        for key, demand in satisfied.items():
+            shares[key] = demand
+            capacity -= demand
+            del remaining[key]
+    spare = capacity / len(shares) if shares else 0
+    return {key: share + spare for key, share in shares.items()}
+
+class TokenBucket:
+    """
+    Token bucket jednoho stahování. Volá se z progress hooku yt-dlp s počtem
+    nově stažených bajtů a uspí vlákno, dokud stahování nesplatí dluh. Rychlost
+    se čte z `rate_source` při každém probuzení, takže změna přídělu platí hned.
+    """
+
+    SLICE = 0.25
+
+    def __init__(self, rate_source):
+        self.rate_source = rate_source
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, rate: float):
+        now = time.monotonic()
+        self.tokens = min(rate * BANDWIDTH_BURST_SECONDS, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def consume(self, amount: int, is_cancelled):
+        rate = self.rate_source()
+        if not rate:
+            self.tokens, self.updated = 0.0, time.monotonic()
+            return
+        self._refill(rate)
+        self.tokens -= amount
+        while self.tokens < 0 and not is_cancelled():
+            time.sleep(min(-self.tokens / rate, self.SLICE))
+            rate = self.rate_source()
+            if not rate:
+                self.tokens = 0.0
+                return
+            self._refill(rate)
+
+class BandwidthScheduler:
+    """
+    Přiděluje rychlost probíhajícím stahováním. Poptávku stahování odhaduje
+    z naměřené rychlosti: kdo svůj příděl vyčerpává, chce víc, ostatním se
+    příděl zmenší na to, co skutečně stahují (s rezervou pro růst).
+    """
+
+    # Stahování, které dosáhne tohoto podílu přídělu, je omezováno plánovačem
+    SATURATED = 0.8
+    HEADROOM = 1.25
+    WARMUP = 1.0
+    # Nejmenší příděl, aby se stahování po extrakci nebo pauze mohlo znovu rozběhnout
+    MIN_RATE = 64 * 1024
+
+    def __init__(self, default_limit: float, schedule: list):
+        self.default_limit = default_limit or None
+        self.schedule = schedule
+        self._lock = threading.Lock()
+        self._flows = {}
+        self._shared = None
+        self._last_limit = self.limit()
+        self._last_tick = time.monotonic()
+
+    def limit(self, now: datetime = None):
+        """Aktuální společný limit v B/s podle časového profilu (None = bez omezení)."""
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.schedule:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return rate or None
+        return self.default_limit
+
+    def attach_shared(self, shared):
+        """Režim procesů: příděly se zrcadlí do sdíleného slovníku, odkud je čtou podřízené procesy."""
+        with self._lock:
+            self._shared = shared
+            self._reallocate()
+
+    def register(self, token: str, user) -> None:
+        with self._lock:
+            self._flows[token] = {"user": user, "rate": None, "measured": 0.0, "bytes": 0,
+                                  "started": time.monotonic(), "window": time.monotonic()}
+            self._reallocate()
+
+    def unregister(self, token: str) -> None:
+        with self._lock:
+            if self._flows.pop(token, None) is not None:
+                self._reallocate()
+                if self._shared is not None:
+                    self._shared.pop(token, None)
+
+    def rate(self, token: str):
+        flow = self._flows.get(token)
+        return flow["rate"] if flow else None
+
+    def report(self, token: str, amount: int):
+        """Započítá stažené bajty; jednou za BANDWIDTH_REALLOCATE_INTERVAL přepočítá příděly."""
+        with self._lock:
+            flow = self._flows.get(token)
+            if flow is None:
+                return
+            flow["bytes"] += amount
+            now = time.monotonic()
+            if now - self._last_tick < BANDWIDTH_REALLOCATE_INTERVAL:
+                return
+            self._last_tick = now
+            for item in self._flows.values():
+                elapsed = now - item["window"]
+                if elapsed > 0:
+                    # Klouzavý průměr, aby jeden pomalý blok nesebral stahování příděl
+                    item["measured"] = 0.5 * item["measured"] + 0.5 * item["bytes"] / elapsed
+                item["bytes"], item["window"] = 0, now
+            limit = self.limit()
+            if limit != self._last_limit:
+                self._last_limit = limit
+                logging.info(f"📶 Limit šířky pásma změněn na {self.describe(limit)}.")
+            self._reallocate()
+
+    def _demand(self, flow: dict, now: float) -> float:
+        if flow["rate"] is None or now - flow["started"] < self.WARMUP or flow["measured"] >= flow["rate"] * self.SATURATED:
+            return math.inf
+        return max(flow["measured"] * self.HEADROOM, self.MIN_RATE)
+
+    def _reallocate(self):
+        limit = self.limit()
+        if not limit:
+            for flow in self._flows.values():
+                flow["rate"] = None
+        else:
+            now = time.monotonic()
+            by_user = collections.defaultdict(dict)
+            for token, flow in self._flows.items():
+                by_user[flow["user"]][token] = self._demand(flow, now)
+            user_shares = max_min_share(limit, {user: sum(demands.values()) for user, demands in by_user.items()})
+            for user, demands in by_user.items():
+                for token, share in max_min_share(user_shares[user], demands).items():
+                    self._flows[token]["rate"] = share
+        if self._shared is not None:
+            # Zápis do sdíleného slovníku je IPC volání – jen při změně přídělu
+            for token, flow in self._flows.items():
+                if flow.get("published", 0) != flow["rate"]:
+                    self._shared[token] = flow["published"] = flow["rate"]
+
+    @staticmethod
+    def describe(limit) -> str:
+        return f"{limit * 8 / 1_000_000:g} Mbit/s" if limit else "bez omezení"
+
+BANDWIDTH = BandwidthScheduler(BANDWIDTH_LIMIT_MBPS * 1_000_000 / 8, parse_bandwidth_schedule(BANDWIDTH_SCHEDULE))
+
+# -------------------------------------------
+# Spouštění yt-dlp (vlákna / procesy)
+# -------------------------------------------
+
+# Stav podřízeného procesu, nastavuje jej _init_ytdlp_process
+_WORKER_EVENT_QUEUE = None
+_WORKER_CANCEL_FLAGS = None
+_WORKER_RATES = None
+
+def _init_ytdlp_process(event_queue, cancel_flags, rates):
+    """Inicializace podřízeného procesu: fronta událostí zpět do bota, příznaky zrušení a příděly pásma."""
+    global _WORKER_EVENT_QUEUE, _WORKER_CANCEL_FLAGS, _WORKER_RATES
+    _WORKER_EVENT_QUEUE = event_queue
+    _WORKER_CANCEL_FLAGS = cancel_flags
+    _WORKER_RATES = rates
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(WorkerLogHandler(event_queue))
+
+def _progress_event(d: dict) -> dict:
+    """Zmenší progress dict yt-dlp na serializovatelnou podobu (bez info_dict)."""
+    keys = ("status", "downloaded_bytes", "total_bytes", "total_bytes_estimate", "speed", "eta", "filename")
+    return {key: d.get(key) for key in keys}
+
+def _downloaded_file(info: dict) -> dict:
+    """Údaje o dokončeném souboru pro další zpracování (převod zvuku)."""
+    return {
+        "filepath": info.get("filepath"),
+        "title": info.get("track") or info.get("title"),
+        "artist": info.get("artist") or info.get("uploader"),
+        "album": info.get("album"),
+        "acodec": info.get("acodec"),
+        "vcodec": info.get("vcodec"),
+        "duration": info.get("duration"),
+        "url": info.get("webpage_url") or info.get("original_url"),
+        "media_key": media_key(info) if info.get("id") else None,
+    }
+
+def _run_ytdlp_download(urls: list, opts: dict, emit, is_cancelled, info: dict = None, bucket: TokenBucket = None) -> tuple:
+    """
+    Spustí yt-dlp stahování. Běží ve vlákně nebo v podřízeném procesu,
+    události předává přes `emit(druh, data)`. Pokud je předán `info` z dřívější
+    extrakce, stahuje se z něj bez opětovného volání extraktoru. `bucket`
+    omezuje rychlost stahování podle přídělu plánovače pásma.
+    Vrací (návratový kód, seznam dokončených souborů).
+    """
+    import yt_dlp # Líné načtení, viz importy na začátku souboru
+    files = []
+    seen = {}
+
+    def progress_hook(d):
+        if bucket is not None and d.get("status") == "downloading":
+            # První hlášení souboru jen nastaví výchozí stav (navázání .part nepočítáme)
+            downloaded = d.get("downloaded_bytes") or 0
+            previous = seen.setdefault(d.get("filename"), downloaded)
+            if downloaded > previous:
+                seen[d.get("filename")] = downloaded
+                bucket.consume(downloaded - previous, is_cancelled)
+        if is_cancelled():
+            raise yt_dlp.utils.DownloadCancelled()
+        emit("progress", _progress_event(d))
+
+    def postprocessor_hook(d):
+        # MoveFiles běží jako poslední, info_dict už obsahuje konečnou cestu souboru
+        if d.get("postprocessor") == "MoveFiles" and d.get("status") == "finished":
+            files.append(_downloaded_file(d.get("info_dict") or {}))
+
+    opts = dict(opts)
+    opts["progress_hooks"] = [progress_hook]
+    opts["postprocessor_hooks"] = [postprocessor_hook]
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        if info is None:
+            return ydl.download(urls), files
+        try:
+            ydl.process_ie_result(info, download=True)
+            # S ignoreerrors chyby nevyhazují výjimku, jen nastaví návratový kód (stejně jako ydl.download)
+            return ydl._download_retcode, files
+        except yt_dlp.utils.DownloadCancelled:
+            raise
+        except yt_dlp.utils.YoutubeDLError as e:
+            # Např. expirované odkazy na formáty – zkusíme to znovu přes URL (stejně jako yt-dlp --load-info-json)
+            webpage_url = info.get("webpage_url")
+            if not webpage_url:
+                raise
+            logging.warning(f"Stažení z uložených metadat selhalo ({e}), zkouším znovu přes URL.")
+            return ydl.download([webpage_url]), files
+
+def _strip_private_keys(obj):
+    """Odstraní interní klíče yt-dlp ("__post_extractor" apod.), které po serializaci nejdou znovu použít."""
+    if isinstance(obj, dict):
+        return {key: _strip_private_keys(value) for key, value in obj.items() if not key.startswith("__")}
+    if isinstance(obj, list):
+        return [_strip_private_keys(value) for value in obj]
+    return obj
+
+def _run_ytdlp_extract(url: str, opts: dict) -> dict:
+    """Extrahuje metadata bez stahování a vrátí je v serializovatelné podobě."""
+    import yt_dlp
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        # Bez remove_private_keys – to by zahodilo i `entries` playlistů a vyhledávání
+        # a `requested_formats` (odhad velikosti), které dál potřebujeme
+        return _strip_private_keys(ydl.sanitize_info(info)) if info else None
+
+def _ytdlp_process_download(token: str, urls: list, opts: dict, info: dict = None) -> tuple:
+    """Vstupní bod stahování v podřízeném procesu."""
+    state = {"last_emit": 0.0, "last_check": 0.0, "cancelled": False, "last_rate": 0.0, "rate": None}
+
+    def emit(kind, payload):
+        # Průběh posíláme nejvýše 4× za sekundu, změny stavu vždy
+        now = time.monotonic()
+        if payload.get("status") == "downloading" and now - state["last_emit"] < 0.25:
+            return
+        state["last_emit"] = now
+        _WORKER_EVENT_QUEUE.put((token, kind, payload))
+
+    def is_cancelled():
+        # Dotaz na sdílený slovník je IPC volání, proto jej omezujeme
+        now = time.monotonic()
+        if not state["cancelled"] and now - state["last_check"] > 0.5:
+            state["last_check"] = now
+            state["cancelled"] = bool(_WORKER_CANCEL_FLAGS.get(token))
+        return state["cancelled"]
+
+    def rate():
+        # Příděl pásma od plánovače v hlavním procesu, čtený stejně šetrně
+        now = time.monotonic()
+        if now - state["last_rate"] > 0.5:
+            state["last_rate"] = now
+            state["rate"] = _WORKER_RATES.get(token)
+        return state["rate"]
+
+    try:
+        return _run_ytdlp_download(urls, opts, emit, is_cancelled, info, TokenBucket(rate))
+    except Exception as e:
+        # Výjimky yt-dlp nesou traceback a nemusí jít serializovat zpět do bota
+        raise RuntimeError(str(e)) from None
+
+def _ytdlp_process_extract(url: str, opts: dict) -> dict:
+    """Vstupní bod extrakce v podřízeném procesu."""
+    try:
+        return _run_ytdlp_extract(url, opts)
+    except Exception as e:
+        raise RuntimeError(str(e)) from None
+
+class YtdlpExecutor:
+    """
+    Spouští yt-dlp buď ve vláknech (výchozí), nebo v poolu samostatných procesů.
+    V režimu "process" se průběh vrací přes frontu událostí, kterou čte jedno
+    vlákno a předává ji zaregistrovaným progress hookům.
+    """
+
+    def __init__(self, mode: str, workers: int):
+        self.mode = mode if mode in ("thread", "process") else "thread"
+        self.workers = max(1, workers)
+        self._pool = None
+        self._manager = None
+        self._event_queue = None
+        self._cancel_flags = None
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def _ensure_pool(self):
+        with self._lock:
+            if self._pool is not None:
+                return self._pool
+            # "spawn" – fork procesu s běžícím event loopem a vlákny není bezpečný
+            ctx = multiprocessing.get_context("spawn")
+            self._manager = ctx.Manager()
+            self._event_queue = ctx.Queue()
+            self._cancel_flags = self._manager.dict()
+            rates = self._manager.dict()
+            BANDWIDTH.attach_shared(rates)
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=ctx,
+                initializer=_init_ytdlp_process,
+                initargs=(self._event_queue, self._cancel_flags, rates),
+            )
+            threading.Thread(target=self._pump_events, name="ytdlp-events", daemon=True).start()
+            logging.info(f"✅ Spuštěn pool {self.workers} procesů pro yt-dlp.")
+            return self._pool
+
+    def _pump_events(self):
+        while True:
+            token, kind, payload = self._event_queue.get()
+            if kind == "log":
+                # Záznam z podřízeného procesu – zapíše ho listener logu bota
+                logging.getLogger(payload.name).handle(payload)
+                continue
+            callback = self._callbacks.get(token)
+            if callback is None:
+                continue
+            try:
+                callback(kind, payload)
+            except Exception as e:
+                logging.warning(f"Chyba při zpracování události yt-dlp: {e}")
+
+    async def download(self, urls: list, opts: dict, progress_hook=None, info: dict = None, files: list = None) -> int:
+        """
+        Stáhne URL (nebo již extrahované `info`) a průběžně volá `progress_hook(d)`
+        (z jiného vlákna než event loop). Do `files` (je-li předán) doplní
+        dokončené soubory. Vrací návratový kód yt-dlp.
+        """
+        received = {}
+        token = uuid.uuid4().hex
+
+        def emit(kind, payload):
+            if kind != "progress":
+                return
+            # Přírůstek stažených bajtů pro metriky a plánovač pásma (každý soubor – video, zvuk – zvlášť)
+            downloaded = payload.get("downloaded_bytes") or 0
+            previous = received.get(payload.get("filename"), 0)
+            if downloaded > previous:
+                received[payload.get("filename")] = downloaded
+                METRICS.inc("bot_download_bytes_total", downloaded - previous)
+                BANDWIDTH.report(token, downloaded - previous)
+            if progress_hook:
+                progress_hook(payload)
+
+        # Pásmo se dělí mezi uživatele; stahování mimo úlohy (např. benchmark) sdílí jeden díl
+        job = CURRENT_JOB.get()
+        BANDWIDTH.register(token, job.user_id if job else None)
+        if BANDWIDTH.limit():
+            opts = {**opts, "buffersize": BANDWIDTH_BLOCK_SIZE, "noresizebuffer": True}
+        with stage_timer("download"):
+            if self.mode == "thread":
+                cancel_event = threading.Event()
+                bucket = TokenBucket(lambda: BANDWIDTH.rate(token))
+                try:
+                    retcode, downloaded = await asyncio.to_thread(_run_ytdlp_download, urls, opts, emit, cancel_event.is_set, info, bucket)
+                except asyncio.CancelledError:
+                    # Vlákno samo skončí při dalším volání progress hooku
+                    cancel_event.set()
+                    raise
+                finally:
+                    BANDWIDTH.unregister(token)
+            else:
+                pool = self._ensure_pool()
+                self._callbacks[token] = emit
+                try:
+                    # Seznam souborů se vrací výsledkem, ne frontou událostí – ta může doběhnout až po skončení
+                    retcode, downloaded = await asyncio.get_running_loop().run_in_executor(pool, _ytdlp_process_download, token, urls, opts, info)
+                except asyncio.CancelledError:
+                    self._cancel_flags[token] = True
+                    raise
+                finally:
+                    self._callbacks.pop(token, None)
+                    BANDWIDTH.unregister(token)
+
+        if files is not None:
+            files.extend(downloaded)
+        return retcode
+
+    async def extract(self, url: str, opts: dict, stage: str = "extract") -> dict:
+        """Extrahuje metadata bez stahování (délka se měří jako fáze `stage`)."""
+        with stage_timer(stage):
+            if self.mode == "thread":
+                return await asyncio.to_thread(_run_ytdlp_extract, url, opts)
+            pool = self._ensure_pool()
+            return await asyncio.get_running_loop().run_in_executor(pool, _ytdlp_process_extract, url, opts)
+
+YTDLP_EXECUTOR = YtdlpExecutor(YTDLP_EXECUTION_MODE, YTDLP_PROCESS_WORKERS)
+
+# -------------------------------------------
+# Převod zvuku (ffmpeg)
+# -------------------------------------------
+
+# Převod na MP3 192 kb/s (nebo jiný výstup podle AUDIO_OUTPUT_POLICY); u Spotify navíc tagy a obal alba
+AUDIO_TRANSCODE = {"codec": "mp3", "bitrate": "192k", "policy": AUDIO_OUTPUT_POLICY}
+SPOTIFY_AUDIO_TRANSCODE = {**AUDIO_TRANSCODE, "embed_metadata": True, "embed_thumbnail": True}
+
+FFMPEG_AUDIO_ENCODERS = {"mp3": "libmp3lame"}
+THUMBNAIL_EXTENSIONS = ("jpg", "jpeg", "png", "webp")
+# Kontejner pro přebalení streamu bez převodu
+REMUX_CONTAINERS = {"opus": "opus", "vorbis": "ogg", "aac": "m4a", "mp3": "mp3", "flac": "flac", "alac": "m4a"}
+# Kontejnery, do kterých umí obal alba vložit přímo ffmpeg (Ogg řeší mutagen, WebM obal nepodporuje)
+FFMPEG_COVER_CONTAINERS = {"mp3", "m4a", "mp4", "flac"}
+OGG_CONTAINERS = {"opus", "ogg"}
+
+class TranscodePool:
+    """
+    Druhá fáze stahování zvuku: yt-dlp stáhne nativní stream bez postprocessingu
+    a uvolní slot pro další stahování, zpracování pak běží v ffmpeg podprocesech
+    (nejvýše `workers` najednou). Celková doba playlistu se tak blíží
+    max(stahování, převod) místo jejich součtu. Podle politiky výstupu se stream
+    převádí, jen přebalí, nebo ponechá; tagy a obal se vkládají ve všech režimech.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        # Převod interaktivní úlohy předběhne čekající převody playlistů
+        self._slots = PrioritySlots(self.workers)
+        self.active = 0
+
+    @staticmethod
+    def find_thumbnail(filepath: str):
+        base = os.path.splitext(filepath)[0]
+        for ext in THUMBNAIL_EXTENSIONS:
+            if os.path.exists(f"{base}.{ext}"):
+                return f"{base}.{ext}"
+        return None
+
+    @staticmethod
+    def normalize_codec(codec: str):
+        """Sjednotí název kodeku z yt-dlp (např. mp4a.40.2) a ffprobe."""
+        if not codec or codec == "none":
+            return None
+        codec = codec.lower()
+        return "aac" if codec.startswith("mp4a") else codec.split(".")[0]
+
+    @staticmethod
+    async def probe_codec(filepath: str):
+        """Zjistí kodek prvního zvukového streamu přes ffprobe (None, pokud nejde zjistit)."""
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name",
+                "-of", "default=nw=1:nk=1", filepath,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+            )
+            stdout, _ = await process.communicate()
+        except FileNotFoundError:
+            return None
+        return stdout.decode(errors="replace").strip() or None
+
+    @staticmethod
+    def output_mode(spec: dict, codec: str) -> str:
+        """Rozhodne podle politiky a kodeku: "transcode", "remux" nebo "native"."""
+        policy = spec.get("policy", "transcode")
+        if policy == "native":
+            return "native"
+        if policy == "remux" and codec in REMUX_CONTAINERS:
+            return "remux"
+        if policy == "auto" and codec in AUDIO_ALLOWED_CODECS and codec in REMUX_CONTAINERS:
+            return "remux"
+        return "transcode"
+
+    @staticmethod
+    def build_command(source: str, target: str, spec: dict, item: dict, thumbnail: str = None, mode: str = "transcode") -> list:
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", source]
+        if thumbnail:
+            cmd += ["-i", thumbnail, "-map", "0:a:0", "-map", "1:0", "-c:v", "mjpeg", "-disposition:v:0", "attached_pic",
+                    "-metadata:s:v", "title=Album cover", "-metadata:s:v", "comment=Cover (front)"]
+        elif mode == "native":
+            # Ponecháváme celý soubor, jen doplňujeme tagy
+            cmd += ["-map", "0", "-c", "copy"]
+        else:
+            cmd += ["-map", "0:a:0"]
+        if mode == "transcode":
+            cmd += ["-c:a", FFMPEG_AUDIO_ENCODERS.get(spec["codec"], spec["codec"]), "-b:a", spec["bitrate"]]
+        else:
+            cmd += ["-c:a", "copy"]
+        if target.endswith(".mp3"):
+            cmd += ["-id3v2_version", "3"]
+        if spec.get("embed_metadata"):
+            for key, value in TranscodePool.tags(spec, item).items():
+                cmd += ["-metadata", f"{key}={value}"]
+        return cmd + [target]
+
+    @staticmethod
+    def tags(spec: dict, item: dict) -> dict:
+        tags = {key: item.get(key) for key in ("title", "artist", "album")}
+        tags.update(spec.get("metadata") or {})
+        return {key: value for key, value in tags.items() if value}
+
+    @staticmethod
+    def embed_ogg_cover(filepath: str, thumbnail: str) -> bool:
+        """Vloží obal do Ogg/Opus souboru (METADATA_BLOCK_PICTURE). Vyžaduje volitelný balíček mutagen."""
+        try:
+            import mutagen
+            from mutagen.flac import Picture
+        except ImportError:
+            logging.warning("Balíček mutagen není nainstalován, obal alba do Opus/Ogg souboru nevložím.")
+            return False
+        picture = Picture()
+        picture.type = 3  # Cover (front)
+        picture.mime = {"png": "image/png", "webp": "image/webp"}.get(thumbnail.rsplit(".", 1)[-1].lower(), "image/jpeg")
+        with open(thumbnail, "rb") as f:
+            picture.data = f.read()
+        audio = mutagen.File(filepath)
+        audio["metadata_block_picture"] = [base64.b64encode(picture.write()).decode("ascii")]
+        audio.save()
+        return True
+
+    async def transcode(self, item: dict, spec: dict) -> str:
+        """Zpracuje stažený soubor podle `spec` a politiky výstupu, nahradí jím originál a vrátí novou cestu."""
+        source = item["filepath"]
+        base, source_ext = os.path.splitext(source)
+        thumbnail = self.find_thumbnail(source) if spec.get("embed_thumbnail") else None
+
+        codec = self.normalize_codec(item.get("acodec"))
+        if codec is None and spec.get("policy", "transcode") != "transcode":
+            codec = self.normalize_codec(await self.probe_codec(source))
+        mode = self.output_mode(spec, codec)
+        if mode == "transcode":
+            ext = spec["codec"]
+        elif mode == "remux":
+            ext = REMUX_CONTAINERS[codec]
+        else:
+            ext = source_ext.lstrip(".")
+        ffmpeg_cover = thumbnail if ext in FFMPEG_COVER_CONTAINERS else None
+        ogg_cover = thumbnail if ext in OGG_CONTAINERS else None
+        if mode == "native" and not (ffmpeg_cover or ogg_cover or (spec.get("embed_metadata") and self.tags(spec, item))):
+            # Není co měnit – soubor zůstane přesně tak, jak ho stáhl yt-dlp
+            return source
+
+        target = f"{base}.{ext}"
+        temp_target = f"{base}.temp.{ext}"
+
+        async with self._slots.acquire():
+            self.active += 1
+            started = time.perf_counter()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *self.build_command(source, temp_target, spec, item, ffmpeg_cover, mode),
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    _, stderr = await process.communicate()
+                except asyncio.CancelledError:
+                    process.kill()
+                    await process.wait()
+                    raise
+            except FileNotFoundError:
+                raise RuntimeError("ffmpeg nebyl nalezen, převod zvuku není možný.") from None
+            except BaseException:
+                if os.path.exists(temp_target):
+                    os.remove(temp_target)
+                raise
+            finally:
+                self.active -= 1
+                observe_stage("transcode", time.perf_counter() - started)
+
+        if process.returncode != 0:
+            if os.path.exists(temp_target):
+                os.remove(temp_target)
+            message = stderr.decode(errors="replace").strip().splitlines()
+            raise RuntimeError(f"Převod zvuku selhal u `{os.path.basename(source)}`: {message[-1] if message else process.returncode}")
+
+        embedded_cover = ffmpeg_cover
+        if ogg_cover:
+            try:
+                if await asyncio.to_thread(self.embed_ogg_cover, temp_target, ogg_cover):
+                    embedded_cover = ogg_cover
+            except Exception as e:
+                logging.warning(f"Obal alba se do `{os.path.basename(target)}` nepodařilo vložit: {e}")
+
+        os.replace(temp_target, target)
+        # Nevložený obal necháme vedle souboru
+        for leftover in (source, embedded_cover):
+            if leftover and os.path.abspath(leftover) != os.path.abspath(target) and os.path.exists(leftover):
+                os.remove(leftover)
+        return target
+
+TRANSCODE_POOL = TranscodePool(TRANSCODE_WORKERS)
+
+def media_key(info: dict) -> str:
+    """Kanonické ID médií ve stejném tvaru jako záznam v download archivu ("youtube abc123")."""
+    extractor = info.get("extractor_key") or info.get("ie_key") or "generic"
+    return f"{extractor.lower()} {info.get('id')}"
+
+class InfoCache:
+    """
+    LRU cache metadat z yt-dlp s omezenou platností. Položky jsou uloženy pod
+    kanonickým ID médií, zadané URL (nebo hledání) na ně jen odkazují, takže
+    různé odkazy na stejné video sdílejí jednu extrakci.
+    """
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._aliases = {}
+
+    def get(self, url: str):
+        key = self._aliases.get(url, url)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, info = entry
+        if time.time() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return info
+
+    def put(self, url: str, info: dict):
+        if not info or not info.get("id") or self.max_size <= 0:
+            return
+        key = media_key(info)
+        self._entries[key] = (time.time(), info)
+        self._entries.move_to_end(key)
+        self._aliases[url] = key
+        if info.get("webpage_url"):
+            self._aliases[info["webpage_url"]] = key
+        while len(self._entries) > self.max_size:
+            evicted, _ = self._entries.popitem(last=False)
+            self._aliases = {alias: k for alias, k in self._aliases.items() if k != evicted}
+
+INFO_CACHE = InfoCache(INFO_CACHE_SIZE, INFO_CACHE_TTL)
+
+async def extract_info_cached(url: str, opts: dict) -> dict:
+    """Vrátí metadata z cache, případně je jednou extrahuje a uloží pro stahování i opakované požadavky."""
+    info = INFO_CACHE.get(url)
+    if info is not None:
+        logging.info(f"♻️ Metadata pro {url} použita z cache.")
+        return info
+    info = await YTDLP_EXECUTOR.extract(url, opts)
+    INFO_CACHE.put(url, info)
+    return info
+
+class ProgressReporter:
+    """
+    Zobrazuje průběh stahování ve status zprávě, aniž by stahování čekalo na Discord.
+    Progress hook jen přepíše poslední stav (`update`), jediná asynchronní smyčka
+    pak zprávu upravuje adaptivní rychlostí podle latence Discordu.
+    """
+
+    def __init__(self, message: discord.Message, base_interval: float = PROGRESS_UPDATE_INTERVAL):
+        self.message = message
+        self.base_interval = base_interval
+        self.interval = base_interval
+        # Poslední stav; přiřazení reference je atomické, zámek tedy není potřeba
+        self._latest = None
+        self._shown = None
+        self._task = None
+
+    def update(self, content: str):
+        """Uloží nejnovější text zprávy. Lze volat z libovolného vlákna, nikdy neblokuje."""
+        self._latest = content
+
+    def start(self):
+        if self.message is not None and self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._flush()
+            except Exception as e:
+                # Aktualizace průběhu nesmí ukončit smyčku ani ovlivnit výsledek stahování
+                self.interval = min(PROGRESS_MAX_INTERVAL, self.interval * 2)
+                logging.warning(f"Chyba při aktualizaci status zprávy, další pokus za {self.interval:.1f} s: {e}")
+
+    async def _flush(self):
+        content = self._latest
+        if content is None or content == self._shown:
+            return
+        started = time.monotonic()
+        try:
+            await self.message.edit(content=content)
+            self._shown = content
+        except Exception as e:
+            # HTTP chyby, síť, timeout i smazaná zpráva – zpomalíme a zkusíme to později
+            self.interval = min(PROGRESS_MAX_INTERVAL, self.interval * 2)
+            logging.warning(f"Chyba při aktualizaci status zprávy, další pokus za {self.interval:.1f} s: {e}")
+            return
+
+        # 429 vyřizuje discord.py uvnitř edit() (čeká a opakuje), projeví se tedy jen
+        # dlouhou odezvou – podle ní zpomalujeme
+        latency = time.monotonic() - started
+        observe_stage("discord_edit", latency)
+        if latency > self.interval / 2:
+            self.interval = min(PROGRESS_MAX_INTERVAL, self.interval * 2)
+        else:
+            self.interval = max(self.base_interval, self.interval * 0.75)
+
+    async def stop(self):
+        """
+        Ukončí aktualizace; případná rozpracovaná úprava doběhne dřív, než volající zapíše finální stav.
+        Chyba aktualizace se jen zaloguje – výsledek stahování na ní nezávisí.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.warning(f"Aktualizace status zprávy skončila chybou: {e}")
+        self._task = None
+
+async def download_with_ytdlp(urls, out_dir: str, ytdlp_opts: dict, status_message: discord.Message, item_name: str = "neznámá položka", info: dict = None, transcode: dict = None, key: str = None) -> bool:
+    """
+    Stahuje obsah pomocí yt-dlp a odesílá průběžné aktualizace na Discord.
+    Je-li předán `info` z dřívější extrakce, stahuje se z něj bez nové extrakce.
+    Se `transcode` se stažený zvuk následně převede v TRANSCODE_POOL. Je-li médium
+    (`key`, jinak podle `info`) už v CONTENT_STORE, jen se vloží do `out_dir`
+    a vrátí se True. Jinak se stahuje vždy – download archiv se yt-dlp nepředává
+    (zápis do něj proběhne až po stažení), jinak by položku z archivu bez souboru
+    v úložišti tiše přeskočil.
+    """
+    variant = CONTENT_STORE.variant(ytdlp_opts or {}, transcode)
+    key = key or (media_key(info) if info and info.get("id") else None)
+    if key:
+        record = await asyncio.to_thread(CONTENT_STORE.lookup, key, variant)
+        METRICS.inc("bot_content_store_lookups_total", result="hit" if record else "miss")
+        if record:
+            await asyncio.to_thread(CONTENT_STORE.materialize, record, out_dir)
+            return True
+
+    reporter = ProgressReporter(status_message)
+
+    def progress_hook(d):
+        if d['status'] == 'downloading':
+            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            downloaded_bytes = d.get('downloaded_bytes') or 0
+            
+            percent = round((downloaded_bytes / total_bytes) * 100, 1) if total_bytes > 0 else 0
+            filename = os.path.basename(d.get('filename') or 'Neznámý soubor')
+            
+            # Zabráníme prázdnému názvu souboru
+            if filename == 'Neznámý soubor' and item_name != 'neznámá položka':
+                display_name = item_name
+            else:
+                display_name = filename
+            
+            # Jen zápis posledního stavu – hook běží ve vlákně stahování a nesmí čekat na Discord
+            reporter.update(f"⏳ Stahuju `{display_name}`...\n**Progres:** {percent:.1f}% | **Rychlost:** {format_speed(d.get('speed'))}")
+
+    opts = {
+        "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
+        "quiet": True,
+        "no_warnings": True,
+        "ignoreerrors": True, # PŘIDÁNO: Ignoruje chyby jednotlivých videí (řeší DownloadError)
+        "continuedl": True, # Navázání na .part soubory přerušeného stahování
+    }
+    opts.update(ytdlp_opts or {})
+    archive = opts.pop("download_archive", None)
+
+    # Plný disk má úlohu zastavit hned, ne uprostřed stahování
+    needed = estimate_size(info)
+    await asyncio.to_thread(ensure_free_space, out_dir, needed)
+    final_dir = os.path.dirname(opts["outtmpl"])
+    opts, workdir = await asyncio.to_thread(STAGING.prepare, opts, str(urls), needed)
+
+    reporter.start()
+    try:
+        # Stahování běží mimo event loop (vlákno nebo proces podle YTDLP_EXECUTION_MODE)
+        files = []
+        retcode = await YTDLP_EXECUTOR.download([urls] if isinstance(urls, str) else urls, opts, progress_hook, info=info, files=files)
+        # S ignoreerrors yt-dlp chybu jen zaloguje – neúspěch poznáme podle návratového kódu a chybějícího souboru
+        if retcode != 0:
+            raise ValueError(f"yt-dlp skončil s chybou (kód {retcode}), podrobnosti jsou v logu.")
+        if not files:
+            raise ValueError("yt-dlp nestáhl žádný soubor, podrobnosti jsou v logu.")
+        if any(not item.get("filepath") or not os.path.exists(item["filepath"]) for item in files):
+            raise ValueError("Stažený soubor nebyl nalezen, podrobnosti jsou v logu.")
+        for item in files:
+            if transcode:
+                reporter.update(f"🎛️ Zpracovávám zvuk `{item.get('title') or item_name}`...")
+                item["filepath"] = await TRANSCODE_POOL.transcode(item, transcode)
+            if workdir:
+                item["filepath"] = await asyncio.to_thread(STAGING.finalize, item["filepath"], final_dir)
+            if item.get("media_key"):
+                await asyncio.to_thread(CONTENT_STORE.publish, item["media_key"], variant, item["filepath"])
+                if archive is not None:
+                    await asyncio.to_thread(archive.add, item["media_key"])
+            await asyncio.to_thread(LIBRARY.add, item, variant, transcode)
+        await asyncio.to_thread(STAGING.discard, workdir)
+    except Exception as e:
+        if "ffmpeg" in str(e).lower():
+            await reporter.stop()
+            logging.error(f"❌ Chyba yt-dlp: Pravděpodobně chybí FFMPEG. Nainstalujte přes 'sudo apt install ffmpeg'. Detaily: {e}")
+            await status_message.edit(content=f"❌ **Chyba stahování:** Pravděpodobně chybí `ffmpeg`. Nainstalujte jej do systému. Detaily: `{str(e).splitlines()[-1]}`")
+        else:
+            raise e
+    finally:
+        await reporter.stop()
+    return False
+
+
+async def download_playlist_items(entries, ytdlp_opts: dict, status_message: discord.Message, playlist_name: str, parallelism: int = PLAYLIST_ITEM_PARALLELISM, transcode: dict = None) -> dict:
+    """
+    Stáhne položky playlistu souběžně (nejvýše `parallelism` najednou) a do status
+    zprávy hlásí souhrnný průběh ("37/200, 48 MiB/s"). Položky z download archivu
+    se přeskočí ještě před spuštěním yt-dlp, archiv pak yt-dlp doplňuje jako dřív.
+    `entries` je seznam položek, nebo asynchronní iterátor jejich dávek – stahování
+    první dávky pak začne, zatímco se další teprve načítají. Se `transcode` se každá
+    položka po stažení převádí v TRANSCODE_POOL, slot stahování se mezitím uvolní.
+    Stav položek se zapisuje do žurnálu úlohy, obnovená úloha dokončené položky přeskočí.
+    """
+    summary = {"total": 0, "skipped": 0, "linked": 0, "done": 0, "failed": 0, "failed_keys": [], "transcoding": 0}
+    job = CURRENT_JOB.get()
+
+    async def journal(state: str, entry: dict):
+        if job and entry.get("id"):
+            await asyncio.to_thread(job.journal, state, media_key(entry))
+
+    tasks = []
+    speeds = {}
+    reporter = ProgressReporter(status_message)
+
+    def render():
+        finished = summary["skipped"] + summary["linked"] + summary["done"] + summary["failed"]
+        total_speed = sum(speed for speed in speeds.values() if speed)
+        transcoding = f" | **Převod:** {summary['transcoding']}" if summary["transcoding"] else ""
+        reporter.update(
+            f"⏳ Stahuju playlist `{playlist_name}`...\n"
+            f"**Položky:** {finished}/{summary['total']} | **Rychlost:** {format_speed(total_speed)}{transcoding}"
+        )
+
+    opts = {
+        "quiet": True,
+        "no_warnings": True,
+        "ignoreerrors": True,
+        "continuedl": True, # Navázání na .part soubory přerušeného stahování
+    }
+    opts.update(ytdlp_opts or {})
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+    variant = CONTENT_STORE.variant(opts, transcode)
+    out_dir = os.path.dirname(opts["outtmpl"]) if isinstance(opts.get("outtmpl"), str) else None
+
+    def link_stored(batch: list) -> list:
+        """Vloží položky, které už jsou v úložišti, a vrátí zbylé (běží ve vlákně)."""
+        remaining = []
+        for entry in batch:
+            record = CONTENT_STORE.lookup(media_key(entry), variant) if entry.get("id") and out_dir else None
+            if entry.get("id") and out_dir:
+                METRICS.inc("bot_content_store_lookups_total", result="hit" if record else "miss")
+            if record:
+                CONTENT_STORE.materialize(record, out_dir)
+                if job:
+                    job.journal("done", media_key(entry))
+            else:
+                remaining.append(entry)
+        return remaining
+
+    async def download_item(index: int, entry: dict):
+        def progress_hook(d):
+            speeds[index] = d.get("speed") if d.get("status") == "downloading" else None
+            render()
+
+        files = []
+        async with semaphore, LANE_GATE.item():
+            # Bez místa na úložišti selže celý playlist (ostatní položky se zruší), ne položka po položce
+            needed = estimate_size(entry)
+            if out_dir:
+                await asyncio.to_thread(ensure_free_space, out_dir, needed)
+            url = entry.get("url") or entry["webpage_url"]
+            item_opts, workdir = await asyncio.to_thread(STAGING.prepare, opts, url, needed)
+            await journal("running", entry)
+            try:
+                retcode = await YTDLP_EXECUTOR.download([url], item_opts, progress_hook, files=files)
+                if retcode != 0:
+                    await asyncio.to_thread(STAGING.discard, workdir)
+                    summary["failed"] += 1
+                    summary["failed_keys"].append(media_key(entry))
+                    await journal("failed", entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                summary["failed"] += 1
+                summary["failed_keys"].append(media_key(entry))
+                await journal("failed", entry)
+                logging.error(f"❌ Chyba při stahování položky `{entry.get('title', entry.get('url'))}`: {e}")
+                return
+            finally:
+                speeds.pop(index, None)
+                render()
+        if retcode != 0:
+            return
+
+        # Převod už mimo slot stahování – další položka se mezitím stahuje
+        if transcode and files:
+            summary["transcoding"] += 1
+            render()
+            try:
+                for item in files:
+                    item["filepath"] = await TRANSCODE_POOL.transcode(item, transcode)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Neúspěšný převod je neúspěšná položka: yt-dlp ji už zapsal do archivu,
+                # odebereme ji, aby ji další běh (např. kontrola playlistu) zkusil znovu
+                logging.error(f"❌ Chyba při převodu položky `{entry.get('title', entry.get('url'))}`: {e}")
+                keys = [item["media_key"] for item in files if item.get("media_key")]
+                await asyncio.to_thread(STATE_STORE.archive_remove, keys)
+                await asyncio.to_thread(STAGING.discard, workdir)
+                summary["failed"] += 1
+                summary["failed_keys"].append(media_key(entry))
+                await journal("failed", entry)
+                return
+            finally:
+                summary["transcoding"] -= 1
+                render()
+        for item in files:
+            if workdir:
+                item["filepath"] = await asyncio.to_thread(STAGING.finalize, item["filepath"], out_dir)
+            if item.get("media_key"):
+                await asyncio.to_thread(CONTENT_STORE.publish, item["media_key"], variant, item["filepath"])
+            await asyncio.to_thread(LIBRARY.add, item, variant, transcode)
+        await asyncio.to_thread(STAGING.discard, workdir)
+        summary["done"] += 1
+        await journal("done", entry)
+        render()
+
+    async def add_batch(batch: list):
+        batch = [entry for entry in batch if entry and (entry.get("url") or entry.get("webpage_url"))]
+        if job and job.done_items:
+            # Položky dokončené před restartem (včetně převodu) už neřešíme
+            remaining = [entry for entry in batch if not (entry.get("id") and media_key(entry) in job.done_items)]
+            summary["total"] += len(batch) - len(remaining)
+            summary["skipped"] += len(batch) - len(remaining)
+            batch = remaining
+        # Co už stáhl kdokoli jiný, se jen vloží z úložiště obsahu
+        stored = await asyncio.to_thread(link_stored, batch)
+        summary["total"] += len(batch) - len(stored)
+        summary["linked"] += len(batch) - len(stored)
+        batch = stored
+        pending = batch
+        if opts.get("download_archive"):
+            keys = [media_key(entry) for entry in batch if entry.get("id")]
+            missing = await asyncio.to_thread(STATE_STORE.archive_missing, keys)
+            pending = [entry for entry in batch if not entry.get("id") or media_key(entry) in missing]
+            METRICS.inc("bot_archive_lookups_total", len(keys) - len(missing), check="playlist", result="hit")
+            METRICS.inc("bot_archive_lookups_total", len(missing), check="playlist", result="miss")
+        summary["total"] += len(batch)
+        summary["skipped"] += len(batch) - len(pending)
+        for entry in pending:
+            tasks.append(asyncio.create_task(download_item(len(tasks), entry)))
+        render()
+
+    render()
+    reporter.start()
+    try:
+        if hasattr(entries, "__aiter__"):
+            async for batch in entries:
+                await add_batch(batch)
+        else:
+            await add_batch(entries)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await reporter.stop()
+    logging.info(f"✅ Playlist `{playlist_name}`: staženo {summary['done']}, z úložiště {summary['linked']}, přeskočeno {summary['skipped']}, chyb {summary['failed']}.")
+    return summary
+
+class SpotifyClient:
+    """
+    Klient Spotify Web API nad sdílenou keep-alive session. Token (client credentials)
+    se drží v paměti až do chvíle krátce před vypršením, odpověď 429 respektuje
+    Retry-After a stránkování playlistu je generátor, takže zpracování první stránky
+    může začít dřív, než se načtou další.
+    """
+
+    def __init__(self, client_id: str, client_secret: str, api_base: str = SPOTIFY_API_BASE, token_url: str = SPOTIFY_TOKEN_URL):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.api_base = api_base
+        self.token_url = token_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(10, PLAYLIST_SWEEP_CONCURRENCY * 2))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # (token, čas vypršení) – jedna dvojice, aby se dala číst bez zámku
+        self._cached_token = (None, 0.0)
+        self._token_lock = threading.Lock()
+
+    def _valid_token(self):
+        token, expires = self._cached_token
+        return token if token and time.time() < expires else None
+
+    def token(self) -> str:
+        """
+        Vrátí platný access token, nový si vyžádá až 60 s před vypršením starého.
+        Platný token se vrací bez zámku – obnova tokenu (i čekání na Retry-After)
+        tak zdrží jen volající, kteří na nový token opravdu čekají.
+        """
+        token = self._valid_token()
+        if token:
+            return token
+        with self._token_lock:
+            token = self._valid_token()
+            if token:
+                return token
+            if not self.client_id or not self.client_secret:
+                raise ValueError("Chybí Spotify Client ID / Secret v .env.")
+            credentials = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
+            response = self._send(
+                "POST", self.token_url, authorized=False,
+                data={"grant_type": "client_credentials"},
+                headers={"Authorization": f"Basic {credentials}"},
+            )
+            payload = response.json()
+            token = payload["access_token"]
+            self._cached_token = (token, time.time() + int(payload.get("expires_in", 3600)) - 60)
+            logging.info("🔑 Získán nový Spotify token.")
+            return token
+
+    def _invalidate_token(self, token: str):
+        """Zahodí odmítnutý token (pokud jej mezitím jiný volající už neobnovil)."""
+        with self._token_lock:
+            if self._cached_token[0] == token:
+                self._cached_token = (None, 0.0)
+
+    def _send(self, method: str, url: str, authorized: bool = True, **kwargs) -> requests.Response:
+        """Odešle požadavek s opakováním při 429 (Retry-After), 5xx, chybě spojení a vypršeném tokenu."""
+        headers = kwargs.pop("headers", {})
+        token = None
+        for attempt in range(SPOTIFY_MAX_RETRIES):
+            if authorized:
+                token = self.token()
+                headers["Authorization"] = f"Bearer {token}"
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=SPOTIFY_HTTP_TIMEOUT, **kwargs)
+            except requests.ConnectionError as e:
+                delay = 2 ** attempt
+                logging.warning(f"Spotify API nedostupné ({e}), další pokus za {delay} s.")
+                time.sleep(delay)
+                continue
+
+            if response.status_code == 429:
+                delay = int(response.headers.get("Retry-After", "1") or 1)
+                if delay > SPOTIFY_MAX_RETRY_AFTER:
+                    raise RuntimeError(f"Spotify API omezilo požadavky na {delay} s.")
+                logging.warning(f"Spotify API vrátilo 429, čekám {delay} s.")
+                time.sleep(delay)
+                continue
+            if response.status_code == 401 and authorized and attempt == 0:
+                self._invalidate_token(token)
+                continue
+            if response.status_code >= 500:
+                delay = 2 ** attempt
+                logging.warning(f"Spotify API vrátilo {response.status_code}, další pokus za {delay} s.")
+                time.sleep(delay)
+                continue
+            response.raise_for_status()
+            return response
+        raise RuntimeError(f"Spotify API neodpovědělo ani po {SPOTIFY_MAX_RETRIES} pokusech: {url}")
 
-async def download_with_ytdlp(urls, out_dir: str, ytdlp_opts: dict, status_message: discord.Message, item_name: str = "neznámá položka"):
-    """
-    Stahuje obsah pomocí yt-dlp a odesílá průběžné aktualizace na Discord.
-    """
-    download_state = {
-        "last_update": time.time(),
-        "total_size": 0,
-        "filename": ""
-    }
+    def get(self, path: str, params: dict = None) -> dict:
+        url = path if path.startswith("http") else f"{self.api_base}/{path.lstrip('/')}"
+        return self._send("GET", url, params=params).json()
 
-    def progress_hook(d):
-        if d['status'] == 'downloading':
-            current_time = time.time()
-            # Aktualizace každé 2 sekundy
-            if (current_time - download_state["last_update"]) > 2:
-                download_state["last_update"] = current_time
-
-                total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-                downloaded_bytes = d.get('downloaded_bytes', 0)
-                
-                percent = round((downloaded_bytes / total_bytes) * 100, 1) if total_bytes > 0 else 0
-                speed = d.get('speed')
-                filename = os.path.basename(d.get('filename', 'Neznámý soubor'))
-                
-                download_state["filename"] = filename
-                download_state["speed"] = format_speed(speed)
-                download_state["progress"] = f"{percent:.1f}%"
-                
-                # Zabráníme prázdnému názvu souboru
-                if download_state['filename'] == 'Neznámý soubor' and item_name != 'neznámá položka':
-                    display_name = item_name
-                else:
-                    display_name = download_state['filename']
-                
-                try:
-                    # Tato část běží v jiném vlákně, proto je nutné run_coroutine_threadsafe
-                    asyncio.run_coroutine_threadsafe(
-                        status_message.edit(content=f"⏳ Stahuju `{display_name}`...\n**Progres:** {download_state['progress']} | **Rychlost:** {download_state['speed']}"),
-                        bot.loop
-                    ).result()
-                except Exception as e:
-                    # Varování, ale nezastavujeme stahování
-                    logging.warning(f"Chyba při aktualizaci status zprávy: {e}")
+    @staticmethod
+    def normalize_track(track: dict):
+        """Převede Spotify objekt skladby na slovník používaný botem (epizody podcastů přeskočí)."""
+        if not track or track.get("type", "track") != "track" or not track.get("name"):
+            return None
+        album = track.get("album") or {}
+        images = album.get("images") or []
+        return {
+            "id": track.get("id"),
+            "title": track["name"],
+            "artist": ", ".join(artist["name"] for artist in track.get("artists") or [] if artist.get("name")),
+            "album": album.get("name"),
+            "thumbnail_url": images[0]["url"] if images else None,
+        }
 
-        elif d['status'] == 'finished':
-            pass
+    def track(self, track_id: str) -> dict:
+        return self.normalize_track(self.get(f"tracks/{track_id}"))
 
-    opts = {
-        "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
-        "quiet": True,
-        "no_warnings": True,
-        "progress_hooks": [progress_hook],
-        "ignoreerrors": True, # PŘIDÁNO: Ignoruje chyby jednotlivých videí (řeší DownloadError)
-    }
-    opts.update(ytdlp_opts or {})
+    def playlist(self, playlist_id: str) -> dict:
+        data = self.get(f"playlists/{playlist_id}", {"fields": "name,snapshot_id,tracks.total"})
+        return {
+            "name": data.get("name"),
+            "total_tracks": (data.get("tracks") or {}).get("total"),
+            "snapshot_id": data.get("snapshot_id"),
+        }
 
-    try:
-        # Spuštění blokující funkce v odděleném vlákně
-        await asyncio.to_thread(yt_dlp.YoutubeDL(opts).download, [urls] if isinstance(urls, str) else urls)
-    except Exception as e:
-        if "ffmpeg" in str(e).lower():
-            logging.error(f"❌ Chyba yt-dlp: Pravděpodobně chybí FFMPEG. Nainstalujte přes 'sudo apt install ffmpeg'. Detaily: {e}")
-            await status_message.edit(content=f"❌ **Chyba stahování:** Pravděpodobně chybí `ffmpeg`. Nainstalujte jej do systému. Detaily: `{str(e).splitlines()[-1]}`")
-        else:
-            raise e
-            
-def get_spotify_token(client_id: str, client_secret: str) -> str:
-    # Zjednodušená funkce, která ignoruje fiktivní URL
-    return "mock_token_12345"
+    def iter_playlist_tracks(self, playlist_id: str, page_size: int = 100):
+        """Generátor stránek skladeb playlistu (seznamy normalizovaných skladeb)."""
+        url = f"playlists/{playlist_id}/tracks"
+        params = {
+            "limit": page_size,
+            "additional_types": "track",
+            "fields": "next,items(track(id,name,type,artists(name),album(name,images)))",
+        }
+        while url:
+            data = self.get(url, params)
+            page = [self.normalize_track(item.get("track")) for item in data.get("items") or []]
+            yield [track for track in page if track]
+            # Odkaz na další stránku už obsahuje všechny parametry
+            url, params = data.get("next"), None
+
+SPOTIFY = SpotifyClient(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET)
 
 def extract_track_id(track_url: str) -> str:
     m = re.search(r"track[/:]([A-Za-z0-9]+)", track_url)
@@ -356,9 +3246,8 @@ def extract_track_id(track_url: str) -> str:
     if m2: return m2.group(1)
     raise ValueError("Nelze extrahovat track ID ze zadané URL")
 
-def get_spotify_track_info(track_url: str, token: str):
-    # Fiktivní implementace pro testování, protože nevíme, jak se autentifikuje skutečné Spotify API
-    return {"title": "Testovací Skladba", "artist": "Testovací Interpret", "thumbnail_url": "http://example.com/thumb.jpg", "album": "Testovací Album"}
+def get_spotify_track_info(track_url: str) -> dict:
+    return SPOTIFY.track(extract_track_id(track_url))
 
 def extract_playlist_id(playlist_url: str) -> str:
     """Vylepšená extrakce playlist ID s lepším handlováním různých URL formátů."""
@@ -381,62 +3270,100 @@ def extract_playlist_id(playlist_url: str) -> str:
     
     raise ValueError(f"Nelze extrahovat playlist ID ze zadané URL: {playlist_url}")
 
-def get_spotify_playlist_info(playlist_url: str, token: str):
-    """Vylepšená funkce pro získání informací o playlistu (fiktivní)."""
-    return {"name": "Testovací Spotify Playlist", "total_tracks": 100}
+def get_spotify_playlist_info(playlist_url: str) -> dict:
+    """Název, počet skladeb a snapshot_id playlistu."""
+    return SPOTIFY.playlist(extract_playlist_id(playlist_url))
 
-def get_spotify_playlist_tracks(playlist_url: str, token: str):
-    """Fiktivní získávání tracků z playlistu."""
-    return [
-        {"title": "Song One", "artist": "Artist A", "album": "Album X"},
-        {"title": "Song Two", "artist": "Artist B", "album": "Album Y"},
-        # ...atd
-    ]
+async def iter_spotify_playlist_tracks(playlist_url: str):
+    """Asynchronně vrací stránky skladeb playlistu; každá stránka se načítá v executoru."""
+    pages = SPOTIFY.iter_playlist_tracks(extract_playlist_id(playlist_url))
+    while True:
+        page = await asyncio.to_thread(next, pages, None)
+        if page is None:
+            return
+        yield page
 
-async def download_spotify_track_via_youtube_async(track_url: str, interaction: discord.Interaction):
-    task_id = interaction.user.id
-    ACTIVE_DOWNLOAD_TASKS[task_id] = asyncio.current_task()
-    
+async def resolve_spotify_tracks(tracks: list, on_progress=None) -> list:
+    """
+    Najde ke Spotify skladbám YouTube videa. Hledání běží souběžně (nejvýše
+    SPOTIFY_SEARCH_CONCURRENCY najednou) a výsledky se ukládají do RESOLUTION_CACHE.
+    Vrací položky ve tvaru plochých položek playlistu yt-dlp ve stejném pořadí
+    jako `tracks` (za nenalezené skladby None).
+    """
+    semaphore = asyncio.Semaphore(max(1, SPOTIFY_SEARCH_CONCURRENCY))
+    state = {"resolved": 0, "searched": 0}
+
+    async def resolve(track: dict):
+        entry = await asyncio.to_thread(RESOLUTION_CACHE.get, track['title'], track['artist'])
+        if entry is None:
+            query = f"ytsearch1:{track['title']} {track['artist']}".strip()
+            async with semaphore:
+                try:
+                    result = await YTDLP_EXECUTOR.extract(query, {'quiet': True, 'extract_flat': 'in_playlist', 'ignoreerrors': True}, stage="search")
+                except Exception as e:
+                    logging.warning(f"Hledání `{query}` selhalo: {e}")
+                    result = None
+            found = next((e for e in (result or {}).get('entries') or [] if e and e.get('id')), None)
+            state["searched"] += 1
+            if found:
+                entry = {
+                    "id": found['id'],
+                    "ie_key": found.get('ie_key') or "Youtube",
+                    "url": found.get('url') or f"https://www.youtube.com/watch?v={found['id']}",
+                    "title": found.get('title') or track['title'],
+                }
+                await asyncio.to_thread(RESOLUTION_CACHE.put, track['title'], track['artist'], entry)
+            else:
+                logging.warning(f"Pro skladbu `{track['title']} - {track['artist']}` nebylo nalezeno žádné video.")
+        state["resolved"] += 1
+        if on_progress:
+            on_progress(state["resolved"], len(tracks))
+        return entry
+
+    entries = await asyncio.gather(*(resolve(track) for track in tracks))
+    logging.info(f"🔎 Vyhledáno {state['searched']} z {len(tracks)} skladeb, zbytek z cache.")
+    return list(entries)
+
+async def download_spotify_track_via_youtube_async(job: DownloadJob):
+    track_url = job.url
     if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
-        if not SILENT_MODE: await interaction.followup.send("❌ Chybí Spotify Client ID / Secret v .env.")
+        if not SILENT_MODE: await job.send("❌ Chybí Spotify Client ID / Secret v .env.")
         logging.error("❌ Chybí Spotify Client ID / Secret v .env.")
         return
-    token = get_spotify_token(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET)
-    if not token:
-        if not SILENT_MODE: await interaction.followup.send("❌ Nepodařilo se získat Spotify token.")
+    try:
+        await asyncio.to_thread(SPOTIFY.token)
+    except Exception as e:
+        if not SILENT_MODE: await job.send("❌ Nepodařilo se získat Spotify token.")
+        logging.error(f"❌ Nepodařilo se získat Spotify token: {e}")
         return
-    
-    track_info = get_spotify_track_info(track_url, token)
+
+    try:
+        track_info = await asyncio.to_thread(get_spotify_track_info, track_url)
+    except Exception as e:
+        logging.error(f"❌ Chyba při získávání informací o tracku {track_url}: {e}")
+        track_info = None
     if not track_info:
-        if not SILENT_MODE: await interaction.followup.send("❌ Nepodařilo se získat informace o tracku.")
+        if not SILENT_MODE: await job.send("❌ Nepodařilo se získat informace o tracku.")
         logging.error("❌ Nepodařilo se získat informace o tracku.")
         return
+    job.title = track_info['title']
 
     # Složka: Downloads/Zvuk/Jméno uživatele
-    user_folder_name = sanitize_filename(interaction.user.name)
+    user_folder_name = sanitize_filename(job.user_name)
     audio_user_dir = os.path.join(BASE_DOWNLOAD_DIR, AUDIO_DIR_NAME, user_folder_name)
-    ensure_folder(audio_user_dir)
+    await asyncio.to_thread(ensure_folder, audio_user_dir)
     
     query = f"{track_info['title']} {track_info['artist']}".strip()
     
     opts = {
         "format": "bestaudio/best",
         "outtmpl": os.path.join(audio_user_dir, "%(title)s.%(ext)s"),
-        "download_archive": DOWNLOAD_ARCHIVE_FILE,
-        "postprocessors": [{
-            "key": "FFmpegExtractAudio",
-            "preferredcodec": "mp3",
-            "preferredquality": "192",
-        },
-        {
-            "key": "FFmpegMetadata",
-            "add_metadata": True,
-        },
-        {
-            "key": "EmbedThumbnail",
-            "already_have_thumbnail": False,
-        }],
+        "download_archive": DOWNLOAD_ARCHIVE,
+        # Obal alba se vloží při převodu na MP3 (TRANSCODE_POOL)
         "writethumbnail": True,
+    }
+    transcode = {
+        **SPOTIFY_AUDIO_TRANSCODE,
         "metadata": {
             "title": track_info['title'],
             "artist": track_info['artist'],
@@ -444,305 +3371,371 @@ async def download_spotify_track_via_youtube_async(track_url: str, interaction:
         }
     }
     
+    status_message = await job.send(f"⏳ Zahajuji stahování `{track_info['title']}`...")
     try:
-        status_message = await interaction.followup.send(f"⏳ Zahajuji stahování `{track_info['title']}`...")
-        await download_with_ytdlp(f"ytsearch1:{query}", audio_user_dir, opts, status_message, item_name=track_info['title'])
-        # Finální zpráva je přesunuta do bloku finally
+        entry = (await resolve_spotify_tracks([track_info]))[0]
+        # Nalezené video z cache/hledání, jinak necháme vyhledat přímo yt-dlp
+        target = entry["url"] if entry else f"ytsearch1:{query}"
+        linked = await download_with_ytdlp(
+            target, audio_user_dir, opts, status_message, item_name=track_info['title'], transcode=transcode,
+            key=media_key(entry) if entry else None,
+        )
     except asyncio.CancelledError:
-        if not SILENT_MODE: await interaction.followup.send("🛑 Stahování bylo zrušeno.")
+        if not SILENT_MODE: await job.send("🛑 Stahování bylo zrušeno.")
+        return
     except Exception as e:
         error_msg = f"❌ Kritická chyba při stahování `{query}`: `{str(e).splitlines()[-1]}`"
-        if not SILENT_MODE: await interaction.followup.send(error_msg) # FIX 2: Bezpečné hlášení chyby
+        if not SILENT_MODE: await job.send(error_msg) # FIX 2: Bezpečné hlášení chyby
         logging.error(f"❌ Chyba při stahování `{query}`: {e}")
-        # Proměnná 'e' zde zůstane definovaná
-    finally:
-        if task_id in ACTIVE_DOWNLOAD_TASKS:
-            # Kontrola, zda nedošlo ke zrušení nebo kritické chybě (kdy je 'e' definováno)
-            if not ACTIVE_DOWNLOAD_TASKS[task_id].cancelled() and 'e' not in locals():
-                await status_message.edit(content=f"✅ Dokončeno `{track_info['title']}`.")
-            del ACTIVE_DOWNLOAD_TASKS[task_id]
-
-async def download_spotify_playlist_via_youtube_async(playlist_url: str, interaction: discord.Interaction):
-    task_id = interaction.user.id
-    ACTIVE_DOWNLOAD_TASKS[task_id] = asyncio.current_task()
-    
+        job.state = "failed"
+        return
+
+    await status_message.edit(content=f"✅ Dokončeno `{track_info['title']}`." + (" (Z úložiště, bez stahování.)" if linked else ""))
+
+async def download_spotify_playlist_via_youtube_async(job: DownloadJob):
+    playlist_url = job.url
     if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
-        if not SILENT_MODE: await interaction.followup.send("❌ Chybí Spotify Client ID / Secret v .env.")
+        if not SILENT_MODE: await job.send("❌ Chybí Spotify Client ID / Secret v .env.")
         logging.error("❌ Chybí Spotify Client ID / Secret v .env.")
         return
         
-    token = get_spotify_token(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET)
-    if not token:
-        if not SILENT_MODE: await interaction.followup.send("❌ Nepodařilo se získat Spotify token.")
+    try:
+        await asyncio.to_thread(SPOTIFY.token)
+    except Exception as e:
+        if not SILENT_MODE: await job.send("❌ Nepodařilo se získat Spotify token.")
+        logging.error(f"❌ Nepodařilo se získat Spotify token: {e}")
         return
-    
-    playlist_info = get_spotify_playlist_info(playlist_url, token)
+
+    try:
+        playlist_info = await asyncio.to_thread(get_spotify_playlist_info, playlist_url)
+    except Exception as e:
+        logging.error(f"❌ Chyba při získávání informací o playlistu {playlist_url}: {e}")
+        playlist_info = None
     if not playlist_info:
         playlist_name = "Neznámý Spotify Playlist"
         logging.warning("❌ Nepodařilo se získat informace o playlistu, ale pokračujem ve stahování.")
     else:
         playlist_name = playlist_info.get('name', 'Neznámý Playlist')
+    job.title = playlist_name
 
     # Složka: Downloads/Zvuk/Jméno uživatele/Název playlistu
-    user_folder_name = sanitize_filename(interaction.user.name)
+    user_folder_name = sanitize_filename(job.user_name)
     audio_user_dir = os.path.join(BASE_DOWNLOAD_DIR, AUDIO_DIR_NAME, user_folder_name)
-    ensure_folder(audio_user_dir)
 
     playlist_name_sanitized = sanitize_filename(playlist_name)
-    playlist_dir = os.path.join(audio_user_dir, playlist_name_sanitized) 
-    ensure_folder(playlist_dir)
-
-    tracks = await asyncio.to_thread(get_spotify_playlist_tracks, playlist_url, token)
-    if not tracks:
-        if not SILENT_MODE: await interaction.followup.send("❌ Playlist je prázdný nebo se nepodařilo získat metadata.")
-        logging.warning("❌ Playlist je prázdný nebo se nepodařilo získat metadata.")
-        return
-    
-    download_urls = [f"ytsearch1:{track['title']} {track['artist']}".strip() for track in tracks]
-    
-    if not download_urls:
-        if not SILENT_MODE: await interaction.followup.send("❌ Playlist neobsahuje žádné tracky pro stahování.")
-        return
+    playlist_dir = os.path.join(audio_user_dir, playlist_name_sanitized)
+    # Složky na NAS se zakládají mimo event loop (makedirs založí i složku uživatele)
+    await asyncio.to_thread(ensure_folder, playlist_dir)
 
     opts = {
         "format": "bestaudio/best",
         "outtmpl": os.path.join(playlist_dir, "%(title)s.%(ext)s"),
-        "download_archive": DOWNLOAD_ARCHIVE_FILE,
-        "postprocessors": [{
-            "key": "FFmpegExtractAudio",
-            "preferredcodec": "mp3",
-            "preferredquality": "192",
-        },
-        {
-            "key": "FFmpegMetadata",
-            "add_metadata": True,
-        },
-        {
-            "key": "EmbedThumbnail",
-            "already_have_thumbnail": False,
-        }],
+        "download_archive": DOWNLOAD_ARCHIVE,
+        # Tagy a obal alba se vloží při převodu na MP3 (TRANSCODE_POOL)
         "writethumbnail": True,
     }
 
+    total_tracks = (playlist_info or {}).get("total_tracks")
+    status_message = await job.send(f"🔎 Vyhledávám `{playlist_name}` ({total_tracks or '?'} tracků) na YouTube a stahuji...")
+    tracks = []
+    resolved = []
+
+    async def resolved_entries():
+        # Každá stránka playlistu se hned vyhledá a začne stahovat, další se mezitím načítají
+        async for page in iter_spotify_playlist_tracks(playlist_url):
+            entries = await resolve_spotify_tracks(page)
+            tracks.extend(page)
+            resolved.extend(entries)
+            yield [entry for entry in entries if entry]
+
     try:
-        status_message = await interaction.followup.send(f"⏳ Zahajuji kontrolu a stahování `{playlist_name}` ({len(download_urls)} tracků)...")
-        await download_with_ytdlp(download_urls, playlist_dir, opts, status_message, item_name=f"{playlist_name} playlist")
-        
+        summary = await download_playlist_items(resolved_entries(), opts, status_message, playlist_name, transcode=SPOTIFY_AUDIO_TRANSCODE)
     except asyncio.CancelledError:
-        if not SILENT_MODE: await interaction.followup.send("🛑 Stahování bylo zrušeno.")
+        if not SILENT_MODE: await job.send("🛑 Stahování bylo zrušeno.")
+        return
     except Exception as e:
         error_msg = f"❌ Kritická chyba při stahování playlistu `{playlist_name}`: `{str(e).splitlines()[-1]}`"
-        if not SILENT_MODE: await interaction.followup.send(error_msg) # FIX 2: Bezpečné hlášení chyby
+        if not SILENT_MODE: await job.send(error_msg) # FIX 2: Bezpečné hlášení chyby
         logging.error(f"❌ Chyba při stahování playlistu `{playlist_name}`: {e}")
-        # Proměnná 'e' zde zůstane definovaná
-    finally:
-        if task_id in ACTIVE_DOWNLOAD_TASKS: 
-            if not ACTIVE_DOWNLOAD_TASKS[task_id].cancelled() and 'e' not in locals():
-                await status_message.edit(content=f"**Hotovo!** Stahování/kontrola playlistu `{playlist_name}` dokončeno. (Nedostupné položky byly přeskočeny)")
-            
-            del ACTIVE_DOWNLOAD_TASKS[task_id]
-            
-            if 'e' not in locals(): 
-                playlist_id_unique = extract_playlist_id(playlist_url)
-                if playlist_id_unique:
-                    playlist_data = load_playlist_data()
-                    playlist_data[playlist_id_unique] = {
-                        "url": playlist_url,
-                        "folder": os.path.join(user_folder_name, playlist_name_sanitized), 
-                    }
-                    save_playlist_data(playlist_data)
-                    await interaction.followup.send(f"✅ Playlist `{playlist_name}` byl přidán k automatickému sledování. Pro kontrolu nových skladeb použijte příkaz `/check`.", ephemeral=True)
-
-async def download_youtube_playlist_video_async(url: str, interaction: discord.Interaction):
-    """Stáhne YouTube playlist jako video do VIDEO_SUB_DIR_NAME/Jméno uživatele/Název Playlistu."""
-    task_id = interaction.user.id
-    ACTIVE_DOWNLOAD_TASKS[task_id] = asyncio.current_task()
-    
-    try:
-        status_message = await interaction.followup.send("⏳ Získávám informace o YouTube playlistu...")
-        
-        # Extrahuj metadata bez stahování
-        info = await asyncio.to_thread(yt_dlp.YoutubeDL({'quiet': True, 'extract_flat': 'in_playlist', 'ignoreerrors': True}).extract_info, url, download=False)
-        
-        if not info or 'title' not in info:
-            await status_message.edit(content="❌ Nepodařilo se získat název playlistu. Zkontrolujte, zda je veřejný.")
-            del ACTIVE_DOWNLOAD_TASKS[task_id]
-            return
+        job.state = "failed"
+        return
 
-        playlist_name = info['title']
-        playlist_name_sanitized = sanitize_filename(playlist_name)
-        
-    except Exception as e:
-        await interaction.followup.send(f"❌ Chyba při získávání informací o playlistu: {e}")
-        logging.error(f"❌ Chyba při získávání informací o YouTube playlistu: {e}")
-        del ACTIVE_DOWNLOAD_TASKS[task_id]
+    if not tracks:
+        if not SILENT_MODE: await status_message.edit(content="❌ Playlist je prázdný nebo se nepodařilo získat metadata.")
+        logging.warning("❌ Playlist je prázdný nebo se nepodařilo získat metadata.")
+        return
+    if not any(resolved):
+        if not SILENT_MODE: await status_message.edit(content="❌ Playlist neobsahuje žádné tracky pro stahování.")
         return
 
-    # Složka: Downloads/Video/Jméno uživatele/Název Playlistu
-    user_folder_name = sanitize_filename(interaction.user.name)
-    out_dir = os.path.join(BASE_DOWNLOAD_DIR, VIDEO_DIR_NAME, user_folder_name, playlist_name_sanitized) 
-    ensure_folder(out_dir)
+    await status_message.edit(content=f"**Hotovo!** Stahování/kontrola playlistu `{playlist_name}` dokončeno. (Nedostupné položky byly přeskočeny)")
 
-    # Nastav možnosti stahování (Video)
-    opts = {
-        "format": "bestvideo[height<=1080]+bestaudio/best", 
-        "merge_output_format": "mp4", 
-        "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
-        "download_archive": DOWNLOAD_ARCHIVE_FILE # Pro přeskakování
-    }
-    
-    try:
-        # Přejmenuj status message pro stahování
-        await status_message.edit(content=f"⏳ Zahajuji stahování VIDEO playlistu `{playlist_name}`...")
-        
-        # Spusť stahování
-        await download_with_ytdlp(url, out_dir, opts, status_message, item_name=playlist_name)
-        
-        # Finální zpráva je přesunuta do bloku finally
-    except asyncio.CancelledError:
-        if not SILENT_MODE: await status_message.edit(content="🛑 Stahování bylo zrušeno.")
-    except Exception as e:
-        error_msg = f"❌ Kritická chyba při stahování playlistu `{playlist_name}`: `{str(e).splitlines()[-1]}`"
-        if not SILENT_MODE: await interaction.followup.send(error_msg) # FIX 2: Bezpečné hlášení chyby
-        logging.error(f"❌ Chyba při stahování playlistu `{playlist_name}`: {e}")
-        # Proměnná 'e' zde zůstane definovaná
-    finally:
-        if task_id in ACTIVE_DOWNLOAD_TASKS:
-            if not ACTIVE_DOWNLOAD_TASKS[task_id].cancelled() and 'e' not in locals():
-                await status_message.edit(content=f"✅ Stahování VIDEO playlistu `{playlist_name}` dokončeno. (Nedostupné položky byly přeskočeny)")
-            del ACTIVE_DOWNLOAD_TASKS[task_id]
+    playlist_id_unique = extract_playlist_id(playlist_url)
+    if playlist_id_unique:
+        # Snapshot pro příští kontroly: zpracované skladby (neúspěšné se zkusí znovu)
+        failed_media = set(summary["failed_keys"])
+        failed_keys = {
+            spotify_track_key(track) for track, entry in zip(tracks, resolved)
+            if entry is None or media_key(entry) in failed_media
+        }
+        handled = {spotify_track_key(track) for track in tracks} - failed_keys
+        await asyncio.to_thread(
+            STATE_STORE.save_playlist, playlist_id_unique, playlist_url, os.path.join(user_folder_name, playlist_name_sanitized),
+            PlaylistScheduler.next_run_after_check({}),
+        )
+        await asyncio.to_thread(
+            STATE_STORE.save_playlist_snapshot, playlist_id_unique,
+            (playlist_info or {}).get("snapshot_id") if not failed_keys else None, handled, set(),
+        )
+        await job.send(f"✅ Playlist `{playlist_name}` byl přidán k automatickému sledování. Pro kontrolu nových skladeb použijte příkaz `/check`.", ephemeral=True)
 
-async def download_youtube_playlist_audio_async(url: str, interaction: discord.Interaction):
-    """Stáhne YouTube playlist jako audio do AUDIO_SUB_DIR_NAME/Jméno uživatele/Název Playlistu."""
-    task_id = interaction.user.id
-    ACTIVE_DOWNLOAD_TASKS[task_id] = asyncio.current_task()
+async def _download_youtube_playlist_async(job: DownloadJob, as_audio: bool):
+    """Společný průběh stahování YouTube playlistu jako video nebo audio."""
+    url = job.url
+    label = "ZVUK" if as_audio else "VIDEO"
     
+    status_message = await job.send("⏳ Získávám informace o YouTube playlistu...")
     try:
-        status_message = await interaction.followup.send("⏳ Získávám informace o YouTube playlistu...")
-        
-        # Extrahuj metadata bez stahování
-        info = await asyncio.to_thread(yt_dlp.YoutubeDL({'quiet': True, 'extract_flat': 'in_playlist', 'ignoreerrors': True}).extract_info, url, download=False)
+        if job.plan:
+            # Obnovená úloha – seznam položek je uložen v žurnálu, playlist znovu neextrahujeme
+            info = job.plan
+        else:
+            # Extrahuj metadata bez stahování
+            info = await extract_info_cached(url, {'quiet': True, 'extract_flat': 'in_playlist', 'ignoreerrors': True})
+            if info and 'title' in info:
+                plan = {
+                    "title": info['title'],
+                    "entries": [
+                        {key: entry.get(key) for key in ("id", "ie_key", "url", "webpage_url", "title")}
+                        for entry in info.get('entries') or [] if entry
+                    ],
+                }
+                await asyncio.to_thread(job.journal, "planned", None, plan)
         
         if not info or 'title' not in info:
             await status_message.edit(content="❌ Nepodařilo se získat název playlistu. Zkontrolujte, zda je veřejný.")
-            del ACTIVE_DOWNLOAD_TASKS[task_id]
+            return
+        if not info.get('entries'):
+            await status_message.edit(content="❌ Playlist neobsahuje žádné dostupné položky.")
+            job.state = "failed"
             return
 
         playlist_name = info['title']
         playlist_name_sanitized = sanitize_filename(playlist_name)
+        job.title = playlist_name
         
     except Exception as e:
-        await interaction.followup.send(f"❌ Chyba při získávání informací o playlistu: {e}")
+        await job.send(f"❌ Chyba při získávání informací o playlistu: {e}")
         logging.error(f"❌ Chyba při získávání informací o YouTube playlistu: {e}")
-        del ACTIVE_DOWNLOAD_TASKS[task_id]
+        job.state = "failed"
         return
 
-    # Složka: Downloads/Zvuk/Jméno uživatele/Název Playlistu
-    user_folder_name = sanitize_filename(interaction.user.name)
-    out_dir = os.path.join(BASE_DOWNLOAD_DIR, AUDIO_DIR_NAME, user_folder_name, playlist_name_sanitized) 
-    ensure_folder(out_dir)
-
-    # Nastav možnosti stahování (Audio MP3)
-    opts = {
-        "format": "bestaudio/best",
-        "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
-        "download_archive": DOWNLOAD_ARCHIVE_FILE,
-        "postprocessors": [{
-            "key": "FFmpegExtractAudio",
-            "preferredcodec": "mp3",
-            "preferredquality": "192",
-        }]
-    }
+    user_folder_name = sanitize_filename(job.user_name)
+    if as_audio:
+        # Složka: Downloads/Zvuk/Jméno uživatele/Název Playlistu
+        out_dir = os.path.join(BASE_DOWNLOAD_DIR, AUDIO_DIR_NAME, user_folder_name, playlist_name_sanitized)
+        # Nastav možnosti stahování (Audio MP3)
+        opts = {
+            "format": "bestaudio/best",
+            "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
+            "download_archive": DOWNLOAD_ARCHIVE,
+            # Převod na MP3 probíhá až po stažení v TRANSCODE_POOL
+        }
+    else:
+        # Složka: Downloads/Video/Jméno uživatele/Název Playlistu
+        out_dir = os.path.join(BASE_DOWNLOAD_DIR, VIDEO_DIR_NAME, user_folder_name, playlist_name_sanitized)
+        # Nastav možnosti stahování (Video)
+        opts = {
+            "format": "bestvideo[height<=1080]+bestaudio/best", 
+            "merge_output_format": "mp4", 
+            "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
+            "download_archive": DOWNLOAD_ARCHIVE # Pro přeskakování
+        }
+    await asyncio.to_thread(ensure_folder, out_dir)
     
     try:
         # Přejmenuj status message pro stahování
-        await status_message.edit(content=f"⏳ Zahajuji stahování ZVUK playlistu `{playlist_name}`...")
+        await status_message.edit(content=f"⏳ Zahajuji stahování {label} playlistu `{playlist_name}`...")
         
-        # Spusť stahování
-        await download_with_ytdlp(url, out_dir, opts, status_message, item_name=playlist_name)
-        
-        # Finální zpráva je přesunuta do bloku finally
+        # Položky se stahují souběžně z již získaného seznamu, playlist se znovu neextrahuje
+        summary = await download_playlist_items(
+            info.get('entries') or [], opts, status_message, playlist_name, transcode=AUDIO_TRANSCODE if as_audio else None
+        )
     except asyncio.CancelledError:
         if not SILENT_MODE: await status_message.edit(content="🛑 Stahování bylo zrušeno.")
+        return
     except Exception as e:
         error_msg = f"❌ Kritická chyba při stahování playlistu `{playlist_name}`: `{str(e).splitlines()[-1]}`"
-        if not SILENT_MODE: await interaction.followup.send(error_msg) # FIX 2: Bezpečné hlášení chyby
+        if not SILENT_MODE: await job.send(error_msg) # FIX 2: Bezpečné hlášení chyby
         logging.error(f"❌ Chyba při stahování playlistu `{playlist_name}`: {e}")
-        # Proměnná 'e' zde zůstane definovaná
-    finally:
-        if task_id in ACTIVE_DOWNLOAD_TASKS:
-            if not ACTIVE_DOWNLOAD_TASKS[task_id].cancelled() and 'e' not in locals():
-                await status_message.edit(content=f"✅ Stahování ZVUK playlistu `{playlist_name}` dokončeno. (Nedostupné položky byly přeskočeny)")
-            del ACTIVE_DOWNLOAD_TASKS[task_id]
+        job.state = "failed"
+        return
 
+    await status_message.edit(content=f"✅ Stahování {label} playlistu `{playlist_name}` dokončeno. Staženo {summary['done']}, z úložiště {summary['linked']}, již staženo {summary['skipped']}, nedostupných {summary['failed']}.")
 
-async def download_generic_async(url: str, as_audio: bool, interaction: discord.Interaction):
-    task_id = interaction.user.id
-    ACTIVE_DOWNLOAD_TASKS[task_id] = asyncio.current_task()
-    
-    user_folder_name = sanitize_filename(interaction.user.name)
+async def download_youtube_playlist_video_async(job: DownloadJob):
+    """Stáhne YouTube playlist jako video do VIDEO_SUB_DIR_NAME/Jméno uživatele/Název Playlistu."""
+    await _download_youtube_playlist_async(job, as_audio=False)
+
+async def download_youtube_playlist_audio_async(job: DownloadJob):
+    """Stáhne YouTube playlist jako audio do AUDIO_SUB_DIR_NAME/Jméno uživatele/Název Playlistu."""
+    await _download_youtube_playlist_async(job, as_audio=True)
+
+
+def generic_user_dir(user_name: str, as_audio: bool) -> str:
+    """Složka uživatele: Downloads/Zvuk/Jméno uživatele nebo Downloads/Video/Jméno uživatele."""
+    return os.path.join(BASE_DOWNLOAD_DIR, AUDIO_DIR_NAME if as_audio else VIDEO_DIR_NAME, sanitize_filename(user_name))
 
+def generic_download_opts(out_dir: str, as_audio: bool) -> dict:
+    """Možnosti yt-dlp pro jednotlivé video nebo zvuk (/stahni i /hromadne)."""
     if as_audio:
-        # Složka: Downloads/Zvuk/Jméno uživatele
-        out_dir = os.path.join(BASE_DOWNLOAD_DIR, AUDIO_DIR_NAME, user_folder_name)
-    else:
-        # Složka: Downloads/Video/Jméno uživatele
-        out_dir = os.path.join(BASE_DOWNLOAD_DIR, VIDEO_DIR_NAME, user_folder_name)
+        return {
+            "format": "bestaudio/best",
+            "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
+            "download_archive": DOWNLOAD_ARCHIVE,
+            # Převod na MP3 probíhá až po stažení v TRANSCODE_POOL
+        }
+    return {
+        "format": "bestvideo[height<=1080]+bestaudio/best",
+        "merge_output_format": "mp4",
+        "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
+        "download_archive": DOWNLOAD_ARCHIVE
+    }
+
+async def download_generic_async(job: DownloadJob):
+    url = job.url
+    as_audio = job.as_audio
+    out_dir = generic_user_dir(job.user_name, as_audio)
+    await asyncio.to_thread(ensure_folder, out_dir)
 
-    ensure_folder(out_dir)
-    
     # --- Získání názvu pro lepší zpětnou vazbu ---
-    status_message = await interaction.followup.send("⏳ Získávám informace o videu/zvuku...")
+    status_message = await job.send("⏳ Získávám informace o videu/zvuku...")
     item_name = url 
+    info = None
     try:
-        # Použij extract_info pro získání názvu
-        info = await asyncio.to_thread(yt_dlp.YoutubeDL({'quiet': True, 'ignoreerrors': True}).extract_info, url, download=False)
+        # Jediná extrakce: výsledek slouží pro název i pro samotné stahování
+        info = await extract_info_cached(url, {'quiet': True, 'ignoreerrors': True})
         item_name = info.get('title', url)
     except Exception:
         pass # Ignorovat chyby při získávání názvu, použít URL
+    job.title = item_name
     
     await status_message.edit(content=f"⏳ Zahajuji stahování `{item_name}`...")
     # ---------------------------------------------
 
-    if as_audio:
-        opts = {
-            "format": "bestaudio/best",
-            "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
-            "download_archive": DOWNLOAD_ARCHIVE_FILE,
-            "postprocessors": [{
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "192",
-            }]
-        }
-    else:
-        opts = {
-            "format": "bestvideo[height<=1080]+bestaudio/best", 
-            "merge_output_format": "mp4", 
-            "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
-            "download_archive": DOWNLOAD_ARCHIVE_FILE
-        }
-    
+    opts = generic_download_opts(out_dir, as_audio)
+
     try:
-        await download_with_ytdlp(url, out_dir, opts, status_message, item_name=item_name)
-        # Finální zpráva je přesunuta do bloku finally
+        linked = await download_with_ytdlp(url, out_dir, opts, status_message, item_name=item_name, info=info, transcode=AUDIO_TRANSCODE if as_audio else None)
     except asyncio.CancelledError:
         if not SILENT_MODE: await status_message.edit(content="🛑 Stahování bylo zrušeno.")
+        return
     except Exception as e:
         error_msg = f"❌ Kritická chyba při stahování `{item_name}`: `{str(e).splitlines()[-1]}`"
-        if not SILENT_MODE: await interaction.followup.send(error_msg) # FIX 2: Bezpečné hlášení chyby
+        if not SILENT_MODE: await job.send(error_msg) # FIX 2: Bezpečné hlášení chyby
         logging.error(f"❌ Chyba při stahování: {e}")
-        # Proměnná 'e' zde zůstane definovaná
-    finally:
-        if task_id in ACTIVE_DOWNLOAD_TASKS:
-            if not ACTIVE_DOWNLOAD_TASKS[task_id].cancelled() and 'e' not in locals():
-                await status_message.edit(content=f"✅ Stahování `{item_name}` dokončeno.")
-            del ACTIVE_DOWNLOAD_TASKS[task_id]
+        job.state = "failed"
+        return
+
+    await status_message.edit(content=f"✅ Stahování `{item_name}` dokončeno." + (" (Z úložiště, bez stahování.)" if linked else ""))
+
+def plan_batch(urls: list, out_dir: str, as_audio: bool) -> dict:
+    """
+    Roztřídí URL hromadné úlohy (běží ve vlákně): nepodporované a playlisty
+    vyřadí, duplicity sloučí podle kanonického ID a položky, které už jsou
+    v archivu a nelze je vložit z úložiště obsahu, vynechá předem.
+    """
+    report = {"total": len(urls), "unsupported": 0, "playlists": 0, "duplicates": 0, "archived": 0, "stored": 0}
+    entries = {}
+    for url in urls:
+        platform = detect_platform(url)
+        if platform is None:
+            report["unsupported"] += 1
+            continue
+        if platform not in CANONICAL_ID_PATTERNS:
+            # Playlisty a Spotify mají vlastní průběh přes /stahni
+            report["playlists"] += 1
+            continue
+        entry = canonical_entry(url, platform)
+        key = media_key(entry) if entry.get("id") else url
+        if key in entries:
+            report["duplicates"] += 1
+            continue
+        entries[key] = entry
+
+    variant = CONTENT_STORE.variant(generic_download_opts(out_dir, as_audio), AUDIO_TRANSCODE if as_audio else None)
+    keys = [key for key, entry in entries.items() if entry.get("id")]
+    missing = STATE_STORE.archive_missing(keys)
+    METRICS.inc("bot_archive_lookups_total", len(keys) - len(missing), check="batch", result="hit")
+    METRICS.inc("bot_archive_lookups_total", len(missing), check="batch", result="miss")
+    planned = []
+    for key, entry in entries.items():
+        if entry.get("id") and CONTENT_STORE.lookup(key, variant):
+            # Hotový soubor se uživateli jen vloží z úložiště
+            report["stored"] += 1
+        elif entry.get("id") and key not in missing:
+            report["archived"] += 1
+            continue
+        planned.append(entry)
+    return {"title": f"Hromadné stahování ({len(planned)} URL)", "entries": planned, "report": report}
+
+async def download_batch_async(job: DownloadJob):
+    """Hromadná úloha: položky z plánu (/hromadne) se stahují souběžně s jednou souhrnnou zprávou."""
+    if not job.plan:
+        await job.send("❌ Seznam URL hromadné úlohy se nepodařilo načíst.")
+        job.state = "failed"
+        return
+    job.title = job.plan["title"]
+    label = "ZVUK" if job.as_audio else "VIDEO"
+    out_dir = generic_user_dir(job.user_name, job.as_audio)
+    await asyncio.to_thread(ensure_folder, out_dir)
+
+    status_message = await job.send(f"⏳ Zahajuji hromadné stahování ({label}): {len(job.plan['entries'])} položek...")
+    try:
+        summary = await download_playlist_items(
+            job.plan["entries"], generic_download_opts(out_dir, job.as_audio), status_message, job.title,
+            transcode=AUDIO_TRANSCODE if job.as_audio else None,
+        )
+    except asyncio.CancelledError:
+        if not SILENT_MODE: await status_message.edit(content="🛑 Stahování bylo zrušeno.")
+        return
+    except Exception as e:
+        if not SILENT_MODE: await job.send(f"❌ Kritická chyba při hromadném stahování: `{str(e).splitlines()[-1]}`")
+        logging.error(f"❌ Chyba při hromadném stahování úlohy #{job.job_id}: {e}")
+        job.state = "failed"
+        return
+
+    await status_message.edit(content=f"✅ Hromadné stahování ({label}) dokončeno. Staženo {summary['done']}, z úložiště {summary['linked']}, již staženo {summary['skipped']}, nedostupných {summary['failed']}.")
+
+# Mapování typu úlohy na funkci, která ji zpracuje
+JOB_RUNNERS = {
+    "generic": download_generic_async,
+    "spotify_track": download_spotify_track_via_youtube_async,
+    "spotify_playlist": download_spotify_playlist_via_youtube_async,
+    "youtube_playlist_video": download_youtube_playlist_video_async,
+    "youtube_playlist_audio": download_youtube_playlist_audio_async,
+    "batch": download_batch_async,
+}
 
 # -------------------------------------------
 # Discord bot příkazy a interaktivní tlačítka
 # -------------------------------------------
 
+async def enqueue_download(interaction: discord.Interaction, kind: str, url: str, as_audio: bool = False, plan: dict = None):
+    """Vytvoří z interakce úlohu a zařadí ji do fronty stahování (s `plan` rovnou uloženým do žurnálu)."""
+    job = DownloadJob.from_interaction(kind, url, interaction, as_audio=as_audio)
+    job.plan = plan
+    try:
+        # Na plné úložiště úlohu ani nezařadíme
+        await asyncio.to_thread(ensure_free_space, BASE_DOWNLOAD_DIR)
+        position = await JOB_QUEUE.submit(job)
+    except ValueError as e:
+        await interaction.followup.send(f"❌ {e}", ephemeral=True)
+        return
+    if plan is not None:
+        await asyncio.to_thread(job.journal, "planned", None, plan)
+    await interaction.followup.send(f"📥 Úloha `#{job.job_id}` byla zařazena do fronty (pozice {position}). Stav zobrazíš příkazem `/queue`.")
+
 class DownloadView(discord.ui.View):
     def __init__(self, url: str):
         super().__init__(timeout=180.0)
@@ -755,7 +3748,7 @@ class DownloadView(discord.ui.View):
         await interaction.message.edit(view=self)
         await interaction.response.defer(ephemeral=False)
         self.stop()
-        await download_generic_async(self.url, as_audio=False, interaction=interaction)
+        await enqueue_download(interaction, "generic", self.url, as_audio=False)
 
     @discord.ui.button(label="Zvuk", style=discord.ButtonStyle.secondary, emoji="🎧")
     async def audio_button(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -764,7 +3757,7 @@ class DownloadView(discord.ui.View):
         await interaction.message.edit(view=self)
         await interaction.response.defer(ephemeral=False)
         self.stop()
-        await download_generic_async(self.url, as_audio=True, interaction=interaction)
+        await enqueue_download(interaction, "generic", self.url, as_audio=True)
 
 class YoutubePlaylistView(discord.ui.View):
     def __init__(self, url: str):
@@ -778,7 +3771,7 @@ class YoutubePlaylistView(discord.ui.View):
         await interaction.message.edit(view=self)
         await interaction.response.defer(ephemeral=False)
         self.stop()
-        await download_youtube_playlist_video_async(self.url, interaction)
+        await enqueue_download(interaction, "youtube_playlist_video", self.url)
 
     @discord.ui.button(label="Zvuk Playlist (MP3)", style=discord.ButtonStyle.secondary, emoji="🎵")
     async def audio_playlist_button(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -787,32 +3780,121 @@ class YoutubePlaylistView(discord.ui.View):
         await interaction.message.edit(view=self)
         await interaction.response.defer(ephemeral=False)
         self.stop()
-        await download_youtube_playlist_audio_async(self.url, interaction)
+        await enqueue_download(interaction, "youtube_playlist_audio", self.url)
 
 intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
 
+# -------------------------------------------
+# Rychlý start
+# -------------------------------------------
+# Kontrola ffmpeg i synchronizace příkazů se opakují jen tehdy, když se od
+# posledního startu něco změnilo – otisky se ukládají do tabulky meta.
+READY_LOGGED = False
+
+def probe_ffmpeg():
+    """
+    Vrátí první řádek `ffmpeg -version`, nebo None, když ffmpeg chybí.
+    Výsledek je uložen podle cesty, velikosti a času změny binárky, takže se
+    ffmpeg spouští jen po jeho aktualizaci.
+    """
+    path = shutil.which("ffmpeg")
+    if not path:
+        return None
+    real = os.path.realpath(path)
+    try:
+        st = os.stat(real)
+    except OSError:
+        return None
+    fingerprint = f"{real}:{st.st_size}:{st.st_mtime_ns}"
+    cached = STATE_STORE.meta_get("ffmpeg_probe")
+    if cached:
+        data = json.loads(cached)
+        if data.get("fingerprint") == fingerprint:
+            return data["version"]
+    try:
+        output = subprocess.run([path, "-version"], capture_output=True, text=True, check=True, timeout=30).stdout
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError):
+        return None
+    version = (output.splitlines() or ["ffmpeg"])[0].strip()
+    STATE_STORE.meta_set("ffmpeg_probe", json.dumps({"fingerprint": fingerprint, "version": version}))
+    return version
+
+def command_tree_fingerprint() -> str:
+    """Otisk všech slash příkazů (názvy, popisy, parametry) v podobě, jakou posílá Discordu."""
+    payload = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+async def sync_command_tree(force: bool = False) -> bool:
+    """Synchronizuje slash příkazy jen při změně jejich otisku. Vrací True, pokud proběhla synchronizace."""
+    key = f"command_tree:{bot.application_id}"
+    fingerprint = command_tree_fingerprint()
+    if not force and await asyncio.to_thread(STATE_STORE.meta_get, key) == fingerprint:
+        logging.info("⏭️ Slash commandy se nezměnily, synchronizace přeskočena.")
+        return False
+    await bot.tree.sync()
+    await asyncio.to_thread(STATE_STORE.meta_set, key, fingerprint)
+    logging.info("✅ Slash commandy byly synchronizovány.")
+    return True
+
+def _preload_ytdlp():
+    """Načte yt_dlp na pozadí, aby první stahování nečekalo na import extraktorů."""
+    started = time.perf_counter()
+    import yt_dlp # noqa: F401
+    logging.info(f"📦 yt-dlp načteno na pozadí za {time.perf_counter() - started:.2f} s.")
+
 @bot.event
 async def on_ready():
+    global READY_LOGGED
     logging.info(f'✅ Bot je připojen jako {bot.user}')
 
-    # Kontrola pro FFMPEG
-    try:
-        subprocess.check_call(['ffmpeg', '-version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        logging.info("✅ Systémový FFMPEG je dostupný.")
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    # Watchdog hned na začátku, aby zachytil i blokování při startu
+    LOOP_WATCHDOG.start()
+
+    # Kontrola pro FFMPEG (mimo event loop, výsledek je uložen podle otisku binárky)
+    ffmpeg_version = await asyncio.to_thread(probe_ffmpeg)
+    if ffmpeg_version:
+        logging.info(f"✅ Systémový FFMPEG je dostupný ({ffmpeg_version}).")
+    else:
         logging.critical("❌ FFMPEG nebyl nalezen v systémové PATH! Stahování zvuku a spojování videa/zvuku nebude fungovat. Použijte 'sudo apt install ffmpeg'.")
         await send_dm_to_owner("⚠️ **Upozornění:** FFMPEG nebyl nalezen v systémové PATH. Stahování zvuku a spojování videa/zvuku nebude fungovat.", error_details="Nainstalujte FFMPEG přes 'sudo apt install ffmpeg'.")
 
+    try:
+        await sync_command_tree()
+    except discord.HTTPException as e:
+        logging.error(f"❌ Synchronizace slash commandů selhala: {e}")
+
+    # Dispečer fronty stahování (při opětovném připojení se nespouští znovu)
+    JOB_QUEUE.start()
+    await METRICS.start(METRICS_HOST, METRICS_PORT)
 
-    await bot.tree.sync()
-    logging.info("✅ Slash commandy byly synchronizovány.")
+    # Nedokončené úlohy z minulého běhu (/stop, restart, pád) – pokračují od nedokončených položek
+    for job in await JOB_QUEUE.restore():
+        try:
+            await job.send(f"♻️ Pokračuji v přerušené úloze {job.describe()} po restartu bota.")
+        except discord.HTTPException as e:
+            logging.warning(f"Oznámení o obnovené úloze #{job.job_id} se nepodařilo odeslat: {e}")
+
+    # Doba od spuštění procesu do připravenosti (jen při prvním připojení)
+    if not READY_LOGGED:
+        READY_LOGGED = True
+        elapsed = time.perf_counter() - PROCESS_STARTED
+        logging.info(f"⏱️ Bot připraven za {elapsed:.2f} s od spuštění procesu.")
+        threading.Thread(target=_preload_ytdlp, name="ytdlp-preload", daemon=True).start()
 
     await send_dm_to_owner("✅ Bot byl úspěšně spuštěn a je online.")
     
-    # Spuštění smyčky pro kontrolu playlistů
-    bot.loop.create_task(check_for_new_songs_async())
+    # Plánovač kontroly playlistů (běží jen jednou i po opětovném připojení)
+    PLAYLIST_SCHEDULER.start()
+
+    # Pracovní složky dávno přerušených stahování (úlohy, které se už neobnoví)
+    removed = await asyncio.to_thread(STAGING.prune, STAGING_RETENTION)
+    if removed:
+        logging.info(f"🧹 Smazáno {removed} starých pracovních složek z {STAGING_DIR}.")
+
+    # Sken knihovny dožene soubory přidané nebo smazané mimo bota
+    LIBRARY.start()
 
 # --- Slash Commands ---
 
@@ -823,7 +3905,7 @@ async def sync_commands(interaction: discord.Interaction):
         return
 
     await interaction.response.send_message("⏳ Synchronizuji slash commandy...", ephemeral=True)
-    await bot.tree.sync()
+    await sync_command_tree(force=True)
     await interaction.followup.send("✅ Slash commandy byly synchronizovány.", ephemeral=True)
 
 @bot.tree.command(name='stahni', description='Stáhne obsah z dané URL (YouTube, TikTok, Instagram, Spotify).')
@@ -841,29 +3923,143 @@ async def stahni_command(interaction: discord.Interaction, url: str):
     await interaction.response.defer() 
 
     if platform == "spotify_playlist" or platform == "spotify_test_url":
-        await download_spotify_playlist_via_youtube_async(url, interaction)
+        await enqueue_download(interaction, "spotify_playlist", url)
     elif platform == "youtube_playlist":
         view = YoutubePlaylistView(url)
         await interaction.followup.send("Chceš stáhnout **celý playlist** jako **video** nebo **zvuk (MP3)**?", view=view)
     elif platform == "spotify_track":
-        await download_spotify_track_via_youtube_async(url, interaction)
+        await enqueue_download(interaction, "spotify_track", url)
     elif platform in ["youtube", "tiktok", "instagram"]:
         view = DownloadView(url)
         await interaction.followup.send("Chceš stáhnout **video** nebo **zvuk**?", view=view)
 
-@bot.tree.command(name='dlstop', description='Zastaví probíhající stahování yt-dlp.')
-async def dlstop_command(interaction: discord.Interaction):
-    task_id = interaction.user.id
-    if task_id in ACTIVE_DOWNLOAD_TASKS:
-        task = ACTIVE_DOWNLOAD_TASKS[task_id]
-        if not task.done():
-            task.cancel()
-            await interaction.response.send_message("✅ Pokus o zastavení stahování. Může chvíli trvat, než se proces ukončí.", ephemeral=True)
-        else:
-            await interaction.response.send_message("✅ Žádné aktivní stahování neprobíhá.", ephemeral=True)
+@bot.tree.command(name='hromadne', description='Stáhne najednou více URL (seznam nebo přiložený .txt soubor).')
+@app_commands.describe(
+    urls="URL oddělené mezerou, čárkou nebo novým řádkem",
+    soubor="Textový soubor s jednou URL na řádek",
+    zvuk="Stáhnout jako zvuk (MP3) místo videa",
+)
+async def hromadne_command(interaction: discord.Interaction, urls: str = None, soubor: discord.Attachment = None, zvuk: bool = False):
+    if not is_owner_or_designated_channel(interaction):
+        await interaction.response.send_message("Nemáš oprávnění použít tento příkaz.", ephemeral=True)
+        return
+    if soubor is not None and soubor.size > BATCH_MAX_ATTACHMENT_BYTES:
+        await interaction.response.send_message(f"❌ Soubor je příliš velký (nejvýše {BATCH_MAX_ATTACHMENT_BYTES // 1024} KiB).", ephemeral=True)
+        return
+
+    await interaction.response.defer()
+    text = urls or ""
+    if soubor is not None:
+        try:
+            text += "\n" + (await soubor.read()).decode("utf-8-sig", errors="replace")
+        except discord.HTTPException as e:
+            await interaction.followup.send(f"❌ Soubor se nepodařilo načíst: {e}", ephemeral=True)
+            return
+
+    found = extract_urls(text)
+    if not found:
+        await interaction.followup.send("❌ Nenašel jsem žádnou URL.", ephemeral=True)
+        return
+    if len(found) > BATCH_MAX_URLS:
+        await interaction.followup.send(f"❌ Příliš mnoho URL ({len(found)}), najednou jich jde nejvýše {BATCH_MAX_URLS}.", ephemeral=True)
+        return
+
+    plan = await asyncio.to_thread(plan_batch, found, generic_user_dir(interaction.user.name, zvuk), zvuk)
+    report = plan.pop("report")
+    lines = [f"📋 **{report['total']} URL:** ke stažení {len(plan['entries'])} (z toho {report['stored']} z úložiště)"]
+    for key, label in (("duplicates", "duplicit"), ("archived", "již staženo"), ("playlists", "playlistů a Spotify (použij /stahni)"), ("unsupported", "nepodporovaných")):
+        if report[key]:
+            lines.append(f"• {label}: {report[key]}")
+    await interaction.followup.send("\n".join(lines))
+    if plan["entries"]:
+        await enqueue_download(interaction, "batch", plan["title"], as_audio=zvuk, plan=plan)
+
+@bot.tree.command(name='dlstop', description='Zastaví probíhající nebo čekající stahování.')
+@app_commands.describe(job_id="Číslo úlohy (bez zadání se zastaví všechny tvoje úlohy)")
+async def dlstop_command(interaction: discord.Interaction, job_id: int = None):
+    if job_id is not None:
+        job = JOB_QUEUE.get(job_id)
+        if not job or (job.user_id != interaction.user.id and not is_owner(interaction)):
+            await interaction.response.send_message(f"❌ Úloha `#{job_id}` neexistuje nebo ti nepatří.", ephemeral=True)
+            return
+        jobs = [job]
+    else:
+        jobs = JOB_QUEUE.jobs_for_user(interaction.user.id)
+
+    cancelled = [job for job in jobs if await JOB_QUEUE.cancel(job)]
+    if cancelled:
+        ids = ", ".join(f"`#{job.job_id}`" for job in cancelled)
+        await interaction.response.send_message(f"✅ Pokus o zastavení stahování {ids}. Může chvíli trvat, než se proces ukončí.", ephemeral=True)
     else:
         await interaction.response.send_message("✅ Žádné aktivní stahování neprobíhá.", ephemeral=True)
 
+@bot.tree.command(name='queue', description='Zobrazí běžící a čekající úlohy stahování.')
+async def queue_command(interaction: discord.Interaction):
+    if not is_owner_or_designated_channel(interaction):
+        await interaction.response.send_message("Nemáš oprávnění použít tento příkaz.", ephemeral=True)
+        return
+
+    lines = [f"**Běží ({len(JOB_QUEUE.running)}/{JOB_QUEUE.workers}):**"]
+    for job in list(JOB_QUEUE.running.values())[:10]:
+        lines.append(f"▶️ {job.describe()} – {int(time.time() - job.started_at)} s")
+    if not JOB_QUEUE.running:
+        lines.append("_nic_")
+
+    if BANDWIDTH.limit():
+        lines.append(f"📶 Limit pásma: {BandwidthScheduler.describe(BANDWIDTH.limit())}")
+
+    lines.append(f"**Čeká ({len(JOB_QUEUE.pending)}/{JOB_QUEUE.limit}):**")
+    for position, job in enumerate(JOB_QUEUE.ordered_pending()[:15], start=1):
+        lines.append(f"{position}. {'📦 ' if job.lane == 'bulk' else ''}{job.describe()}")
+    if len(JOB_QUEUE.pending) > 15:
+        lines.append(f"… a dalších {len(JOB_QUEUE.pending) - 15}")
+    if not JOB_QUEUE.pending:
+        lines.append("_nic_")
+
+    await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
+
+@bot.tree.command(name='hledej', description='Vyhledá stažené soubory v knihovně podle názvu.')
+@app_commands.describe(dotaz="Slova z názvu souboru, interpreta nebo složky")
+async def hledej_command(interaction: discord.Interaction, dotaz: str):
+    if not is_owner_or_designated_channel(interaction):
+        await interaction.response.send_message("Nemáš oprávnění použít tento příkaz.", ephemeral=True)
+        return
+
+    results = await asyncio.to_thread(LIBRARY.search, dotaz)
+    if not results:
+        await interaction.response.send_message(f"🔍 Pro `{dotaz}` nic nenalezeno.", ephemeral=True)
+        return
+    lines = [f"🔍 **Nalezeno pro `{dotaz}`:**"]
+    for result in results:
+        duration = f" · {int(result['duration']) // 60}:{int(result['duration']) % 60:02d}" if result["duration"] else ""
+        relative = os.path.relpath(result["path"], BASE_DOWNLOAD_DIR)
+        lines.append(f"• **{result['title']}**{duration} · {(result['size'] or 0) / 1024**2:.1f} MiB\n  `{relative}`")
+    if len(results) == LIBRARY_SEARCH_LIMIT:
+        lines.append(f"_Zobrazeno prvních {LIBRARY_SEARCH_LIMIT} výsledků, upřesni dotaz._")
+    await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
+
+@bot.tree.command(name='knihovna', description='Zobrazí obsazené místo v knihovně podle uživatelů.')
+@app_commands.describe(skenovat="Nejdřív porovnat knihovnu s obsahem složek")
+async def knihovna_command(interaction: discord.Interaction, skenovat: bool = False):
+    if not is_owner_or_designated_channel(interaction):
+        await interaction.response.send_message("Nemáš oprávnění použít tento příkaz.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    if skenovat:
+        await asyncio.to_thread(LIBRARY.reconcile)
+    usage = await asyncio.to_thread(STATE_STORE.library_usage)
+    lines = [
+        f"📚 **Knihovna:** {usage['files']} souborů, {usage['size'] / 1024**3:.2f} GiB "
+        f"(na disku {usage['unique'] / 1024**3:.2f} GiB bez sdílených hardlinků)"
+    ]
+    for user_name, files, size in usage["users"][:15]:
+        lines.append(f"• {user_name or '_mimo složky uživatelů_'}: {files} souborů, {size / 1024**3:.2f} GiB")
+    lines.append(f"💾 Volné místo: {await asyncio.to_thread(free_space, BASE_DOWNLOAD_DIR) / 1024**3:.1f} GiB")
+    if LIBRARY.last_scan:
+        lines.append(f"Poslední sken: {datetime.fromtimestamp(LIBRARY.last_scan).strftime('%d.%m. %H:%M')}")
+    await interaction.followup.send("\n".join(lines)[:2000], ephemeral=True)
+
 @bot.tree.command(name='check', description='Spustí okamžitou kontrolu nových skladeb v sledovaných playlistech.')
 async def check_command(interaction: discord.Interaction):
     if not is_owner_or_designated_channel(interaction):
@@ -872,8 +4068,47 @@ async def check_command(interaction: discord.Interaction):
 
     await interaction.response.defer()
     await interaction.followup.send("⏳ Spouštím kontrolu nových skladeb...", ephemeral=True)
-    await check_for_new_songs_async(manual_run=True)
-    await interaction.followup.send("✅ Kontrola dokončena.", ephemeral=True)
+    new_songs = await PLAYLIST_SCHEDULER.run_sweep()
+    await interaction.followup.send(f"✅ Kontrola dokončena. Nových skladeb: {new_songs}.", ephemeral=True)
+
+@bot.tree.command(name='interval', description='Nastaví interval automatické kontroly sledovaného playlistu.')
+@app_commands.describe(playlist_id="ID Spotify playlistu", hodiny="Interval kontroly v hodinách (0 = výchozí)")
+async def interval_command(interaction: discord.Interaction, playlist_id: str, hodiny: float):
+    if not is_owner_or_designated_channel(interaction):
+        await interaction.response.send_message("Nemáš oprávnění použít tento příkaz.", ephemeral=True)
+        return
+
+    check_interval = int(hodiny * 3600) if hodiny > 0 else None
+    if not await asyncio.to_thread(STATE_STORE.set_playlist_interval, playlist_id, check_interval):
+        await interaction.response.send_message(f"❌ Playlist `{playlist_id}` není sledován.", ephemeral=True)
+        return
+    await asyncio.to_thread(STATE_STORE.set_playlist_next_run, playlist_id, PlaylistScheduler.next_run_after_check({"check_interval": check_interval}))
+    PLAYLIST_SCHEDULER.wake()
+    label = f"{hodiny:g} h" if check_interval else f"výchozí ({PLAYLIST_CHECK_INTERVAL / 3600:g} h)"
+    await interaction.response.send_message(f"✅ Interval kontroly playlistu `{playlist_id}` nastaven na {label}.", ephemeral=True)
+
+@bot.tree.command(name='profile', description='Spustí vzorkovací profiler a pošle výsledek (jen vlastník).')
+@app_commands.describe(sekundy=f"Délka profilování v sekundách (1–{PROFILE_MAX_SECONDS})")
+async def profile_command(interaction: discord.Interaction, sekundy: int = 15):
+    if not is_owner(interaction):
+        await interaction.response.send_message("Nemáš oprávnění použít tento příkaz.", ephemeral=True)
+        return
+    if PROFILER.running:
+        await interaction.response.send_message("⏳ Profiler už běží, počkej na jeho výsledek.", ephemeral=True)
+        return
+
+    seconds = max(1, min(sekundy, PROFILE_MAX_SECONDS))
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    logging.info(f"🔬 Spouštím profiler na {seconds} s.")
+    stacks, samples = await asyncio.to_thread(PROFILER.run, seconds)
+
+    collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+    filename = f"profile-{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.txt"
+    lines = [f"🔬 **Profil za {seconds} s** ({samples} vzorků). Nejčastější funkce (vlastní čas):"]
+    for thread, function, count in SamplingProfiler.top_functions(stacks):
+        lines.append(f"`{count / max(1, samples):6.1%}` {thread}: `{function}`")
+    lines.append("Soubor je ve formátu collapsed stacks (flamegraph.pl, speedscope.app).")
+    await interaction.followup.send("\n".join(lines)[:2000], file=discord.File(io.BytesIO(collapsed.encode()), filename=filename), ephemeral=True)
 
 @bot.tree.command(name='silent', description='Přepíná "silent" mód, kdy bot neposílá potvrzovací zprávy.')
 async def silent_command(interaction: discord.Interaction):
@@ -894,6 +4129,7 @@ async def stop_command(interaction: discord.Interaction):
 
     await interaction.response.send_message("🛑 Zastavuji a restartuji bota...", ephemeral=True)
     await send_dm_to_owner("🛑 Bot byl restartován příkazem `/stop`.")
+    stop_logging()
     os.execv(sys.executable, ['python3'] + sys.argv) 
 
 @bot.tree.command(name='shutdown', description='Vypne bota bez restartu.')
@@ -915,8 +4151,8 @@ if __name__ == "__main__":
     ensure_folder(os.path.join(BASE_DOWNLOAD_DIR, AUDIO_DIR_NAME))
     ensure_folder(os.path.join(BASE_DOWNLOAD_DIR, VIDEO_DIR_NAME))
     
-    # Zajistíme existenci archivačního souboru
-    Path(DOWNLOAD_ARCHIVE_FILE).touch(exist_ok=True)
+    # Stavová databáze (archiv, sledované playlisty) a jednorázový převod původních souborů
+    STATE_STORE.migrate_legacy_files()
 
     if not DISCORD_BOT_TOKEN:
         logging.critical("❌ Chybí DISCORD_BOT_TOKEN v .env souboru. Bot nelze spustit.")
@@ -0,0 +1,54 @@
+"""
+Společné nastavení testů. Proměnné prostředí se nastaví před importem bot.py,
+aby stav, logy i stažené soubory skončily v dočasné složce, a ne vedle bota.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+import yt_dlp
+
+_TEST_ROOT = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ["OMV_BASE_DOWNLOAD_DIR"] = os.path.join(_TEST_ROOT, "downloads")
+os.environ["BOT_DATA_DIR"] = os.path.join(_TEST_ROOT, "data")
+os.environ["BOT_LOGS_DIR"] = os.path.join(_TEST_ROOT, "logs")
+os.environ["STAGING_DIR"] = ""
+os.environ["MIN_FREE_SPACE_GB"] = "0"
+os.environ["METRICS_PORT"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def state_store(tmp_path, monkeypatch):
+    """Čistá stavová databáze pro jeden test (i pro úložiště obsahu a knihovnu)."""
+    store = bot.StateStore(str(tmp_path / "state.db"))
+    monkeypatch.setattr(bot, "STATE_STORE", store)
+    monkeypatch.setattr(bot.CONTENT_STORE, "store", store)
+    monkeypatch.setattr(bot.LIBRARY, "store", store)
+    monkeypatch.setattr(bot.RESOLUTION_CACHE, "store", store)
+    return store
+
+
+@pytest.fixture
+def lane_gate(monkeypatch):
+    """Nová LaneGate – asyncio.Condition se váže na event loop prvního použití."""
+    gate = bot.LaneGate(bot.BULK_ITEMS_WHILE_INTERACTIVE)
+    monkeypatch.setattr(bot, "LANE_GATE", gate)
+    return gate
+
+
+@pytest.fixture
+def fake_extract(monkeypatch):
+    """Náhrada YoutubeDL.extract_info – vrací připravený výsledek (podle URL) místo síťové extrakce."""
+    results = {}
+
+    def extract_info(self, url, download=True, **kwargs):
+        return results[url]
+
+    monkeypatch.setattr(yt_dlp.YoutubeDL, "extract_info", extract_info)
+    monkeypatch.setattr(bot, "INFO_CACHE", bot.InfoCache(16, 60))
+    return results
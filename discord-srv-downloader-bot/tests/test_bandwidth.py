@@ -0,0 +1,75 @@
+import pytest
+
+import bot
+
+
+class FakeClock:
+    """Náhrada time.monotonic/time.sleep – spánek jen posune čas."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(bot.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(bot.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_max_min_share_splits_evenly_between_greedy_flows():
+    assert bot.max_min_share(3.0, {"a": 10.0, "b": 10.0, "c": 10.0}) == {"a": 1.0, "b": 1.0, "c": 1.0}
+
+
+def test_max_min_share_gives_small_demand_its_need():
+    shares = bot.max_min_share(4.0, {"a": 1.0, "b": 10.0, "c": 10.0})
+    assert shares == {"a": 1.0, "b": 1.5, "c": 1.5}
+
+
+def test_max_min_share_spreads_spare_capacity():
+    shares = bot.max_min_share(10.0, {"a": 1.0, "b": 2.0})
+    assert shares == {"a": 4.5, "b": 5.5}
+    assert sum(shares.values()) == pytest.approx(10.0)
+
+
+def test_max_min_share_without_flows():
+    assert bot.max_min_share(10.0, {}) == {}
+
+
+def test_token_bucket_holds_rate(clock):
+    bucket = bot.TokenBucket(lambda: 1000.0)
+    for _ in range(10):
+        bucket.consume(500, lambda: False)
+    # 5000 B při 1000 B/s; počáteční zásoba je prázdná
+    assert clock.slept == pytest.approx(5.0)
+
+
+def test_token_bucket_burst_is_capped(clock):
+    bucket = bot.TokenBucket(lambda: 1000.0)
+    clock.now += 60
+    # Po dlouhé nečinnosti smí projít jen BANDWIDTH_BURST_SECONDS zásoby, ne celá minuta
+    bucket.consume(int(1000 * bot.BANDWIDTH_BURST_SECONDS) + 1000, lambda: False)
+    assert clock.slept == pytest.approx(1.0)
+
+
+def test_token_bucket_follows_rate_changes(clock):
+    rates = iter([1000.0, 0])
+    bucket = bot.TokenBucket(lambda: next(rates))
+    # Po prvním spánku limit zmizí (0 = bez omezení) a stahování pokračuje hned
+    bucket.consume(10000, lambda: False)
+    assert clock.slept == pytest.approx(bot.TokenBucket.SLICE)
+
+
+def test_token_bucket_unlimited_and_cancelled(clock):
+    bot.TokenBucket(lambda: 0).consume(10**9, lambda: False)
+    bot.TokenBucket(lambda: 1000.0).consume(10**9, lambda: True)
+    assert clock.slept == 0
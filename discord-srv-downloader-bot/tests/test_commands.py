@@ -0,0 +1,60 @@
+import asyncio
+import types
+
+import pytest
+
+import bot
+
+
+class FakeResponse:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, content, ephemeral=False, **kwargs):
+        self.messages.append(content)
+
+
+def make_interaction(user_id: int):
+    return types.SimpleNamespace(user=types.SimpleNamespace(id=user_id, name=f"user{user_id}"), channel_id=1, response=FakeResponse())
+
+
+@pytest.fixture
+def queue(state_store, monkeypatch):
+    queue = bot.DownloadQueue(workers=1, limit=10, per_user_active=1, per_user_queued=5)
+    monkeypatch.setattr(bot, "JOB_QUEUE", queue)
+    monkeypatch.setattr(bot, "DISCORD_OWNER_ID", "42")
+    return queue
+
+
+def submit(queue, user_id: int) -> bot.DownloadJob:
+    job = bot.DownloadJob("generic", "https://example.com/v", user_id, f"user{user_id}", channel_id=1)
+    asyncio.run(queue.submit(job))
+    return job
+
+
+def test_dlstop_owner_can_stop_any_job(queue):
+    job = submit(queue, 7)
+    interaction = make_interaction(42)
+    asyncio.run(bot.dlstop_command.callback(interaction, job.job_id))
+    assert job.state == "cancelled"
+    assert "Pokus o zastavení" in interaction.response.messages[0]
+
+
+def test_dlstop_other_user_cannot_stop_foreign_job(queue):
+    job = submit(queue, 7)
+    interaction = make_interaction(8)
+    asyncio.run(bot.dlstop_command.callback(interaction, job.job_id))
+    assert job.state == "queued"
+    assert "nepatří" in interaction.response.messages[0]
+
+
+@pytest.mark.parametrize("owner_id", ["", "42"])
+def test_admin_commands_are_owner_only(monkeypatch, owner_id):
+    monkeypatch.setattr(bot, "DISCORD_OWNER_ID", owner_id)
+    monkeypatch.setattr(bot, "DISCORD_CHANNEL_ID", "99")
+    interaction = make_interaction(8)
+    interaction.command = types.SimpleNamespace(name="shutdown")
+    assert bot.is_owner_or_designated_channel(interaction) is False
+
+    interaction.user.id = 42
+    assert bot.is_owner_or_designated_channel(interaction) is bool(owner_id)
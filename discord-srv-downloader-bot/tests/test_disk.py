@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+import bot
+
+MiB = 1024 * 1024
+
+MERGED_INFO = {
+    "id": "merged",
+    "title": "Merged",
+    "duration": 600,
+    "requested_formats": [
+        {"format_id": "137", "vcodec": "avc1", "acodec": "none", "filesize": 300 * MiB},
+        # Zvuk bez velikosti – odhad z datového toku 128 kbit/s × 600 s
+        {"format_id": "140", "vcodec": "none", "acodec": "mp4a", "tbr": 128},
+    ],
+}
+
+
+def test_estimate_size_of_merged_formats():
+    assert bot.estimate_size(MERGED_INFO) == 300 * MiB + 128 * 125 * 600
+
+
+def test_estimate_size_of_playlist_and_unknown():
+    playlist = {"entries": [MERGED_INFO, None, {"id": "x", "filesize_approx": 5 * MiB}]}
+    assert bot.estimate_size(playlist) == bot.estimate_size(MERGED_INFO) + 5 * MiB
+    assert bot.estimate_size({"id": "unknown"}) == 0
+    assert bot.estimate_size(None) == 0
+
+
+def test_extracted_merged_info_keeps_estimate(fake_extract):
+    url = "https://www.youtube.com/watch?v=merged"
+    fake_extract[url] = dict(MERGED_INFO)
+    info = asyncio.run(bot.extract_info_cached(url, {}))
+    assert bot.estimate_size(info) == bot.estimate_size(MERGED_INFO)
+
+
+def test_admission_rejects_download_that_does_not_fit(state_store, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "free_space", lambda path: 200 * MiB)
+    monkeypatch.setattr(bot, "MIN_FREE_SPACE", 10 * MiB)
+
+    async def download(*args, **kwargs):
+        raise AssertionError("stahování nemělo začít")
+
+    monkeypatch.setattr(bot.YTDLP_EXECUTOR, "download", download)
+    with pytest.raises(ValueError, match="dochází místo"):
+        asyncio.run(bot.download_with_ytdlp("https://www.youtube.com/watch?v=merged", str(tmp_path), {}, None, info=MERGED_INFO))
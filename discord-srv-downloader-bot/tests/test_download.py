@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def fake_download(monkeypatch):
+    """Náhrada YTDLP_EXECUTOR.download s nastavitelným návratovým kódem a hlášenými soubory."""
+    result = {"retcode": 0, "files": [], "opts": None}
+
+    async def download(urls, opts, progress_hook, info=None, files=None):
+        result["opts"] = opts
+        files.extend(result["files"])
+        return result["retcode"]
+
+    monkeypatch.setattr(bot.YTDLP_EXECUTOR, "download", download)
+    return result
+
+
+def test_failed_download_raises(state_store, fake_download, tmp_path):
+    fake_download["retcode"] = 1
+    with pytest.raises(ValueError, match="kód 1"):
+        asyncio.run(bot.download_with_ytdlp("https://example.com/v", str(tmp_path), {}, None))
+
+
+def test_archived_item_without_stored_file_is_downloaded_again(state_store, fake_download, tmp_path):
+    archive = bot.SqliteDownloadArchive(state_store)
+    archive.add("youtube a")
+    output = tmp_path / "a.mp4"
+    output.write_bytes(b"a")
+    fake_download["files"] = [{"filepath": str(output), "media_key": "youtube a", "title": "A"}]
+    opts = {"download_archive": archive}
+
+    # Archiv yt-dlp nedostane, takže položku opravdu stáhne
+    assert asyncio.run(bot.download_with_ytdlp("https://example.com/a", str(tmp_path), opts, None, key="youtube a")) is False
+    assert "download_archive" not in fake_download["opts"]
+    assert state_store.library_find("youtube a", bot.ContentStore.variant(opts))
+
+
+def test_new_item_is_added_to_archive(state_store, fake_download, tmp_path):
+    archive = bot.SqliteDownloadArchive(state_store)
+    output = tmp_path / "b.mp4"
+    output.write_bytes(b"b")
+    fake_download["files"] = [{"filepath": str(output), "media_key": "youtube b", "title": "B"}]
+    asyncio.run(bot.download_with_ytdlp("https://example.com/b", str(tmp_path), {"download_archive": archive}, None))
+    assert "youtube b" in archive
+
+
+def test_download_without_files_raises(state_store, fake_download, tmp_path):
+    with pytest.raises(ValueError, match="žádný soubor"):
+        asyncio.run(bot.download_with_ytdlp("https://example.com/v", str(tmp_path), {}, None))
+
+
+def test_missing_output_file_raises(state_store, fake_download, tmp_path):
+    fake_download["files"] = [{"filepath": str(tmp_path / "neexistuje.mp4"), "media_key": None}]
+    with pytest.raises(ValueError, match="nebyl nalezen"):
+        asyncio.run(bot.download_with_ytdlp("https://example.com/v", str(tmp_path), {}, None))
+
+
+def test_successful_download_is_indexed(state_store, fake_download, tmp_path):
+    output = tmp_path / "video.mp4"
+    output.write_bytes(b"x" * 10)
+    fake_download["files"] = [{"filepath": str(output), "media_key": "generic video", "title": "Video"}]
+    assert asyncio.run(bot.download_with_ytdlp("https://example.com/v", str(tmp_path), {}, None)) is False
+    assert [entry["path"] for entry in state_store.library_find("generic video", bot.ContentStore.variant({}))] == [str(output)]
+
+
+def test_playlist_items_without_ytdlp_opts(state_store, fake_download, lane_gate):
+    entries = [{"id": "a", "url": "https://example.com/a", "title": "A"}]
+    summary = asyncio.run(bot.download_playlist_items(entries, None, None, "Playlist"))
+    assert summary["done"] == 1 and summary["failed"] == 0
+
+
+class FlakyMessage:
+    """Status zpráva, jejíž první úprava selže síťovou chybou."""
+
+    def __init__(self):
+        self.calls = 0
+        self.content = None
+
+    async def edit(self, content):
+        self.calls += 1
+        if self.calls == 1:
+            raise OSError("spojení přerušeno")
+        self.content = content
+
+
+def test_progress_reporter_survives_edit_errors():
+    async def scenario():
+        message = FlakyMessage()
+        reporter = bot.ProgressReporter(message, base_interval=0.01).start()
+        reporter.update("50 %")
+        await asyncio.sleep(0.01)
+        reporter.update("60 %")
+        for _ in range(100):
+            if message.content == "60 %":
+                break
+            await asyncio.sleep(0.01)
+        await reporter.stop()
+        return message
+
+    message = asyncio.run(scenario())
+    assert message.calls >= 2 and message.content == "60 %"
+
+
+def test_progress_reporter_stop_does_not_raise(monkeypatch):
+    async def broken_flush(self):
+        raise RuntimeError("neočekávaná chyba")
+
+    async def scenario():
+        reporter = bot.ProgressReporter(FlakyMessage(), base_interval=0.01)
+        # Smyčka chybu zachytí a pokračuje; stop() ji případně jen zaloguje
+        monkeypatch.setattr(bot.ProgressReporter, "_flush", broken_flush)
+        reporter.start()
+        await asyncio.sleep(0.05)
+        assert not reporter._task.done()
+        await reporter.stop()
+
+    asyncio.run(scenario())
+
+
+def test_playlist_item_with_failed_transcode_is_failed(state_store, fake_download, lane_gate, monkeypatch, tmp_path):
+    async def broken_transcode(item, transcode):
+        raise RuntimeError("ffmpeg selhal")
+
+    monkeypatch.setattr(bot.TRANSCODE_POOL, "transcode", broken_transcode)
+    output = tmp_path / "a.webm"
+    output.write_bytes(b"a")
+    fake_download["files"] = [{"filepath": str(output), "media_key": "youtube a", "title": "A"}]
+    # yt-dlp zapíše položku do archivu hned po stažení, ještě před převodem
+    state_store.archive_add("youtube a")
+
+    entries = [{"id": "a", "ie_key": "Youtube", "url": "https://example.com/a", "title": "A"}]
+    opts = {"outtmpl": str(tmp_path / "%(title)s.%(ext)s")}
+    summary = asyncio.run(bot.download_playlist_items(entries, opts, None, "Playlist", transcode=bot.AUDIO_TRANSCODE))
+
+    assert (summary["done"], summary["failed"], summary["failed_keys"]) == (0, 1, ["youtube a"])
+    # Další kontrola playlistu položku znovu stáhne a převede
+    assert not state_store.archive_contains("youtube a")
+    assert state_store.library_find("youtube a", bot.ContentStore.variant(opts, bot.AUDIO_TRANSCODE)) == []
@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+import bot
+
+
+def test_playlist_entries_survive_extraction(fake_extract):
+    url = "https://www.youtube.com/playlist?list=PL1"
+    fake_extract[url] = {
+        "_type": "playlist",
+        "id": "PL1",
+        "title": "Playlist",
+        "original_url": url,
+        "entries": [
+            {"_type": "url", "id": "a", "url": "https://www.youtube.com/watch?v=a", "title": "A", "ie_key": "Youtube"},
+            {"_type": "url", "id": "b", "url": "https://www.youtube.com/watch?v=b", "title": "B", "ie_key": "Youtube"},
+        ],
+        "__post_extractor": lambda: {},
+    }
+
+    info = asyncio.run(bot.extract_info_cached(url, {"extract_flat": "in_playlist"}))
+
+    assert [entry["id"] for entry in info["entries"]] == ["a", "b"]
+    assert info["original_url"] == url
+    # Interní klíče se odstraní a výsledek zůstane serializovatelný (režim "process", cache)
+    assert "__post_extractor" not in info
+    json.dumps(info)
+    # Druhý požadavek se obslouží z cache se stejnými položkami
+    assert asyncio.run(bot.extract_info_cached(url, {}))["entries"] == info["entries"]
+
+
+def test_requested_formats_survive_extraction(fake_extract):
+    url = "https://www.youtube.com/watch?v=a"
+    fake_extract[url] = {
+        "id": "a",
+        "title": "A",
+        "requested_formats": [{"format_id": "137", "filesize": 100}, {"format_id": "140", "filesize": 20}],
+    }
+
+    info = asyncio.run(bot.extract_info_cached(url, {}))
+
+    assert [fmt["format_id"] for fmt in info["requested_formats"]] == ["137", "140"]
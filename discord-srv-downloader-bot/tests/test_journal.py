@@ -0,0 +1,98 @@
+import asyncio
+
+import bot
+
+
+def make_job(user_id: int, kind: str = "youtube_playlist_audio") -> bot.DownloadJob:
+    return bot.DownloadJob(kind, f"https://example.com/{user_id}", user_id, f"user{user_id}", channel_id=7, as_audio=True)
+
+
+def new_queue() -> bot.DownloadQueue:
+    return bot.DownloadQueue(workers=1, limit=10, per_user_active=1, per_user_queued=5)
+
+
+def test_restore_unfinished_job_after_restart(state_store):
+    before = new_queue()
+    job = make_job(1)
+    asyncio.run(before.submit(job))
+    job.journal("running")
+    job.journal("planned", payload={"title": "Playlist", "entries": [{"id": "a"}, {"id": "b"}]})
+    job.journal("done", "youtube a")
+    job.journal("failed", "youtube b")
+
+    # Nový proces = nová fronta nad stejnou databází
+    restored = asyncio.run(new_queue().restore())
+
+    assert [r.job_id for r in restored] == [job.job_id]
+    again = restored[0]
+    assert again.restored
+    assert (again.kind, again.url, again.user_id, again.channel_id, again.as_audio) == (job.kind, job.url, 1, 7, True)
+    assert again.done_items == {"youtube a"}
+    assert again.plan["entries"] == [{"id": "a"}, {"id": "b"}]
+
+
+def test_restore_skips_finished_and_cancelled_jobs(state_store):
+    queue = new_queue()
+    done, cancelled, waiting = make_job(1), make_job(2), make_job(3)
+    for job in (done, cancelled, waiting):
+        asyncio.run(queue.submit(job))
+    done.journal("running")
+    done.journal("done")
+    asyncio.run(queue.cancel(cancelled))
+
+    assert [job.job_id for job in asyncio.run(new_queue().restore())] == [waiting.job_id]
+
+
+def test_restore_gives_up_after_max_restarts(state_store):
+    job = make_job(1)
+    asyncio.run(new_queue().submit(job))
+    for _ in range(bot.JOB_MAX_RESTARTS):
+        job.journal("running")
+
+    assert asyncio.run(new_queue().restore()) == []
+    # Úloha je označena jako neúspěšná a při dalším startu se už nezkouší
+    assert state_store.unfinished_jobs() == []
+
+
+def test_restore_runs_only_once(state_store):
+    asyncio.run(new_queue().submit(make_job(1)))
+    queue = new_queue()
+    assert len(asyncio.run(queue.restore())) == 1
+    assert asyncio.run(queue.restore()) == []
+    assert len(queue.pending) == 1
+
+
+def test_restored_job_skips_queue_wait(state_store, lane_gate, monkeypatch):
+    async def run_job(job):
+        pass
+
+    monkeypatch.setitem(bot.JOB_RUNNERS, "youtube_playlist_audio", run_job)
+    stages = []
+    monkeypatch.setattr(bot, "STAGE_OBSERVERS", [lambda stage, seconds: stages.append(stage)])
+
+    async def scenario():
+        queue = new_queue()
+        await queue.restore()
+        queue.start()
+        for _ in range(20):
+            await asyncio.sleep(0.005)
+        queue._dispatcher.cancel()
+        return queue
+
+    asyncio.run(new_queue().submit(make_job(1)))
+    queue = asyncio.run(scenario())
+    assert not queue.pending and not queue.running
+    # Doba, kdy bot neběžel, se do čekání ve frontě nezapočítá
+    assert "job" in stages and "queue_wait" not in stages
+
+
+def test_concurrent_submits_respect_limit(state_store):
+    async def scenario():
+        queue = bot.DownloadQueue(workers=1, limit=3, per_user_active=1, per_user_queued=5)
+        results = await asyncio.gather(*(queue.submit(make_job(user_id)) for user_id in range(5)), return_exceptions=True)
+        return queue, results
+
+    queue, results = asyncio.run(scenario())
+    # Zápis do žurnálu běží ve vlákně, limit ale platí i pro souběžně zařazované úlohy
+    assert len(queue.pending) == 3
+    assert sum(isinstance(result, ValueError) for result in results) == 2
@@ -0,0 +1,104 @@
+import os
+import time
+
+import pytest
+
+import bot
+
+# Pevný čas v minulosti – opakované "stárnutí" nezměněné složky její mtime nezmění
+PAST = int(time.time()) - 3600
+
+
+@pytest.fixture
+def library(state_store, tmp_path):
+    audio, video = tmp_path / "Zvuk", tmp_path / "Video"
+    (audio / "alice" / "Playlist").mkdir(parents=True)
+    (video / "bob").mkdir(parents=True)
+    (audio / "alice" / "Playlist" / "a.mp3").write_bytes(b"a" * 10)
+    (audio / "alice" / "Playlist" / "b.mp3.part").write_bytes(b"b")
+    (video / "bob" / "v.mp4").write_bytes(b"v" * 20)
+    age(tmp_path)
+    return bot.LibraryIndex(state_store, [str(audio), str(video)])
+
+
+def age(root):
+    """Posune mtime všech složek do minulosti (jako u složek, které se mezi skeny nezměnily)."""
+    for path, _, _ in os.walk(root):
+        os.utime(path, (PAST, PAST))
+
+
+def indexed(state_store) -> dict:
+    rows = state_store._conn().execute("SELECT path, user_name, size FROM library").fetchall()
+    return {os.path.basename(path): (user_name, size) for path, user_name, size in rows}
+
+
+def test_first_scan_indexes_files_with_owner(state_store, library):
+    stats = library.reconcile()
+    assert stats["added"] == 2
+    assert indexed(state_store) == {"a.mp3": ("alice", 10), "v.mp4": ("bob", 20)}
+
+
+def test_unchanged_directories_are_not_listed(state_store, library, monkeypatch):
+    library.reconcile()
+    listed = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(bot.os, "scandir", lambda path: listed.append(path) or real_scandir(path))
+    stats = library.reconcile()
+    assert stats["scanned"] == 0 and listed == []
+    # Všechny složky se ale stále prošly (stat), i vnořené
+    assert stats["dirs"] == 5
+
+
+def test_changes_in_nested_directory_are_found(state_store, library, tmp_path):
+    library.reconcile()
+    playlist = tmp_path / "Zvuk" / "alice" / "Playlist"
+    (playlist / "c.mp3").write_bytes(b"c" * 5)
+    (playlist / "a.mp3").unlink()
+    age(tmp_path)
+    os.utime(playlist)
+
+    stats = library.reconcile()
+    assert stats == {"dirs": 5, "scanned": 1, "added": 1, "removed": 1}
+    assert indexed(state_store) == {"c.mp3": ("alice", 5), "v.mp4": ("bob", 20)}
+
+
+def test_removed_directory_drops_its_tree(state_store, library, tmp_path):
+    library.reconcile()
+    (tmp_path / "Zvuk" / "alice" / "Playlist" / "a.mp3").unlink()
+    (tmp_path / "Zvuk" / "alice" / "Playlist" / "b.mp3.part").unlink()
+    (tmp_path / "Zvuk" / "alice" / "Playlist").rmdir()
+    (tmp_path / "Zvuk" / "alice").rmdir()
+    age(tmp_path)
+    os.utime(tmp_path / "Zvuk")
+
+    library.reconcile()
+    assert indexed(state_store) == {"v.mp4": ("bob", 20)}
+    assert state_store.library_dir_children(str(tmp_path / "Zvuk")) == []
+
+
+def test_recently_changed_directory_is_read_again(state_store, library, tmp_path):
+    library.reconcile()
+    folder = tmp_path / "Video" / "bob"
+    (folder / "w.mp4").write_bytes(b"w")
+    library.reconcile()
+    assert state_store.library_dir_mtime(str(folder)) == 0
+
+    # Další soubor ve stejném "tiku" mtime, jaký složka měla při skenu
+    mtime_ns = os.stat(folder).st_mtime_ns
+    (folder / "x.mp4").write_bytes(b"x")
+    os.utime(folder, ns=(mtime_ns, mtime_ns))
+    library.reconcile()
+    assert {"w.mp4", "x.mp4"} <= set(indexed(state_store))
+
+
+def test_search_and_usage_count_hardlinks_once(state_store, library, tmp_path):
+    library.reconcile()
+    os.link(tmp_path / "Video" / "bob" / "v.mp4", tmp_path / "Zvuk" / "alice" / "v.mp4")
+    os.utime(tmp_path / "Zvuk" / "alice", (time.time() - 60, time.time() - 60))
+    library.reconcile()
+
+    assert {r["user_name"] for r in library.search("v.mp4")} == {"alice", "bob"}
+    assert [r["user_name"] for r in library.search("ALICE v.mp4")] == ["alice"]
+    assert library.search("100%") == []
+    usage = state_store.library_usage()
+    assert (usage["files"], usage["size"], usage["unique"]) == (3, 50, 30)
@@ -0,0 +1,10 @@
+import asyncio
+
+import bot
+
+
+def test_metrics_use_prometheus_text_format():
+    bot.METRICS.inc("bot_jobs_total", kind="generic", state="done")
+    response = asyncio.run(bot.METRICS._handle(None))
+    assert response.headers["Content-Type"] == "text/plain; version=0.0.4; charset=utf-8"
+    assert 'bot_jobs_total{kind="generic",state="done"}' in response.text
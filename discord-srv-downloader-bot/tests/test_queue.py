@@ -0,0 +1,197 @@
+import asyncio
+
+import pytest
+
+import bot
+
+
+def make_job(user_id: int, kind: str = "test") -> bot.DownloadJob:
+    return bot.DownloadJob(kind, f"https://example.com/{user_id}", user_id, f"user{user_id}", channel_id=1)
+
+
+async def settle():
+    """Nechá doběhnout dispečera, rozběhnuté úlohy a zápisy do žurnálu (ve vláknech)."""
+    for _ in range(10):
+        await asyncio.sleep(0.005)
+
+
+@pytest.fixture
+def runner(monkeypatch, lane_gate):
+    """Běh úlohy trvá, dokud test neuvolní její událost (`release[job_id].set()`)."""
+    release = {}
+
+    async def run_job(job):
+        await release.setdefault(job.job_id, asyncio.Event()).wait()
+
+    for kind in ("test", "batch"):
+        monkeypatch.setitem(bot.JOB_RUNNERS, kind, run_job)
+    return release
+
+
+def finish(release: dict, job: bot.DownloadJob):
+    release.setdefault(job.job_id, asyncio.Event()).set()
+
+
+def test_submit_rejects_full_queue(state_store):
+    queue = bot.DownloadQueue(workers=1, limit=2, per_user_active=1, per_user_queued=5)
+    asyncio.run(queue.submit(make_job(1)))
+    asyncio.run(queue.submit(make_job(2)))
+    with pytest.raises(ValueError, match="plná"):
+        asyncio.run(queue.submit(make_job(3)))
+
+
+def test_submit_rejects_over_per_user_queued(state_store):
+    queue = bot.DownloadQueue(workers=1, limit=10, per_user_active=1, per_user_queued=2)
+    asyncio.run(queue.submit(make_job(1)))
+    asyncio.run(queue.submit(make_job(1)))
+    with pytest.raises(ValueError, match="čekajících"):
+        asyncio.run(queue.submit(make_job(1)))
+    # Ostatní uživatelé limit nesdílí
+    asyncio.run(queue.submit(make_job(2)))
+
+
+def test_submit_returns_lane_position(state_store):
+    queue = bot.DownloadQueue(workers=1, limit=10, per_user_active=1, per_user_queued=5)
+    assert asyncio.run(queue.submit(make_job(1, kind="batch"))) == 1
+    # Interaktivní úloha se zařadí před hromadnou
+    assert asyncio.run(queue.submit(make_job(2))) == 1
+    assert [job.lane for job in queue.ordered_pending()] == ["interactive", "bulk"]
+
+
+def test_workers_and_per_user_active_limit(state_store, runner):
+    async def scenario():
+        queue = bot.DownloadQueue(workers=2, limit=10, per_user_active=1, per_user_queued=5)
+        first, second, other = make_job(1), make_job(1), make_job(2)
+        for job in (first, second, other):
+            await queue.submit(job)
+        queue.start()
+        await settle()
+        assert set(queue.running) == {first.job_id, other.job_id}
+        assert list(queue.pending) == [second]
+
+        finish(runner, first)
+        await settle()
+        assert set(queue.running) == {second.job_id, other.job_id}
+        assert first.state == "done"
+
+        finish(runner, second)
+        finish(runner, other)
+        await settle()
+        assert not queue.running and not queue.pending
+        queue._dispatcher.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_interactive_job_gets_reserved_slot(state_store, runner):
+    async def scenario():
+        queue = bot.DownloadQueue(workers=2, limit=10, per_user_active=1, per_user_queued=5)
+        bulk, second_bulk = make_job(1, kind="batch"), make_job(2, kind="batch")
+        await queue.submit(bulk)
+        await queue.submit(second_bulk)
+        queue.start()
+        await settle()
+        # Hromadné úlohy obsadí nejvýše workers - 1 slotů
+        assert set(queue.running) == {bulk.job_id}
+        assert second_bulk in queue.pending
+
+        interactive = make_job(3)
+        await queue.submit(interactive)
+        await settle()
+        assert set(queue.running) == {bulk.job_id, interactive.job_id}
+
+        # Další interaktivní úloha už nad počet workerů nepoběží
+        waiting = make_job(4)
+        await queue.submit(waiting)
+        await settle()
+        assert waiting in queue.pending
+
+        finish(runner, interactive)
+        await settle()
+        assert set(queue.running) == {bulk.job_id, waiting.job_id}
+
+        for job in (bulk, second_bulk, waiting):
+            finish(runner, job)
+        await settle()
+        assert not queue.running and not queue.pending
+        queue._dispatcher.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_single_worker_runs_bulk_jobs(state_store, runner):
+    async def scenario():
+        queue = bot.DownloadQueue(workers=1, limit=10, per_user_active=1, per_user_queued=5)
+        bulk, interactive = make_job(1, kind="batch"), make_job(2)
+        await queue.submit(bulk)
+        queue.start()
+        await settle()
+        assert set(queue.running) == {bulk.job_id}
+
+        # S jediným workerem počká i interaktivní úloha
+        await queue.submit(interactive)
+        await settle()
+        assert interactive in queue.pending
+
+        finish(runner, bulk)
+        await settle()
+        assert set(queue.running) == {interactive.job_id}
+        finish(runner, interactive)
+        await settle()
+        queue._dispatcher.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_running_jobs_never_exceed_workers(state_store, runner):
+    async def scenario():
+        queue = bot.DownloadQueue(workers=3, limit=50, per_user_active=2, per_user_queued=10)
+        jobs = [make_job(user_id % 4, kind="batch" if user_id % 3 else "test") for user_id in range(24)]
+        for job in jobs[:12]:
+            await queue.submit(job)
+        queue.start()
+        most = 0
+        for step, job in enumerate(jobs[12:]):
+            await queue.submit(job)
+            await settle()
+            assert len(queue.running) <= queue.workers
+            assert sum(1 for running in queue.running.values() if running.lane == "bulk") <= queue.workers - 1
+            most = max(most, len(queue.running))
+            # Průběžně dokončuj nejstarší běžící úlohu
+            if step % 2:
+                finish(runner, next(iter(queue.running.values())))
+        while queue.running or queue.pending:
+            for job in list(queue.running.values()):
+                finish(runner, job)
+            await settle()
+            assert len(queue.running) <= queue.workers
+        assert most == queue.workers
+        assert all(job.state == "done" for job in jobs)
+        queue._dispatcher.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_pending_and_running(state_store, runner):
+    async def scenario():
+        queue = bot.DownloadQueue(workers=1, limit=10, per_user_active=1, per_user_queued=5)
+        running, pending = make_job(1), make_job(1)
+        await queue.submit(running)
+        await queue.submit(pending)
+        queue.start()
+        await settle()
+        assert running.job_id in queue.running
+
+        assert await queue.cancel(pending)
+        assert pending.state == "cancelled" and pending not in queue.pending
+
+        assert await queue.cancel(running)
+        await settle()
+        assert running.state == "cancelled"
+        assert not queue.running
+        assert not await queue.cancel(running)
+        queue._dispatcher.cancel()
+
+    asyncio.run(scenario())
+    # Obě zrušené úlohy jsou v žurnálu ukončené a po restartu se neobnoví
+    assert state_store.unfinished_jobs() == []
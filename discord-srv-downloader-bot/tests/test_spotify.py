@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from aiohttp import web
+
+import bot
+
+
+def test_search_resolution_uses_entries_and_cache(state_store, fake_extract):
+    fake_extract["ytsearch1:Song Artist"] = {
+        "_type": "playlist",
+        "id": "Song Artist",
+        "entries": [{"_type": "url", "id": "yt1", "url": "https://www.youtube.com/watch?v=yt1", "title": "Song (Official)", "ie_key": "Youtube"}],
+    }
+    fake_extract["ytsearch1:Missing Nobody"] = {"_type": "playlist", "id": "Missing Nobody", "entries": []}
+    tracks = [{"title": "Song", "artist": "Artist"}, {"title": "Missing", "artist": "Nobody"}]
+
+    found, missing = asyncio.run(bot.resolve_spotify_tracks(tracks))
+
+    assert found == {"id": "yt1", "ie_key": "Youtube", "url": "https://www.youtube.com/watch?v=yt1", "title": "Song (Official)"}
+    assert missing is None
+    assert bot.RESOLUTION_CACHE.get("Song", "Artist") == found
+
+    # Podruhé se skladba nevyhledává, výsledek je z cache
+    del fake_extract["ytsearch1:Song Artist"]
+    assert asyncio.run(bot.resolve_spotify_tracks(tracks[:1])) == [found]
+
+
+class SpotifyStandIn:
+    """Lokální náhrada Spotify Web API (token, skladba, stránkovaný playlist)."""
+
+    def __init__(self, tracks: int = 5):
+        self.base = None
+        self.tokens_issued = 0
+        self.valid_tokens = set()
+        self.throttle = 0
+        self.retry_after = "2"
+        self.tracks = [
+            {"id": f"t{i}", "name": f"Song {i}", "type": "track", "artists": [{"name": "Artist"}], "album": {"name": "Album", "images": []}}
+            for i in range(tracks)
+        ]
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/token", self.token)
+        app.router.add_get("/v1/tracks/{track_id}", self.track)
+        app.router.add_get("/v1/playlists/{playlist_id}/tracks", self.playlist_tracks)
+        return app
+
+    async def token(self, request):
+        form = await request.post()
+        assert form["grant_type"] == "client_credentials"
+        assert request.headers["Authorization"].startswith("Basic ")
+        self.tokens_issued += 1
+        token = f"token-{self.tokens_issued}"
+        self.valid_tokens.add(token)
+        return web.json_response({"access_token": token, "token_type": "Bearer", "expires_in": 3600})
+
+    def check(self, request):
+        if request.headers.get("Authorization", "").removeprefix("Bearer ") not in self.valid_tokens:
+            return web.json_response({"error": "invalid token"}, status=401)
+        if self.throttle:
+            self.throttle -= 1
+            return web.json_response({"error": "rate limited"}, status=429, headers={"Retry-After": self.retry_after})
+        return None
+
+    async def track(self, request):
+        rejected = self.check(request)
+        if rejected:
+            return rejected
+        return web.json_response(next(t for t in self.tracks if t["id"] == request.match_info["track_id"]))
+
+    async def playlist_tracks(self, request):
+        rejected = self.check(request)
+        if rejected:
+            return rejected
+        offset = int(request.query.get("offset", 0))
+        limit = int(request.query["limit"])
+        end = offset + limit
+        next_url = f"{self.base}/v1/playlists/{request.match_info['playlist_id']}/tracks?offset={end}&limit={limit}" if end < len(self.tracks) else None
+        return web.json_response({"items": [{"track": t} for t in self.tracks[offset:end]], "next": next_url})
+
+
+@pytest.fixture
+def spotify_server():
+    stand_in = SpotifyStandIn()
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(stand_in.app())
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    stand_in.base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield stand_in
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.run_until_complete(runner.cleanup())
+    loop.close()
+
+
+@pytest.fixture
+def client(spotify_server, monkeypatch):
+    # Čekání na Retry-After / backoff se jen zaznamená
+    sleeps = []
+    monkeypatch.setattr(bot.time, "sleep", sleeps.append)
+    client = bot.SpotifyClient("id", "secret", api_base=f"{spotify_server.base}/v1", token_url=f"{spotify_server.base}/api/token")
+    client.sleeps = sleeps
+    return client
+
+
+def test_token_is_cached_and_refreshed(spotify_server, client):
+    assert client.track("t1")["title"] == "Song 1"
+    assert client.track("t2")["title"] == "Song 2"
+    assert spotify_server.tokens_issued == 1
+
+    # Token krátce před vypršením se obnoví předem
+    client._cached_token = (client._cached_token[0], time.time() - 1)
+    client.track("t1")
+    assert spotify_server.tokens_issued == 2
+
+    # Token odmítnutý serverem (401) se zahodí a požadavek se zopakuje s novým
+    spotify_server.valid_tokens.clear()
+    assert client.track("t3")["title"] == "Song 3"
+    assert spotify_server.tokens_issued == 3
+
+
+def test_valid_token_does_not_wait_for_refresh(spotify_server, client):
+    client.track("t1")
+    result = []
+    # Zámek drží obnova tokenu čekající na Retry-After
+    with client._token_lock:
+        caller = threading.Thread(target=lambda: result.append(client.track("t2")["title"]))
+        caller.start()
+        caller.join(timeout=5)
+        assert result == ["Song 2"]
+
+    # Odmítnutý starý token nezahodí token, který mezitím získal jiný volající
+    old = client._cached_token[0]
+    client._cached_token = ("novy", time.time() + 3600)
+    client._invalidate_token(old)
+    assert client._cached_token[0] == "novy"
+
+
+def test_rate_limit_respects_retry_after(spotify_server, client):
+    spotify_server.throttle = 2
+    assert client.track("t0")["id"] == "t0"
+    assert client.sleeps == [2, 2]
+
+
+def test_rate_limit_over_cap_fails_fast(spotify_server, client):
+    spotify_server.throttle = 1
+    spotify_server.retry_after = str(bot.SPOTIFY_MAX_RETRY_AFTER + 1)
+    with pytest.raises(RuntimeError, match="omezilo"):
+        client.track("t0")
+    assert client.sleeps == []
+
+
+def test_playlist_pagination_follows_next(spotify_server, client):
+    pages = list(client.iter_playlist_tracks("pl", page_size=2))
+    assert [[track["id"] for track in page] for page in pages] == [["t0", "t1"], ["t2", "t3"], ["t4"]]